@@ -0,0 +1,18 @@
+'''Shared fixtures for the plan evaluation tests.
+'''
+
+#%% imports etc.
+from typing import Dict
+import pytest
+from plan_data import DvhFile, Plan
+from GUI.Testing.sample_data import DEFAULT_UNITS, StructureData, write_dvh
+
+
+@pytest.fixture
+def make_plan(tmp_path):
+    '''Return a function that writes a .dvh file and loads it as a Plan.'''
+    def make_plan(structures: Dict[str, StructureData],
+                  file_name: str = 'plan.dvh', **header)->Plan:
+        dvh_file = write_dvh(tmp_path / file_name, structures, **header)
+        return Plan(DEFAULT_UNITS, frozenset(), DvhFile(dvh_file))
+    return make_plan
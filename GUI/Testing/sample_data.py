@@ -0,0 +1,152 @@
+'''Sample plan and report definition files for the plan evaluation tests.
+
+Plans and report definitions are written to temporary files, so each test
+controls the structure names, DVH curves and report items it uses.
+'''
+
+#%% imports etc.
+from typing import Dict, List, Sequence, Tuple
+from pathlib import Path
+import xml.etree.ElementTree as ET
+from plan_report import ReportDefinition
+
+
+DEFAULT_UNITS = {'DoseUnit': 'cGy', 'VolumeUnit': 'cc', 'DistanceUnit': 'cm'}
+
+# (structure volume in cc, [(dose in cGy, volume), ...])
+StructureData = Tuple[float, Sequence[Tuple[float, float]]]
+
+
+#%% Plan Files
+def write_dvh(dvh_file: Path, structures: Dict[str, StructureData],
+              plan_name: str = 'LUNG', dose: float = 4800.0,
+              volume_unit: str = 'cm³')->Path:
+    '''Write a .dvh file in the exported text format.
+    Arguments:
+        dvh_file {Path} -- The file to write.
+        structures {Dict[str, StructureData]} -- The structure volume and
+            cumulative DVH curve, keyed by structure name.
+    Keyword Arguments:
+        plan_name {str} -- The plan name.  The fourth letter sets the plan
+            laterality. (default: {'LUNG'})
+        dose {float} -- The prescribed dose in cGy. (default: {4800.0})
+        volume_unit {str} -- The units of the DVH volume column, 'cm³' or
+            '%'. (default: {'cm³'})
+    Returns:
+        Path -- The written file.
+    '''
+    lines = ['Patient Name         : Test, Patient',
+             'Patient ID           : 0001',
+             'Date                 : Monday, January 06, 2020 10:00:00',
+             '',
+             'Plan: {}'.format(plan_name),
+             'Course: C1',
+             'Prescribed dose [cGy]: {}'.format(dose),
+             '']
+    for name, (volume, curve) in structures.items():
+        lines.extend(['Structure: {}'.format(name),
+                      'Volume [cm³]: {}'.format(volume),
+                      '',
+                      'Dose [cGy]    Structure Volume [{}]'.format(
+                          volume_unit)])
+        lines.extend('{} {}'.format(*point) for point in curve)
+        lines.append('')
+    dvh_file.write_text('\n'.join(lines) + '\n', encoding='utf_8')
+    return dvh_file
+
+
+#%% Report Definitions
+def report_item(name: str, reference: str = None, constructor: str = None,
+                expression: str = None, condition: str = None,
+                unit: str = None, cell: str = None,
+                interpolation: str = None)->str:
+    '''Return the XML text of a ReportItem.
+    Arguments:
+        name {str} -- The report item name.
+    Keyword Arguments:
+        reference {str} -- The XML text of the PlanReference contents.
+        constructor {str} -- The item Constructor.
+        expression {str} -- The item Expression.
+        condition {str} -- The XML text of the Condition contents.  The item
+            Category is set to Condition.
+        unit {str} -- The Target Unit.
+        cell {str} -- The Target CellAddress.  If None, no Target is given.
+        interpolation {str} -- The DVH Interpolation kernel.
+    Returns:
+        str -- The ReportItem element text.
+    '''
+    parts = ['<ReportItem name="{}">'.format(name)]
+    if condition is not None:
+        parts.append('<Category>Condition</Category>')
+        parts.append('<Condition>{}</Condition>'.format(condition))
+    if constructor:
+        parts.append('<Constructor>{}</Constructor>'.format(constructor))
+    if interpolation:
+        parts.append('<Interpolation>{}</Interpolation>'.format(
+            interpolation))
+    if expression:
+        parts.append('<Expression>{}</Expression>'.format(expression))
+    if reference is not None:
+        parts.append('<PlanReference>{}</PlanReference>'.format(reference))
+    if cell:
+        parts.append('<Target>')
+        if unit:
+            parts.append('<Unit>{}</Unit>'.format(unit))
+        parts.append('<CellAddress>{}</CellAddress>'.format(cell))
+        parts.append('</Target>')
+    parts.append('</ReportItem>')
+    return ''.join(parts)
+
+
+def structure_reference(name: str, laterality: str = None,
+                        aliases: List[str] = ())->str:
+    '''Return the XML text of a Structure PlanReference.'''
+    parts = ['<Type>Structure</Type><Name>{}</Name>'.format(name)]
+    if laterality:
+        parts.append('<Laterality>{}</Laterality>'.format(laterality))
+    if aliases:
+        parts.append('<Aliases>')
+        parts.extend('<Alias>{}</Alias>'.format(alias) for alias in aliases)
+        parts.append('</Aliases>')
+    return ''.join(parts)
+
+
+def report_xml(name: str, items: Sequence[str],
+               prescriptions: Sequence[Tuple[float, int]] = ())->str:
+    '''Return the XML text of a Report element.
+    Arguments:
+        name {str} -- The report name.
+        items {Sequence[str]} -- The ReportItem element texts.
+    Keyword Arguments:
+        prescriptions {Sequence[Tuple[float, int]]} -- (dose in cGy,
+            fractions) schedules. (default: {()})
+    Returns:
+        str -- The Report element text.
+    '''
+    schedules = ''.join('<Prescription Dose="{}" Fractions="{}"/>'.format(
+                            dose, fractions)
+                        for dose, fractions in prescriptions)
+    return ('<Report><Name>{name}</Name>'
+            '<Description>Test report</Description>'
+            '<Prescriptions>{schedules}</Prescriptions>'
+            '<FilePaths><Template><File>Template.xlsx</File>'
+            '<WorkSheet>Sheet1</WorkSheet></Template>'
+            '<Save><Path>.</Path><File>Report.xlsx</File>'
+            '<WorkSheet>Sheet1</WorkSheet></Save></FilePaths>'
+            '<ReportItemList>{items}</ReportItemList></Report>').format(
+                name=name, schedules=schedules, items=''.join(items))
+
+
+def write_reports(report_file: Path, *reports: str)->Path:
+    '''Write Report element texts to an XML report definition file.'''
+    report_file.write_text('<ReportDefinitions>{}</ReportDefinitions>'.format(
+        ''.join(reports)), encoding='utf_8')
+    return report_file
+
+
+def make_definition(name: str, items: Sequence[str],
+                    prescriptions: Sequence[Tuple[float, int]] = (),
+                    **parameters)->ReportDefinition:
+    '''Build a ReportDefinition from report item texts.'''
+    report_def = ET.fromstring(report_xml(name, items, prescriptions))
+    return ReportDefinition(report_def, **parameters)
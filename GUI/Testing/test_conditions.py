@@ -0,0 +1,177 @@
+'''Tests for report conditions and the selection of their limits by the
+number of fractions.
+'''
+
+#%% imports etc.
+import xml.etree.ElementTree as ET
+import pytest
+from plan_qa import PlanQa, PlanValues, plan_values
+from plan_report import Report, ReportDefinitionError
+from report_conditions import FAIL, NOT_EVALUATED, PASS, WARN
+from report_conditions import ConditionSet, Constraint, Tolerance
+from report_conditions import failed_conditions, load_constraint
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+
+# Volume must not exceed 10 cc (warn above 8 cc), or 12 cc for 8 fractions.
+VOLUME_CONDITION = ('<Item>Volume</Item><Comparator>le</Comparator>'
+                    '<Limit>10</Limit><Warning>8</Warning>'
+                    '<Tolerance Fractions="8"><Limit>12</Limit></Tolerance>')
+
+
+def condition_definition(prescriptions=()):
+    '''Return a report with a PTV Volume item and a condition on it.'''
+    return make_definition('Check', [
+        report_item('Volume', reference=structure_reference('PTV'),
+                    constructor='Volume', unit='cc', cell='A1'),
+        report_item('Volume Check', condition=VOLUME_CONDITION)],
+        prescriptions=prescriptions)
+
+
+def volume_constraint()->Constraint:
+    '''Return the compiled Volume condition.'''
+    return load_constraint(ET.fromstring(
+        '<Condition>{}</Condition>'.format(VOLUME_CONDITION)))
+
+
+#%% Condition Definitions
+def test_tolerance_is_selected_by_fractions():
+    '''Fractionations without their own entry use the default limits.'''
+    constraint = volume_constraint()
+    assert constraint.item == 'Volume'
+    assert constraint.comparator == '<='
+    assert constraint.tolerance() == Tolerance(10.0, 8.0)
+    assert constraint.tolerance(8) == Tolerance(12.0)
+    assert constraint.tolerance(5) == Tolerance(10.0, 8.0)
+
+
+@pytest.mark.parametrize('condition, message', [
+    ('<Comparator>lt</Comparator><Limit>1</Limit>', 'no Item'),
+    ('<Item>A</Item><Comparator>~</Comparator><Limit>1</Limit>',
+     'Unknown Condition Comparator'),
+    ('<Item>A</Item><Comparator>lt</Comparator>', 'no Limit'),
+    ('<Item>A</Item><Comparator>lt</Comparator><Warning>1</Warning>',
+     'Warning given without a Limit'),
+    ('<Item>A</Item><Comparator>lt</Comparator><Limit>1</Limit>'
+     '<Tolerance Fractions="5"/>', 'no Limit'),
+    ('<Item>A</Item><Comparator>lt</Comparator>'
+     '<Tolerance Fractions="5"><Limit>1</Limit></Tolerance>',
+     'no default Limit'),
+    ('<Item>A</Item><Comparator>lt</Comparator><Limit>low</Limit>',
+     'Invalid Condition Limit')])
+def test_invalid_conditions_are_rejected(condition, message):
+    '''Conditions need an Item, a known Comparator, a default Limit and a
+    Limit for each fractionation.'''
+    with pytest.raises(ValueError) as error:
+        load_constraint(ET.fromstring(
+            '<Condition>{}</Condition>'.format(condition)))
+    assert message in str(error.value)
+
+
+#%% Evaluation
+def test_batch_status_uses_the_fractions_of_each_plan():
+    '''Each row is compared with the limits for its own fractions.'''
+    condition_set = ConditionSet({'Volume Check': volume_constraint()})
+    value_rows = [{'Volume': 7.0}, {'Volume': 9.0}, {'Volume': 11.0},
+                  {'Volume': 11.0}, {'Volume': 'n/a'}, dict()]
+    status = condition_set.evaluate_batch(value_rows,
+                                          [None, None, None, 8, None, 8])
+    assert status[:, 0].tolist() == [PASS, WARN, FAIL, PASS,
+                                     NOT_EVALUATED, NOT_EVALUATED]
+    assert set(condition_set.limits) == {None, 8}
+
+
+def test_results_give_the_limits_applied():
+    '''The single plan results report the limits for the fractions used.'''
+    condition_set = ConditionSet({'Volume Check': volume_constraint()})
+    default = condition_set.evaluate({'Volume': 11.0})['Volume Check']
+    assert (default.status, default.limit, default.warning) == \
+        ('Fail', 10.0, 8.0)
+    eight = condition_set.evaluate({'Volume': 11.0}, 8)['Volume Check']
+    assert (eight.status, eight.limit, eight.warning) == ('Pass', 12.0, None)
+    warning = condition_set.evaluate({'Volume': 9.0})
+    assert failed_conditions(warning) == list()
+    assert failed_conditions(warning, include_warnings=True) == \
+        [warning['Volume Check']]
+
+
+#%% Report Conditions
+def test_conditions_may_only_check_other_items():
+    '''A condition on an unknown item or on another condition is a report
+    definition error.'''
+    unknown = ('<Item>Missing</Item><Comparator>lt</Comparator>'
+               '<Limit>1</Limit>')
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Unknown', [report_item('A', condition=unknown)])
+    assert error.value.problems == [
+        'A: Unknown report item Missing in Condition']
+    nested = '<Item>A</Item><Comparator>eq</Comparator><Limit>1</Limit>'
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Nested', [
+            report_item('A', condition=unknown.replace('Missing', 'B')),
+            report_item('B', expression='1'),
+            report_item('C', condition=nested)])
+    assert error.value.problems == ['C: Condition item A used in Condition']
+
+
+def test_conditions_without_default_limits_are_rejected():
+    '''A report with a condition that only has limits for some
+    fractionations is a report definition error.'''
+    fractions_only = ('<Item>Volume</Item><Comparator>le</Comparator>'
+                      '<Tolerance Fractions="8"><Limit>12</Limit>'
+                      '</Tolerance>')
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Fractions Only', [
+            report_item('Volume', reference=structure_reference('PTV'),
+                        constructor='Volume', unit='cc', cell='A1'),
+            report_item('Volume Check', condition=fractions_only)])
+    assert error.value.problems == [
+        'Volume Check: Condition has no default Limit']
+
+
+@pytest.mark.parametrize('prescriptions, fractions, status', [
+    ((), None, 'Fail'), ((), 8, 'Pass'),
+    ([(4800, 8)], None, 'Pass'), ([(4800, 8)], 4, 'Fail'),
+    ([(4800, 8), (6000, 30)], None, 'Fail')])
+def test_report_values_use_the_plan_fractions(make_plan, prescriptions,
+                                              fractions, status):
+    '''The report prescriptions give the fractions when they all agree and
+    the plan fractions are not known.'''
+    plan = make_plan({'PTV': (11.0, CURVE)})
+    report = Report(condition_definition(prescriptions))
+    report.match_elements(plan)
+    report.get_values(plan, fractions)
+    assert report.values['Volume'] == pytest.approx(11.0)
+    assert report.values['Volume Check'] == status
+    assert report.conditions['Volume Check'].status == status
+
+
+#%% Plan QA
+def test_plan_values_record_the_fractions_used(make_plan):
+    '''The values keep the fractions used to select the limits.'''
+    plan = make_plan({'PTV': (11.0, CURVE)})
+    reports = {'Check': Report(condition_definition([(4800, 8)]))}
+    (default,) = plan_values(plan, reports, 'plan.dvh')
+    assert default == PlanValues('plan.dvh', 'Check',
+                                 {'Volume': pytest.approx(11.0)}, 8)
+    (given,) = plan_values(plan, reports, 'plan.dvh', fractions=4)
+    assert given.fractions == 4
+
+
+def test_qa_rows_use_the_fractions_of_each_plan():
+    '''Plans without fractions use the batch fractions.'''
+    batch = [PlanValues('a.dvh', 'Check', {'Volume': 11.0}, 8),
+             PlanValues('b.dvh', 'Check', {'Volume': 11.0}),
+             PlanValues('c.dvh', 'Check', {'Volume': 9.0}, 5)]
+    qa_results = PlanQa()
+    qa_results.add_batch(condition_definition(), batch, fractions=4)
+    rows = [(row.plan_file, row.fractions, row.limit, row.status)
+            for row in qa_results.rows]
+    assert rows == [('a.dvh', 8, 12.0, 'Pass'), ('b.dvh', 4, 10.0, 'Fail'),
+                    ('c.dvh', 5, 10.0, 'Warn')]
+    assert qa_results.failing_plans() == ['b.dvh']
+    assert qa_results.failing_plans(include_warnings=True) == ['b.dvh',
+                                                               'c.dvh']
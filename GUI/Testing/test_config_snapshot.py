@@ -0,0 +1,82 @@
+'''Tests for the cached configuration snapshot.
+'''
+
+#%% imports etc.
+import os
+from pathlib import Path
+import pytest
+import build_plan_report
+from build_plan_report import ConfigSnapshot, load_config_snapshot
+
+
+CONFIG_FILE_NAME = 'PlanEvaluationConfig.xml'
+REPO_CONFIG = Path(__file__).resolve().parents[2] / CONFIG_FILE_NAME
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    '''Return a directory holding a copy of the configuration file, and
+    count the times the configuration is parsed.'''
+    config_file = tmp_path / CONFIG_FILE_NAME
+    config_file.write_bytes(REPO_CONFIG.read_bytes())
+    os.utime(str(config_file), ns=(10**18, 10**18))
+    monkeypatch.chdir(tmp_path)
+    compiled = list()
+    compile_config = build_plan_report.compile_config
+    def counted_compile(config, config_file=None):
+        compiled.append(config_file)
+        return compile_config(config, config_file)
+    monkeypatch.setattr(build_plan_report, 'compile_config', counted_compile)
+    return tmp_path, compiled
+
+
+#%% Snapshot Cache
+def test_unchanged_config_is_read_from_the_cache(config_dir):
+    '''The XML file is parsed once and the snapshot is cached beside it.'''
+    (base_path, compiled) = config_dir
+    snapshot = load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    assert isinstance(snapshot, ConfigSnapshot)
+    assert (base_path / 'PlanEvaluationConfig.pkl').exists()
+    assert load_config_snapshot(base_path, CONFIG_FILE_NAME) == snapshot
+    assert len(compiled) == 1
+
+
+def test_changed_config_files_are_parsed_again(config_dir):
+    '''A new modification time, or changed contents, rebuild the cache.'''
+    (base_path, compiled) = config_dir
+    config_file = base_path / CONFIG_FILE_NAME
+    snapshot = load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    os.utime(str(config_file), ns=(2 * 10**18, 2 * 10**18))
+    assert load_config_snapshot(base_path, CONFIG_FILE_NAME) == snapshot
+    assert len(compiled) == 2
+    config_text = config_file.read_text(encoding='utf-8')
+    config_file.write_text(config_text.replace(
+        '<VolumeUnit>%</VolumeUnit>', '<VolumeUnit>cc</VolumeUnit>'),
+                           encoding='utf-8')
+    changed = load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    assert len(compiled) == 3
+    assert changed.default_units['VolumeUnit'] == 'cc'
+    assert load_config_snapshot(base_path, CONFIG_FILE_NAME) == changed
+    assert len(compiled) == 3
+
+
+def test_cache_depends_on_the_working_directory(config_dir, monkeypatch):
+    '''Report directories are relative to the working directory, so a new
+    working directory rebuilds the snapshot.'''
+    (base_path, compiled) = config_dir
+    snapshot = load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    other_dir = base_path / 'Other'
+    other_dir.mkdir()
+    monkeypatch.chdir(other_dir)
+    moved = load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    assert len(compiled) == 2
+    assert moved.report_locations != snapshot.report_locations
+
+
+def test_damaged_cache_files_are_replaced(config_dir):
+    '''A cache file that can not be read is rebuilt.'''
+    (base_path, compiled) = config_dir
+    (base_path / 'PlanEvaluationConfig.pkl').write_bytes(b'short')
+    load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    load_config_snapshot(base_path, CONFIG_FILE_NAME)
+    assert len(compiled) == 1
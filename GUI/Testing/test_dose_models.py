@@ -0,0 +1,166 @@
+'''Tests for the radiobiological dose models.
+'''
+
+#%% imports etc.
+from pathlib import Path
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+from plan_data import PlanDescription, Structure
+from build_plan_report import compile_config, load_dvh, load_plan
+from dose_models import DoseModel, make_dose_grid, evaluate_models, eqd2
+from dose_models import apply_dose_models, evaluate_plans
+from GUI.Testing.sample_data import DEFAULT_UNITS, write_dvh
+
+
+# Every voxel of the structure receives between 4990 and 5000 cGy, which
+# is a single 10 cGy bin centred on 49.95 Gy.
+UNIFORM_DOSE = 49.95
+UNIFORM_CURVE = [(0.0, 100.0), (4990.0, 100.0), (5000.0, 0.0)]
+LUNG_CURVE = [(0.0, 100.0), (1000.0, 40.0), (2000.0, 10.0), (3000.0, 0.0)]
+
+
+def ntcp_model(structure: str, **parameters)->DoseModel:
+    '''Return an NTCP model with a 50% response at the uniform dose.'''
+    return DoseModel(structure, 'NTCP', volume_effect=0.5,
+                     d50=UNIFORM_DOSE, slope=0.2, **parameters)
+
+
+#%% Model Calculations
+def test_uniform_dose_gives_the_d50_response():
+    '''A uniform dose equal to D50 gives a gEUD of D50 and a 50% response
+    for both model types, whatever the volume effect.'''
+    dose_grid = make_dose_grid(5000.0)
+    volumes = np.interp(dose_grid, *zip(*UNIFORM_CURVE), right=0.0)
+    models = [ntcp_model('PTV'),
+              DoseModel('PTV', 'TCP', volume_effect=-0.1,
+                        d50=UNIFORM_DOSE, slope=2.0)]
+    results = evaluate_models(dose_grid, np.stack([volumes, volumes]),
+                              models)
+    assert results['gEUD'] == pytest.approx([UNIFORM_DOSE, UNIFORM_DOSE])
+    assert results['Probability'] == pytest.approx([0.5, 0.5])
+
+
+def test_evaluate_models_accepts_a_plan_axis():
+    '''Stacked plans are evaluated together.'''
+    dose_grid = make_dose_grid(5000.0)
+    uniform = np.interp(dose_grid, *zip(*UNIFORM_CURVE), right=0.0)
+    lung = np.interp(dose_grid, *zip(*LUNG_CURVE), right=0.0)
+    volumes = np.stack([uniform, lung])[:, np.newaxis, :]
+    results = evaluate_models(dose_grid, volumes, [ntcp_model('PTV')])
+    assert results['Probability'].shape == (2, 1)
+    assert results['Probability'][0, 0] == pytest.approx(0.5)
+    assert results['Probability'][1, 0] < 0.5
+
+
+def test_eqd2_conversion():
+    '''EQD2 = D(d + alpha/beta)/(2 + alpha/beta), with d the dose per
+    fraction.'''
+    dose = np.array([10.0, 4.0])
+    converted = eqd2(dose, [3.0], fractions=1)
+    assert converted[0] == pytest.approx([26.0, 5.6])
+    # Two fractions of 2 Gy are unchanged.
+    assert eqd2(dose[1:], [3.0], fractions=2)[0] == pytest.approx([4.0])
+
+
+def test_eqd2_without_fractions_or_alpha_beta():
+    '''The physical dose is used if the fractions or alpha/beta are not
+    known.'''
+    dose = np.array([10.0, 4.0])
+    assert eqd2(dose, [3.0])[0] == pytest.approx(dose)
+    assert eqd2(dose, [np.nan], fractions=1)[0] == pytest.approx(dose)
+
+
+#%% Plan Level Methods
+def test_apply_dose_models_stores_structure_properties(make_plan):
+    '''The response is stored in % and the gEUD in cGy.'''
+    plan = make_plan({'PTV': (10.0, UNIFORM_CURVE)}, volume_unit='%')
+    updated = apply_dose_models(plan, [ntcp_model('PTV')])
+    assert set(updated) == {'PTV'}
+    structure = plan.get_data_element('Structure', 'PTV')
+    assert structure.get_value('NTCP', target_units='%') == \
+        pytest.approx(50.0)
+    assert structure.get_value('NTCP gEUD', target_units='cGy') == \
+        pytest.approx(100*UNIFORM_DOSE)
+
+
+def test_each_model_type_keeps_its_own_geud(make_plan):
+    '''NTCP and TCP models on one structure store the gEUD for their own
+    volume effect.'''
+    plan = make_plan({'Lung': (500.0, LUNG_CURVE)}, volume_unit='%')
+    models = [DoseModel('Lung', 'NTCP', volume_effect=1.0, d50=24.5,
+                        slope=0.18),
+              DoseModel('Lung', 'TCP', volume_effect=-0.1, d50=24.5,
+                        slope=2.0)]
+    apply_dose_models(plan, models)
+    dose_grid = make_dose_grid(3000.0)
+    volumes = np.interp(dose_grid, *zip(*LUNG_CURVE), right=0.0)
+    results = evaluate_models(dose_grid, np.stack([volumes, volumes]),
+                              models)
+    structure = plan.get_data_element('Structure', 'Lung')
+    geud = [structure.get_value(name, target_units='Gy')
+            for name in ('NTCP gEUD', 'TCP gEUD')]
+    assert geud == pytest.approx(list(results['gEUD']))
+    assert geud[0] > geud[1]
+
+
+def test_structures_without_a_dvh_are_skipped(make_plan):
+    '''Models for missing structures, or structures without a DVH, do not
+    prevent the other models from being evaluated.'''
+    plan = make_plan({'PTV': (10.0, UNIFORM_CURVE)}, volume_unit='%')
+    plan.add_data_item('Structure', Structure('Empty', dict(), None))
+    models = [ntcp_model('Empty'), ntcp_model('Missing'), ntcp_model('PTV')]
+    updated = apply_dose_models(plan, models)
+    assert set(updated) == {'PTV'}
+
+
+def test_evaluate_plans_gives_nan_for_missing_structures(make_plan):
+    '''Structures missing from one plan do not affect the other plans.'''
+    first = make_plan({'PTV': (10.0, UNIFORM_CURVE)}, file_name='a.dvh',
+                      volume_unit='%')
+    second = make_plan({'Lung': (500.0, LUNG_CURVE)}, file_name='b.dvh',
+                       volume_unit='%')
+    results = evaluate_plans([first, second], [ntcp_model('PTV')])
+    assert results['Probability'][0, 0] == pytest.approx(0.5)
+    assert np.isnan(results['Probability'][1, 0])
+
+
+def test_load_dvh_uses_the_plan_fractions(tmp_path):
+    '''The plan description's number of fractions sets the EQD2
+    conversion.'''
+    dvh_file = write_dvh(tmp_path / 'plan.dvh',
+                         {'PTV': (10.0, UNIFORM_CURVE)}, volume_unit='%')
+    models = [ntcp_model('PTV', alpha_beta=3.0)]
+    geud = dict()
+    for fractions in (None, 5):
+        plan_desc = PlanDescription(dvh_file, 'DVH', 'Test, Patient', '0001',
+                                    'LUNG', fractions=fractions)
+        plan = load_dvh(plan_desc, models, default_units=DEFAULT_UNITS,
+                        laterality_exceptions=frozenset())
+        structure = plan.get_data_element('Structure', 'PTV')
+        geud[fractions] = structure.get_value('NTCP gEUD', target_units='Gy')
+    assert geud[None] == pytest.approx(UNIFORM_DOSE)
+    dose_per_fraction = UNIFORM_DOSE / 5
+    assert geud[5] == pytest.approx(
+        UNIFORM_DOSE * (dose_per_fraction + 3.0) / 5.0)
+
+
+def test_load_plan_uses_the_given_fractions(tmp_path):
+    '''load_plan gives the same model values as load_dvh.'''
+    dvh_file = write_dvh(tmp_path / 'plan.dvh',
+                         {'PTV': (10.0, UNIFORM_CURVE)}, volume_unit='%')
+    models = [ntcp_model('PTV', alpha_beta=3.0)]
+    config_file = Path(__file__).resolve().parents[2] / \
+        'PlanEvaluationConfig.xml'
+    settings = compile_config(ET.parse(str(config_file)).getroot())
+    settings = settings._replace(default_units=DEFAULT_UNITS,
+                                 dose_models=models, conformity=None)
+    plan_desc = PlanDescription(dvh_file, 'DVH', 'Test, Patient', '0001',
+                                'LUNG', fractions=5)
+    expected = load_dvh(plan_desc, models, default_units=DEFAULT_UNITS,
+                        laterality_exceptions=frozenset())
+    plan = load_plan(settings, dvh_file, fractions=5)
+    for loaded in (plan, expected):
+        structure = loaded.get_data_element('Structure', 'PTV')
+        assert structure.get_value('NTCP gEUD', target_units='Gy') == \
+            pytest.approx(UNIFORM_DOSE * (UNIFORM_DOSE / 5 + 3.0) / 5.0)
@@ -0,0 +1,149 @@
+'''Tests for the population DVH statistics.
+'''
+
+#%% imports etc.
+import numpy as np
+import pytest
+from dvh_population import DvhShapeIndex, QuantileSketch, PopulationDvh
+from dvh_population import iterate_plans
+from dvh_population import population_bands
+from GUI.Testing.sample_data import DEFAULT_UNITS, write_dvh
+
+
+DOSE_GRID = np.array([0.0, 50.0, 100.0])  # % of the 4800 cGy prescription
+LUNG_VOLUME = 500.0
+# Lung volume in % for three plans; 10%, 20% and 30% at the prescription.
+LUNG_CURVES = [[(0.0, 100.0), (2400.0, 40.0 + 10*index),
+                (4800.0, 10.0 + 10*index), (6000.0, 0.0)]
+               for index in range(3)]
+
+
+def in_cc(volume, curve):
+    '''Convert a % volume DVH curve to cc.'''
+    return [(dose, volume * percent / 100.0) for dose, percent in curve]
+
+
+#%% Quantile Sketch
+def test_sketch_quantiles_are_within_the_resolution():
+    '''Each bin reports the quantiles of the values added to it.'''
+    sketch = QuantileSketch(2, resolution=1.0)
+    values = np.stack([np.arange(1.0, 101.0), np.full(100, 42.0)], axis=1)
+    sketch.add(values)
+    assert sketch.total == 100
+    quantiles = sketch.quantiles([0.05, 0.5, 0.95])
+    assert quantiles[:, 0] == pytest.approx([5.0, 50.0, 95.0], abs=1.0)
+    assert quantiles[:, 1] == pytest.approx([42.0, 42.0, 42.0], abs=0.5)
+
+
+def test_sketch_ignores_nan_and_clips_the_range():
+    '''NaN values are not counted and out of range values are counted in
+    the end levels.'''
+    sketch = QuantileSketch(3, resolution=1.0)
+    sketch.add([np.nan, -5.0, 150.0])
+    quantiles = sketch.quantiles([0.5])[0]
+    assert np.isnan(quantiles[0])
+    assert quantiles[1] == pytest.approx(0.5)
+    assert quantiles[2] == pytest.approx(100.0)
+
+
+#%% Population DVH
+@pytest.mark.parametrize('volume_unit', ['%', 'cm³'])
+def test_population_bands_are_in_percent_volume(make_plan, volume_unit):
+    '''cc and % volume DVHs give the same population bands.'''
+    population = PopulationDvh(DOSE_GRID, resolution=0.1)
+    for index, curve in enumerate(LUNG_CURVES):
+        if volume_unit != '%':
+            curve = in_cc(LUNG_VOLUME, curve)
+        plan = make_plan({'Lung': (LUNG_VOLUME, curve)},
+                         file_name='plan{}.dvh'.format(index),
+                         volume_unit=volume_unit)
+        population.add_plan(plan)
+    assert population.plan_count == 3
+    bands = population.bands([0, 50, 100])['Lung']
+    assert bands.shape == (3, len(DOSE_GRID))
+    assert bands[:, 0] == pytest.approx([100.0, 100.0, 100.0], abs=0.1)
+    assert bands[:, 1] == pytest.approx([40.0, 50.0, 60.0], abs=0.1)
+    assert bands[:, 2] == pytest.approx([10.0, 20.0, 30.0], abs=0.1)
+
+
+def test_population_name_map_and_selection(make_plan):
+    '''Plan structure names are mapped before selection.'''
+    population = PopulationDvh(DOSE_GRID, name_map={'Lung_L': 'Lung'})
+    plan = make_plan({'Lung_L': (LUNG_VOLUME, LUNG_CURVES[0]),
+                      'Cord': (20.0, LUNG_CURVES[1])}, volume_unit='%')
+    population.add_plan(plan, structure_names=['Lung'])
+    assert set(population.bands()) == {'Lung'}
+
+
+#%% DVH Shape Index
+def index_plans(make_plan, plan_names):
+    '''Index one Lung DVH from each of LUNG_CURVES.'''
+    shape_index = DvhShapeIndex(DOSE_GRID)
+    for index, (curve, plan_name) in enumerate(zip(LUNG_CURVES,
+                                                   plan_names)):
+        plan = make_plan({'Lung': (LUNG_VOLUME, curve)},
+                         file_name='plan{}.dvh'.format(index),
+                         plan_name=plan_name, volume_unit='%')
+        shape_index.add_plan(plan, 'plan{}'.format(index))
+    return shape_index
+
+
+def test_shape_index_returns_the_closest_dvhs(make_plan):
+    '''Neighbours are sorted by the RMS volume difference.'''
+    shape_index = index_plans(make_plan, ['LUNG'] * 3)
+    features = [100.0, 52.0, 22.0]
+    neighbours = shape_index.query(features, 'Lung', k=2)
+    assert [entry.plan_id for entry, _ in neighbours] == ['plan1', 'plan2']
+    assert neighbours[0][1] == pytest.approx(np.sqrt(8.0 / 3))
+    assert shape_index.query(features, 'Heart') == list()
+
+
+def test_shape_index_partitions(make_plan, tmp_path):
+    '''Partitioned queries only compare plans with the same body region
+    and prescription, and the partitions are kept when saved.'''
+    shape_index = index_plans(make_plan, ['LUNG', 'LUNG', 'BRAI'])
+    plan = make_plan({'Lung': (LUNG_VOLUME, LUNG_CURVES[2])},
+                     file_name='query.dvh', volume_unit='%')
+    (region, prescription) = shape_index.plan_keys(plan)
+    assert prescription == pytest.approx(4800.0)
+    neighbours = shape_index.query_plan(plan, k=3)['Lung']
+    assert [entry.plan_id for entry, _ in neighbours] == ['plan1', 'plan0']
+    assert all(entry.body_region == region for entry, _ in neighbours)
+    index_file = tmp_path / 'index.npz'
+    shape_index.save(index_file)
+    loaded = DvhShapeIndex.load(index_file)
+    assert loaded.query_plan(plan, k=3) == shape_index.query_plan(plan, k=3)
+    everything = loaded.query_plan(plan, k=3, partition=False)['Lung']
+    assert len(everything) == 3
+
+
+def test_shape_index_partitions_by_laterality(make_plan):
+    '''Left and right plans of one body region are kept in separate
+    partitions.'''
+    shape_index = index_plans(make_plan, ['LUNL', 'LUNR', 'LUNR'])
+    plan = make_plan({'Lung': (LUNG_VOLUME, LUNG_CURVES[2])},
+                     file_name='query.dvh', plan_name='LUNL',
+                     volume_unit='%')
+    assert shape_index.plan_keys(plan)[0] == 'LUNL'
+    assert plan.get_laterality(frozenset()) == 'Left'
+    neighbours = shape_index.query_plan(plan, k=3)['Lung']
+    assert [entry.plan_id for entry, _ in neighbours] == ['plan0']
+
+
+#%% Archive Methods
+def test_archive_bands_skip_unreadable_plans(tmp_path):
+    '''Files that fail to load are skipped.'''
+    for index, curve in enumerate(LUNG_CURVES):
+        write_dvh(tmp_path / 'plan{}.dvh'.format(index),
+                  {'Lung': (LUNG_VOLUME, curve)}, volume_unit='%')
+    # A DVH row that is not a number.
+    write_dvh(tmp_path / 'broken.dvh',
+              {'Lung': (LUNG_VOLUME, [('n/a', '')])})
+    plan_parameters = dict(default_units=DEFAULT_UNITS,
+                           laterality_exceptions=frozenset())
+    plans = list(iterate_plans(sorted(tmp_path.glob('*.dvh')),
+                               **plan_parameters))
+    assert len(plans) == 3
+    bands = population_bands(tmp_path, DOSE_GRID, percentiles=[50],
+                             **plan_parameters)
+    assert bands['Lung'][0] == pytest.approx([100.0, 50.0, 20.0], abs=0.1)
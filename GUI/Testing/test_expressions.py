@@ -0,0 +1,117 @@
+'''Tests for report item expressions and their evaluation order.
+'''
+
+#%% imports etc.
+from pickle import dumps, loads
+import pytest
+from plan_report import ItemExpression, Report, ReportDefinitionError
+from plan_report import ReportElement
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+
+
+def volume_item(name: str, structure: str = 'PTV', cell: str = None)->str:
+    '''Return a Volume report item for a structure.'''
+    return report_item(name, reference=structure_reference(structure),
+                       constructor='Volume', unit='cc', cell=cell)
+
+
+#%% Expressions
+def test_dependencies_include_braced_item_names():
+    '''Names that are not identifiers are written in braces.'''
+    expression = ItemExpression('100 * {V105- PTV} / PTV_Volume')
+    assert set(expression.dependencies) == {'V105- PTV', 'PTV_Volume'}
+    assert expression.evaluate({'V105- PTV': 2.0,
+                                'PTV_Volume': 40.0}) == pytest.approx(5.0)
+
+
+def test_functions_and_comparisons():
+    '''The allowed functions, comparisons and conditional expressions.'''
+    expression = ItemExpression('round(max(a, b), 1) if a < 10 else abs(b)')
+    assert set(expression.dependencies) == {'a', 'b'}
+    assert expression.evaluate({'a': 2, 'b': 3.14}) == pytest.approx(3.1)
+    assert expression.evaluate({'a': 20, 'b': -3}) == 3
+
+
+def test_missing_values_and_errors_give_none():
+    '''An expression is None if a value is missing or the calculation
+    fails.'''
+    expression = ItemExpression('a / b')
+    assert expression.evaluate({'a': 1.0, 'b': None}) is None
+    assert expression.evaluate({'a': 1.0}) is None
+    assert expression.evaluate({'a': 1.0, 'b': 0.0}) is None
+
+
+@pytest.mark.parametrize('text', ['a.__class__', '__import__("os")',
+                                  'open("file")', '[a, b]', 'lambda: a',
+                                  'a +'])
+def test_unsafe_or_invalid_expressions(text):
+    '''Only arithmetic, comparisons and the allowed functions are
+    accepted.'''
+    with pytest.raises(ValueError):
+        ItemExpression(text)
+
+
+def test_expressions_can_be_pickled_after_use():
+    '''The compiled code is left out of the pickled expression.'''
+    expression = ItemExpression('a + 1')
+    assert expression.evaluate({'a': 1}) == 2
+    copied = loads(dumps(expression))
+    assert copied.evaluate({'a': 2}) == 3
+
+
+#%% Evaluation Order
+def test_items_follow_the_items_they_use():
+    '''Expressions are evaluated after their dependencies, otherwise the
+    definition order is kept.'''
+    definition = make_definition('Order', [
+        report_item('Ratio', expression='Half / Volume'),
+        report_item('Half', expression='Volume / 2'),
+        volume_item('Volume'),
+        volume_item('Other', 'Cord')])
+    assert definition.evaluation_order == ['Volume', 'Half', 'Ratio',
+                                           'Other']
+
+
+def test_circular_references_are_rejected():
+    '''Items using each other in a loop give a report definition error.'''
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Loop', [report_item('A', expression='B + 1'),
+                                 report_item('B', expression='C + 1'),
+                                 report_item('C', expression='A + 1')])
+    assert 'Circular item references' in str(error.value)
+    assert error.value.report_name == 'Loop'
+
+
+def test_unknown_items_are_rejected():
+    '''Expressions may only use items in the same report.'''
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Unknown', [report_item('A', expression='B + 1')])
+    assert error.value.problems == ['A: Unknown report item B in Expression']
+
+
+#%% Report Values
+def test_report_values_use_the_evaluation_order(make_plan, monkeypatch):
+    '''Expressions use the plan values, and items asking for the same plan
+    value share one lookup.'''
+    lookups = list()
+    get_value = ReportElement.get_value
+    def counted_get_value(self, reference, conversion):
+        lookups.append(self.name)
+        return get_value(self, reference, conversion)
+    monkeypatch.setattr(ReportElement, 'get_value', counted_get_value)
+    definition = make_definition('Values', [
+        report_item('Percent', expression='100 * {Cord Volume} / Volume'),
+        volume_item('Volume', cell='A1'),
+        volume_item('Same Volume', cell='A2'),
+        volume_item('Cord Volume', 'Cord', cell='A3')])
+    plan = make_plan({'PTV': (40.0, CURVE), 'Cord': (10.0, CURVE)})
+    report = Report(definition)
+    report.match_elements(plan)
+    report.get_values(plan)
+    assert report.values['Percent'] == pytest.approx(25.0)
+    assert report.values['Same Volume'] == pytest.approx(40.0)
+    assert sorted(lookups) == ['Cord Volume', 'Volume']
@@ -0,0 +1,103 @@
+'''Tests for the DVH interpolation kernels.
+'''
+
+#%% imports etc.
+import math
+import pytest
+from plan_data import DVH, INTERPOLATION_KERNELS, parse_constructor
+from plan_report import Report
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+COLUMNS = [{'Data Type': 'Dose', 'Unit': 'cGy'},
+           {'Data Type': 'Volume', 'Unit': '%'}]
+# Volume falls exponentially with dose: V(d) = 100·exp(-d/1000).
+CURVE = [(dose, 100.0 * math.exp(-dose / 1000.0))
+         for dose in (0.0, 1000.0, 2000.0, 3000.0)]
+DOSE, VOLUME = 0, 1
+
+
+def make_dvh()->DVH:
+    '''Return a DVH sampled from the exponential curve.'''
+    return DVH(COLUMNS, CURVE)
+
+
+def dvh_point(dvh: DVH, constructor: str, kernel: str)->float:
+    '''Return the value of a DVH point constructor.'''
+    return dvh.get_value(parse_constructor(constructor), kernel).element_value
+
+
+#%% Kernels
+def test_linear_kernel_interpolates_between_points():
+    '''The linear kernel gives the mean of the neighbouring points.'''
+    expected = (CURVE[1][VOLUME] + CURVE[2][VOLUME]) / 2
+    assert dvh_point(make_dvh(), 'V1500cGy', 'linear') == \
+        pytest.approx(expected)
+
+
+def test_log_kernel_follows_exponential_volume():
+    '''Volume is interpolated on a log scale.'''
+    assert dvh_point(make_dvh(), 'V1500cGy', 'log') == \
+        pytest.approx(100.0 * math.exp(-1.5))
+
+
+def test_log_kernel_for_dose_at_volume():
+    '''For dose points the volume axis is used on a log scale.'''
+    assert dvh_point(make_dvh(), 'D30%', 'log') == \
+        pytest.approx(-1000.0 * math.log(0.3))
+
+
+def test_pchip_kernel_is_monotone():
+    '''PCHIP passes through the data and stays between neighbouring
+    points.'''
+    dvh = make_dvh()
+    function = dvh.interpolator(DOSE, VOLUME, 'pchip')
+    for dose, volume in CURVE:
+        assert float(function(dose)) == pytest.approx(volume)
+    value = dvh_point(dvh, 'V1500cGy', 'pchip')
+    assert CURVE[2][VOLUME] < value < CURVE[1][VOLUME]
+    assert value != pytest.approx(dvh_point(dvh, 'V1500cGy', 'linear'))
+
+
+@pytest.mark.parametrize('kernel', INTERPOLATION_KERNELS)
+def test_points_outside_the_curve_are_not_interpolated(kernel):
+    '''Points outside the range of the curve give no value.'''
+    assert dvh_point(make_dvh(), 'V4000cGy', kernel) is None
+
+
+#%% Interpolator Cache
+def test_interpolators_are_cached_per_kernel():
+    '''The same function is returned for repeated requests.'''
+    dvh = make_dvh()
+    linear = dvh.interpolator(DOSE, VOLUME, 'linear')
+    assert dvh.interpolator(DOSE, VOLUME, 'linear') is linear
+    assert dvh.interpolator(DOSE, VOLUME, 'log') is not linear
+    assert dvh.interpolator(VOLUME, DOSE, 'linear') is not linear
+
+
+def test_unknown_kernel():
+    '''Unknown kernel names raise a ValueError.'''
+    with pytest.raises(ValueError):
+        make_dvh().interpolator(DOSE, VOLUME, 'cubic')
+
+
+#%% Report Items
+def test_report_items_use_their_interpolation_kernel(make_plan):
+    '''Items differing only by kernel get separate values.'''
+    lung = structure_reference('Lung')
+    definition = make_definition('Lung', [
+        report_item(name, reference=lung, constructor='V1500cGy', unit='%',
+                    cell=cell, interpolation=kernel)
+        for name, kernel, cell in (('linear', None, 'A1'),
+                                   ('log', 'log', 'A2'),
+                                   ('unknown', 'cubic', 'A3'))])
+    plan = make_plan({'Lung': (500.0, CURVE)}, volume_unit='%')
+    report = Report(definition)
+    report.match_elements(plan)
+    report.get_values(plan)
+    linear = (CURVE[1][VOLUME] + CURVE[2][VOLUME]) / 2
+    assert report.values['linear'] == pytest.approx(linear)
+    assert report.values['log'] == pytest.approx(100.0 * math.exp(-1.5))
+    # Unknown kernels fall back to linear interpolation.
+    assert report.values['unknown'] == pytest.approx(linear)
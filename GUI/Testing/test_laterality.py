@@ -0,0 +1,59 @@
+'''Tests for the plan laterality and the laterality name variants.
+'''
+
+#%% imports etc.
+import pytest
+from plan_data import DvhFile, Plan
+from plan_report import LateralityResolver
+from GUI.Testing.sample_data import DEFAULT_UNITS, write_dvh
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+LAT_PATTERNS = [('{Base} {LatIndicator}', 1), ('{LatIndicator}_{Base}', 2),
+                ('{Base}_{LatIndicator}', 1)]
+LATERALITY_LOOKUP = {('Right', 'Ipsilateral', 1): 'R',
+                     ('Right', 'Ipsilateral', 2): 'RT',
+                     ('Right', 'Contralateral', 1): 'L',
+                     ('Left', 'Ipsilateral', 1): 'L',
+                     ('None', 'Both', 1): 'B'}
+
+
+#%% Laterality Variants
+def test_variants_follow_the_pattern_order():
+    '''Each default pattern with an indicator of its size gives a name.'''
+    resolver = LateralityResolver('Right', LATERALITY_LOOKUP, LAT_PATTERNS)
+    assert resolver.indicator('Ipsilateral', 2) == 'RT'
+    assert resolver.name_variants('Lung', 'Ipsilateral') == [
+        'Lung R', 'RT_Lung', 'Lung_R']
+    assert resolver.name_variants('Lung', 'Contralateral') == [
+        'Lung L', 'Lung_L']
+    assert resolver.name_variants('Lung', None) == list()
+
+
+def test_missing_combinations_have_no_variants():
+    '''Lateralities missing from the table give no names, rather than an
+    error.'''
+    resolver = LateralityResolver('Left', LATERALITY_LOOKUP, LAT_PATTERNS)
+    assert resolver.indicator('Contralateral', 1) is None
+    assert resolver.name_variants('Lung', 'Contralateral') == list()
+    assert LateralityResolver('Both').name_variants('Lung', 'Both') == list()
+
+
+def test_plans_without_laterality_use_the_none_rows():
+    '''The laterality table uses 'None' for plans without laterality.'''
+    resolver = LateralityResolver(None, LATERALITY_LOOKUP, LAT_PATTERNS)
+    assert resolver.name_variants('Lung', 'Both') == ['Lung B', 'Lung_B']
+
+
+#%% Plan Laterality
+@pytest.mark.parametrize('plan_name, laterality', [
+    ('LUNR', 'Right'), ('LUNL', 'Left'), ('BRSB', 'Both'), ('LUNG', None),
+    ('ORAL', None), ('ORALR', None), ('NECB', 'Both')])
+def test_plan_laterality_from_the_region_code(tmp_path, plan_name,
+                                              laterality):
+    '''The fourth letter of the region code gives the laterality, unless the
+    4-letter code is a laterality exception.'''
+    dvh_file = write_dvh(tmp_path / 'plan.dvh', {'PTV': (10.0, CURVE)},
+                         plan_name=plan_name)
+    plan = Plan(DEFAULT_UNITS, frozenset({'ORAL'}), DvhFile(dvh_file))
+    assert plan.laterality == laterality
@@ -0,0 +1,148 @@
+'''Tests for the aliases learned from manual matches.
+'''
+
+#%% imports etc.
+import xml.etree.ElementTree as ET
+import pytest
+from plan_report import LearnedAliases, ReferenceGroup, ReferencePool
+from plan_report import Report, ReportCache, ReportCatalog, load_aliases
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import report_xml, structure_reference
+from GUI.Testing.sample_data import write_reports
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+CORD = ('Structure', 'Cord', None)
+LUNG = ('Structure', 'Lung', 'Ipsilateral')
+LATERALITY_LOOKUP = {('Right', 'Ipsilateral', 1): 'R',
+                     ('Right', 'Ipsilateral', 2): 'Rt',
+                     ('Left', 'Ipsilateral', 1): 'L',
+                     ('Left', 'Ipsilateral', 2): 'Lt'}
+
+
+def manual(reference_index, plan_item: str,
+           status: str = 'Manual')->ReferenceGroup:
+    '''Return a match of a reference to a plan item.'''
+    (reference_type, reference_name, laterality) = reference_index
+    return ReferenceGroup(reference_index, reference_name, reference_type,
+                          laterality, status, plan_item)
+
+
+def cord_items(name: str):
+    '''Return report items using the Cord reference.'''
+    return [report_item(name, reference=structure_reference('Cord'),
+                        constructor='Volume', unit='cc', cell='A1')]
+
+
+#%% Learning
+def test_only_manual_matches_are_learned():
+    '''Automatic matches, suggestions and matches to the reference name are
+    not aliases.'''
+    learned = LearnedAliases()
+    matches = [manual(CORD, 'SC_PRV'),
+               manual(CORD, 'Cord'),
+               manual(CORD, 'SpinalCord', status='Auto'),
+               manual(CORD, 'Spinal', status='Suggested')]
+    assert learned.record(matches, None, LATERALITY_LOOKUP) == 1
+    assert learned == {CORD: {('SC_PRV', None): 1}}
+
+
+def test_lateral_names_are_learned_as_patterns():
+    '''The laterality indicator is replaced, so the alias also applies to
+    plans of the other side.'''
+    learned = LearnedAliases()
+    assert learned.learn(manual(LUNG, 'Lung_Rt'), 'Right',
+                         LATERALITY_LOOKUP) == ('Lung_{LatIndicator}', 2)
+    assert learned.learn(manual(LUNG, 'LungR'), 'Right',
+                         LATERALITY_LOOKUP) is None
+    assert learned.learn(manual(LUNG, 'Lung_Lt'), 'Left',
+                         LATERALITY_LOOKUP) == ('Lung_{LatIndicator}', 2)
+    assert learned[LUNG] == {('Lung_{LatIndicator}', 2): 2}
+
+
+def test_alias_reference_orders_by_use():
+    '''The most used aliases come first; rarely used aliases can be left
+    out.'''
+    learned = LearnedAliases()
+    for plan_item in ('SC', 'SC_PRV', 'SC_PRV'):
+        learned.learn(manual(CORD, plan_item), None, None)
+    assert learned.alias_reference() == {
+        CORD: [('SC_PRV', None), ('SC', None)]}
+    assert learned.alias_reference(min_count=2) == {
+        CORD: [('SC_PRV', None)]}
+    assert learned.alias_reference(min_count=3) == dict()
+
+
+def test_save_and_load(tmp_path):
+    '''The alias file keeps the counts and laterality patterns.'''
+    learned = LearnedAliases()
+    learned.learn(manual(CORD, 'SC_PRV'), None, None)
+    learned.learn(manual(LUNG, 'Lung_R'), 'Right', LATERALITY_LOOKUP)
+    alias_file = tmp_path / 'LearnedAliases.xml'
+    learned.save(alias_file)
+    assert LearnedAliases.load(alias_file) == learned
+    assert LearnedAliases.load(tmp_path / 'missing.xml') == dict()
+
+
+def test_learned_aliases_follow_config_aliases():
+    '''Learned aliases are added after the config aliases, without
+    duplicates.'''
+    alias_root = ET.fromstring(
+        '<AliasList><PlanElement><Type>Structure</Type>'
+        '<ReferenceName>Cord</ReferenceName>'
+        '<Aliases><Alias>SpinalCord</Alias></Aliases>'
+        '</PlanElement></AliasList>')
+    learned = {CORD: [('SC_PRV', None), ('SpinalCord', None)]}
+    assert load_aliases(alias_root, learned) == {
+        CORD: [('SpinalCord', None), ('SC_PRV', None)]}
+
+
+#%% Adding Learned Aliases To Reports
+def test_with_aliases_does_not_change_the_definition():
+    '''The learned aliases are added to a copy of the definition and its
+    references.'''
+    definition = make_definition('Cord', cord_items('Cord'))
+    reference = definition.references[CORD]
+    original_aliases = set(reference['Aliases'])
+    updated = definition.with_aliases({CORD: [('SC_PRV', None)]})
+    assert updated is not definition
+    assert definition.references[CORD] is reference
+    assert reference['Aliases'] == original_aliases
+    assert updated.references[CORD]['Aliases'] == \
+        original_aliases | {('SC_PRV', None)}
+    assert definition.with_aliases({CORD: list(original_aliases)}) is \
+        definition
+
+
+def test_catalog_pools_the_reports_with_learned_aliases(make_plan,
+                                                        tmp_path):
+    '''Reports from the catalog share pooled references that include the
+    learned aliases, and the pool keys stay valid.'''
+    write_reports(tmp_path / 'Reports.xml',
+                  report_xml('First', cord_items('Cord')),
+                  report_xml('Second', cord_items('Cord Volume')))
+    report_cache = ReportCache()
+    report_cache.refresh([tmp_path], max_workers=1, template_path=tmp_path)
+    reference_pool = ReferencePool()
+    learned = LearnedAliases()
+    learned.learn(manual(CORD, 'SC_PRV'), None, None)
+    catalog = ReportCatalog(report_cache, reference_pool,
+                            learned.alias_reference())
+    first = catalog['First']
+    second = catalog['Second']
+    cord = first.references[CORD]
+    assert ('SC_PRV', None) in cord['Aliases']
+    assert second.references[CORD] is cord
+    assert reference_pool[ReferencePool.pool_key(cord)] is cord
+    for key, reference in reference_pool.items():
+        assert ReferencePool.pool_key(reference) == key
+    # The cached definitions are unchanged.
+    cached = report_cache.get_report('First')
+    assert ('SC_PRV', None) not in cached.references[CORD]['Aliases']
+
+    plan = make_plan({'SC_PRV': (10.0, CURVE)})
+    report = Report(first)
+    report.apply_matches(reference_pool.match_elements(plan), plan)
+    assert report.references[CORD].matched_name == 'SC_PRV'
+    report.get_values(plan)
+    assert report.values['Cord'] == pytest.approx(10.0)
@@ -0,0 +1,128 @@
+'''Tests for the compiled reference lookup used to match report references
+to plan structures.
+'''
+
+#%% imports etc.
+import pytest
+from plan_report import Report
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+LAT_PATTERNS = [('{Base} {LatIndicator}', 1)]
+LATERALITY_LOOKUP = {
+    (plan, item, size): indicator
+    for plan, (same, other) in (('Right', ('R', 'L')), ('Left', ('L', 'R')))
+    for item, side in (('Ipsilateral', same), ('Contralateral', other))
+    for size, indicator in ((1, side), (2, side + 'T'))}
+PLAN_STRUCTURES = ('PTV', 'Cord', 'SpinalCord', 'Lung R', 'Lung_LT',
+                   'Kidney_RT', 'Kidney L')
+
+
+def lung_reference(laterality: str)->str:
+    '''A lateral Lung reference with a sized alias pattern.'''
+    return (structure_reference('Lung', laterality) +
+            '<Aliases><Alias Size="2">Lung_{LatIndicator}</Alias>'
+            '</Aliases>')
+
+
+def kidney_reference(laterality: str)->str:
+    '''A lateral Kidney reference matched only through its alias.'''
+    return (structure_reference('Kidneys', laterality) +
+            '<Aliases><Alias Size="2">Kidney_{LatIndicator}</Alias>'
+            '</Aliases>')
+
+
+def make_test_report():
+    '''A report with plain, lateral and aliased references.'''
+    references = [('PTV', structure_reference('PTV')),
+                  ('Cord', structure_reference('Cord',
+                                               aliases=['SpinalCord'])),
+                  ('Heart', structure_reference('Heart')),
+                  ('Ipsi Lung', lung_reference('Ipsilateral')),
+                  ('Contra Lung', lung_reference('Contralateral')),
+                  ('Ipsi Kidney', kidney_reference('Ipsilateral')),
+                  ('Contra Kidney', kidney_reference('Contralateral'))]
+    items = [report_item(name, reference=reference, constructor='Volume',
+                         unit='cc', cell='A{}'.format(row))
+             for row, (name, reference) in enumerate(references, 1)]
+    return Report(make_definition('Lateral', items,
+                                  lat_patterns=LAT_PATTERNS,
+                                  laterality_lookup=LATERALITY_LOOKUP))
+
+
+def matched_names(report):
+    '''Return the matched plan structure name of each reference.'''
+    return {index: reference.matched_name
+            for index, reference in report.references.items()}
+
+
+def match_details(report):
+    '''Return the match method, matched name and suggestion of each
+    reference.'''
+    return {index: (reference['match_method'], reference.matched_name,
+                    reference['suggested_element'])
+            for index, reference in report.references.items()}
+
+
+#%% Compiled Lookup
+@pytest.mark.parametrize('plan_name', ['LUNR', 'LUNL'])
+def test_compiled_lookup_equals_the_ordered_search(make_plan, plan_name):
+    '''Matching through the compiled lookup gives the same plan elements
+    as PlanReference.match_element for every reference.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES},
+                     plan_name=plan_name)
+    report = make_test_report()
+    report.match_elements(plan)
+    ordered = make_test_report()
+    lat_param = dict(plan_laterality=plan.laterality,
+                     lat_patterns=LAT_PATTERNS,
+                     laterality_lookup=LATERALITY_LOOKUP)
+    for reference in ordered.references.values():
+        plan_elements = plan.data_elements[reference['reference_type']]
+        reference.match_element(plan_elements, **lat_param)
+    assert matched_names(report) == matched_names(ordered)
+
+
+def test_search_priority_is_kept(make_plan):
+    '''Reference names are used before laterality patterns and aliases.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES},
+                     plan_name='LUNR')
+    report = make_test_report()
+    (matched, not_matched) = report.match_elements(plan)
+    names = {index[1:]: name for index, name in matched_names(report).items()}
+    assert names == {('PTV', None): 'PTV',
+                     ('Cord', None): 'Cord',
+                     ('Heart', None): None,
+                     ('Lung', 'Ipsilateral'): 'Lung R',
+                     ('Lung', 'Contralateral'): 'Lung_LT',
+                     ('Kidneys', 'Ipsilateral'): 'Kidney_RT',
+                     ('Kidneys', 'Contralateral'): None}
+    assert len(matched) == 5
+    assert not_matched == [None, None]
+
+
+@pytest.mark.parametrize('plan_name', ['LUNR', 'LUNL'])
+def test_plan_scan_equals_the_candidate_probe(make_plan, plan_name):
+    '''Matching every reference by scanning the plan gives the same result
+    as probing the candidate names of each reference.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES +
+                      ('SC_PRV', 'Hart')}, plan_name=plan_name)
+    scanned = make_test_report()
+    scanned_items = scanned.match_elements(plan)
+    probed = make_test_report()
+    probed_items = probed.match_elements(plan, set(probed.references))
+    assert scanned_items == probed_items
+    assert match_details(scanned) == match_details(probed)
+
+
+def test_lookups_are_compiled_once_per_plan_laterality(make_plan):
+    '''Plans with the same laterality share one compiled lookup.'''
+    report = make_test_report()
+    for index, plan_name in enumerate(['LUNR', 'BRSR', 'LUNL']):
+        plan = make_plan({'PTV': (10.0, CURVE)},
+                         file_name='plan{}.dvh'.format(index),
+                         plan_name=plan_name)
+        report.match_elements(plan)
+    assert sorted(report.definition.match_indexes) == ['Left', 'Right']
@@ -0,0 +1,101 @@
+'''Tests for the persistent record of reference matches.
+'''
+
+#%% imports etc.
+from plan_report import MatchMemo, Report, structure_fingerprint
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+CORD = ('Structure', 'Cord', None)
+
+
+def make_report(*aliases)->Report:
+    '''Return a report with a single Cord reference.'''
+    item = report_item('Cord', constructor='Volume', unit='cc', cell='A1',
+                       reference=structure_reference('Cord',
+                                                     aliases=aliases))
+    return Report(make_definition('Memo', [item]))
+
+
+def manual_match(report: Report, plan, plan_item: str):
+    '''Manually match the Cord reference.'''
+    match = report.references[CORD].match
+    report.update_ref(match._replace(match_status='Manual',
+                                     plan_Item=plan_item), plan)
+
+
+#%% Memo Keys
+def test_fingerprint_uses_the_structure_names(make_plan):
+    '''The fingerprint ignores the DVH data and the structure order.'''
+    first = make_plan({'Cord': (10.0, CURVE), 'PTV': (20.0, CURVE)},
+                      file_name='a.dvh')
+    second = make_plan({'PTV': (5.0, CURVE[::-1]), 'Cord': (1.0, CURVE)},
+                       file_name='b.dvh')
+    third = make_plan({'Cord': (10.0, CURVE)}, file_name='c.dvh')
+    assert structure_fingerprint(first) == structure_fingerprint(second)
+    assert structure_fingerprint(first) != structure_fingerprint(third)
+
+
+#%% Recall
+def test_recall_applies_stored_manual_matches(make_plan):
+    '''A new run of the same report and plan naming gets the stored
+    matches.'''
+    plan = make_plan({'SC_PRV': (10.0, CURVE), 'PTV': (20.0, CURVE)})
+    memo = MatchMemo()
+    report = make_report()
+    assert not memo.recall(report, plan)
+    report.match_elements(plan)
+    manual_match(report, plan, 'SC_PRV')
+    memo.store(report, plan)
+
+    other_plan = make_plan({'PTV': (30.0, CURVE), 'SC_PRV': (40.0, CURVE)},
+                           file_name='other.dvh')
+    new_report = make_report()
+    assert memo.recall(new_report, other_plan)
+    cord = new_report.references[CORD]
+    assert cord['match_method'] == 'Manual'
+    assert cord['plan_element'] is other_plan.get_data_element(
+        'Structure', 'SC_PRV')
+
+
+def test_recall_needs_the_same_names_and_report_version(make_plan):
+    '''Plans with other structure names, or changed report references, are
+    matched again.'''
+    plan = make_plan({'SC_PRV': (10.0, CURVE)})
+    memo = MatchMemo()
+    report = make_report()
+    report.match_elements(plan)
+    manual_match(report, plan, 'SC_PRV')
+    memo.store(report, plan)
+    renamed = make_plan({'SC_PRV': (10.0, CURVE), 'Cord_PRV': (5.0, CURVE)},
+                        file_name='renamed.dvh')
+    assert not memo.recall(make_report(), renamed)
+    assert not memo.recall(make_report('SC_PRV'), plan)
+
+
+#%% Memo Files
+def test_save_and_load(make_plan, tmp_path):
+    '''A saved memo gives the same matches when loaded.'''
+    plan = make_plan({'SC_PRV': (10.0, CURVE)})
+    memo = MatchMemo()
+    report = make_report()
+    report.match_elements(plan)
+    manual_match(report, plan, 'SC_PRV')
+    memo.store(report, plan)
+    memo_file = tmp_path / 'MatchMemo.pkl'
+    memo.save(memo_file)
+    loaded = MatchMemo.load(memo_file)
+    assert loaded == memo
+    new_report = make_report()
+    assert loaded.recall(new_report, plan)
+    assert new_report.references[CORD].matched_name == 'SC_PRV'
+
+
+def test_unreadable_memo_files_give_an_empty_memo(tmp_path):
+    '''Missing and damaged files are ignored.'''
+    assert MatchMemo.load(tmp_path / 'missing.pkl') == dict()
+    damaged = tmp_path / 'damaged.pkl'
+    damaged.write_bytes(b'not a pickle')
+    assert MatchMemo.load(damaged) == dict()
@@ -0,0 +1,107 @@
+'''Tests for matching report references to plan structures by name.
+'''
+
+#%% imports etc.
+import pytest
+from plan_data import NameIndex, normalise_name
+from plan_report import FUZZY_THRESHOLD, MatchHistory, Report
+from plan_report import rerun_matching, reset_matching
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+PLAN_STRUCTURES = ('PTV', 'Spinal_Cord', 'Oesophagus', 'Lung_Total',
+                   'Heart')
+
+
+def reference_index(name: str):
+    '''Return the reference index of an un-lateralised structure.'''
+    return ('Structure', name, None)
+
+
+@pytest.fixture
+def plan(make_plan):
+    '''A plan containing PLAN_STRUCTURES.'''
+    return make_plan({name: (100.0, CURVE) for name in PLAN_STRUCTURES},
+                     volume_unit='%')
+
+
+@pytest.fixture
+def report():
+    '''A report referencing structures with exact, normalised, fuzzy and
+    unmatched names.'''
+    items = [report_item(name, reference=structure_reference(name),
+                         constructor='Volume', unit='cc', cell=cell)
+             for name, cell in (('PTV', 'A1'), ('SpinalCord', 'A2'),
+                                ('Esophagus', 'A3'), ('Lungs', 'A4'))]
+    items.append(report_item(
+        'Cardiac', constructor='Volume', unit='cc', cell='A5',
+        reference=structure_reference('Cardiac', aliases=['Heart'])))
+    return Report(make_definition('Names', items))
+
+
+def match_methods(report: Report):
+    '''Return the match method and matched name of each reference.'''
+    return {index[1]: (reference['match_method'], reference.matched_name)
+            for index, reference in report.references.items()}
+
+
+#%% Name Index
+def test_normalised_names_ignore_case_spaces_and_underscores():
+    '''Names differing only by case, spaces and underscores are equal.'''
+    assert normalise_name('Spinal_Cord') == normalise_name('spinal cord')
+    assert normalise_name('SpinalCord') == normalise_name('SPINAL  CORD')
+
+
+def test_best_match_prefers_a_normalised_match():
+    '''An exact normalised match scores 1 and fuzzy matches score less.'''
+    index = NameIndex({'Spinal_Cord': 'cord', 'Oesophagus': 'oesophagus'})
+    assert index.best_match(['Esophagus', 'spinal cord']) == ('cord', 1.0)
+    (element, score) = index.best_match(['Esophagus'])
+    assert element == 'oesophagus'
+    assert FUZZY_THRESHOLD <= score < 1.0
+    assert index.best_match(['Bladder']) == (None, 0.0)
+
+
+#%% Report Matching
+def test_match_methods(plan, report):
+    '''Exact, alias and normalised names match automatically, close names
+    are suggested and distant names are not matched.'''
+    report.match_elements(plan)
+    assert match_methods(report) == {
+        'PTV': ('Auto', 'PTV'),
+        'SpinalCord': ('Auto', 'Spinal_Cord'),
+        'Esophagus': ('Suggested', None),
+        'Lungs': (None, None),
+        'Cardiac': ('Auto', 'Heart')}
+    suggested = report.references[reference_index('Esophagus')]
+    assert suggested['suggested_element'].name == 'Oesophagus'
+    assert suggested['match_score'] >= FUZZY_THRESHOLD
+    assert suggested.match.plan_Item == 'Oesophagus'
+
+
+def test_suggestions_are_not_used_for_values(plan, report):
+    '''A suggested match gives no value until it is approved.'''
+    report.match_elements(plan)
+    report.get_values(plan)
+    assert report.values['PTV'] == pytest.approx(100.0)
+    assert report.values['Esophagus'] is None
+
+
+def test_approved_suggestions_survive_rematching(plan, report):
+    '''Approved matches are re-applied when the plan is matched again, and
+    unapproved suggestions stay suggestions.'''
+    report.match_elements(plan)
+    history = MatchHistory()
+    suggestion = report.references[reference_index('Esophagus')].match
+    approved = suggestion._replace(match_status='Manual')
+    report.update_ref(approved, plan)
+    history.add(suggestion, approved)
+    rerun_matching(report, plan, history)
+    assert match_methods(report)['Esophagus'] == ('Manual', 'Oesophagus')
+    report.get_values(plan)
+    assert report.values['Esophagus'] == pytest.approx(100.0)
+    (report, history) = reset_matching(report, plan, history)
+    assert match_methods(report)['Esophagus'] == ('Suggested', None)
+    assert not history
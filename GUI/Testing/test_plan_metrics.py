@@ -0,0 +1,109 @@
+'''Tests for the conformity and gradient indices.
+'''
+
+#%% imports etc.
+import pytest
+from plan_metrics import ConformitySettings, conformity_indices
+from plan_metrics import apply_conformity_indices
+
+
+SETTINGS = ConformitySettings(targets=['PTV'], bodies=['BODY'],
+                              prescription_isodoses=['PIV'],
+                              half_isodoses=['Dose 50%'])
+
+# With a 4800 cGy prescription: 95% of the 10 cc PTV is covered, and the
+# 1000 cc body has 12 cc inside the 100% isodose and 40 cc inside the 50%
+# isodose.
+PTV_VOLUME = 10.0
+BODY_VOLUME = 1000.0
+PTV_CURVE = [(0.0, 100.0), (4700.0, 100.0), (4800.0, 95.0), (5200.0, 0.0)]
+BODY_CURVE = [(0.0, 100.0), (2400.0, 4.0), (4800.0, 1.2), (6000.0, 0.0)]
+EXPECTED = {'RTOG CI': 1.2,
+            'Paddick CI': 9.5**2 / (10.0 * 12.0),
+            'R50%': 4.0,
+            'Gradient Index': 40.0 / 12.0}
+
+
+def in_cc(volume, curve):
+    '''Convert a % volume DVH curve to cc.'''
+    return [(dose, volume * percent / 100.0) for dose, percent in curve]
+
+
+def index_values(items):
+    '''Return the values of stored index plan properties.'''
+    return {name: item.element_value for name, item in items.items()}
+
+
+#%% Index Calculations
+def test_conformity_index_formulas():
+    '''RTOG CI = V100/TV, Paddick CI = TV_PIV²/(TV·V100),
+    R50% = V50/TV and GI = V50/V100.'''
+    indices = conformity_indices(10.0, 9.5, [12.0, 40.0])
+    for name, value in EXPECTED.items():
+        assert indices[name] == pytest.approx(value)
+
+
+def test_conformity_indices_for_many_plans():
+    '''Leading dimensions evaluate several plans at once.'''
+    indices = conformity_indices([10.0, 20.0], [9.5, 20.0],
+                                 [[12.0, 40.0], [20.0, 60.0]])
+    assert indices['RTOG CI'] == pytest.approx([1.2, 1.0])
+    assert indices['Paddick CI'] == pytest.approx(
+        [EXPECTED['Paddick CI'], 1.0])
+
+
+#%% Plan Level Methods
+@pytest.mark.parametrize('volume_unit', ['%', 'cm³'])
+def test_plan_indices_do_not_depend_on_the_volume_unit(make_plan,
+                                                        volume_unit):
+    '''Absolute and relative volume DVHs give the same indices.'''
+    ptv_curve = PTV_CURVE
+    body_curve = BODY_CURVE
+    if volume_unit != '%':
+        ptv_curve = in_cc(PTV_VOLUME, PTV_CURVE)
+        body_curve = in_cc(BODY_VOLUME, BODY_CURVE)
+    plan = make_plan({'PTV': (PTV_VOLUME, ptv_curve),
+                      'BODY': (BODY_VOLUME, body_curve)},
+                     volume_unit=volume_unit)
+    items = apply_conformity_indices(plan, SETTINGS)
+    assert index_values(items) == pytest.approx(EXPECTED)
+    stored = plan.get_data_element('Plan Property', 'RTOG CI')
+    assert stored.element_value == pytest.approx(EXPECTED['RTOG CI'])
+
+
+def test_isodose_structures_used_without_a_body(make_plan):
+    '''The isodose structure volumes replace a missing body DVH.'''
+    plan = make_plan({'PTV': (PTV_VOLUME, PTV_CURVE),
+                      'PIV': (12.0, [(0.0, 100.0), (6000.0, 0.0)]),
+                      'Dose 50%': (40.0, [(0.0, 100.0), (6000.0, 0.0)])},
+                     volume_unit='%')
+    items = apply_conformity_indices(plan, SETTINGS)
+    assert index_values(items) == pytest.approx(EXPECTED)
+
+
+def test_missing_isodose_volumes_give_empty_values(make_plan):
+    '''Indices that cannot be calculated are stored without a value.'''
+    plan = make_plan({'PTV': (PTV_VOLUME, PTV_CURVE)}, volume_unit='%')
+    items = apply_conformity_indices(plan, SETTINGS)
+    assert set(items) == set(EXPECTED)
+    assert all(value is None for value in index_values(items).values())
+
+
+def test_no_target_gives_no_indices(make_plan):
+    '''Plans without a target structure are not given index values.'''
+    plan = make_plan({'BODY': (BODY_VOLUME, BODY_CURVE)}, volume_unit='%')
+    assert apply_conformity_indices(plan, SETTINGS) == dict()
+
+
+def test_indices_are_calculated_once(make_plan):
+    '''Stored values are reused unless recalculate is requested.'''
+    plan = make_plan({'PTV': (PTV_VOLUME, PTV_CURVE),
+                      'BODY': (BODY_VOLUME, BODY_CURVE)}, volume_unit='%')
+    first = apply_conformity_indices(plan, SETTINGS)
+    no_body = SETTINGS._replace(bodies=[], prescription_isodoses=[],
+                                half_isodoses=[])
+    cached = apply_conformity_indices(plan, no_body)
+    assert index_values(cached) == index_values(first)
+    recalculated = apply_conformity_indices(plan, no_body, recalculate=True)
+    assert all(value is None
+               for value in index_values(recalculated).values())
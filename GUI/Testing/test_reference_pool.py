@@ -0,0 +1,142 @@
+'''Tests for matching several reports through a shared reference pool.
+'''
+
+#%% imports etc.
+from plan_report import MatchHistory, ReferencePool, Report, ReportCache
+from plan_report import rerun_matching
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import report_xml, structure_reference
+from GUI.Testing.sample_data import write_reports
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+PLAN_STRUCTURES = ('PTV', 'SpinalCord', 'Oesophagus', 'Heart')
+
+
+def structure_items(*names, aliases=()):
+    '''Return Volume report items for structure references.'''
+    return [report_item(name, constructor='Volume', unit='cc',
+                        cell='A{}'.format(row),
+                        reference=structure_reference(name, aliases=aliases))
+            for row, name in enumerate(names, 1)]
+
+
+def make_reports():
+    '''Two report definitions sharing the PTV and Cord references.'''
+    first = make_definition('First', structure_items('PTV', 'Cord',
+                                                     'Esophagus'))
+    second = make_definition('Second', structure_items('PTV', 'Heart') +
+                             structure_items('Cord', aliases=['SpinalCord']))
+    return (first, second)
+
+
+def matches(report: Report):
+    '''Return the match method and matched name of each reference.'''
+    return {index: (reference['match_method'], reference.matched_name,
+                    reference['suggested_element'])
+            for index, reference in report.references.items()}
+
+
+#%% Pooled Matching
+def test_pool_holds_each_distinct_reference_once():
+    '''References with the same index and aliases are pooled together and
+    the definitions are not changed.'''
+    definitions = make_reports()
+    originals = [dict(definition.references) for definition in definitions]
+    reference_pool = ReferencePool.from_reports(definitions)
+    # PTV is shared; the two Cord references have different aliases.
+    assert len(reference_pool) == 5
+    for definition, references in zip(definitions, originals):
+        assert definition.references == references
+        for index, reference in definition.references.items():
+            assert references[index] is reference
+
+
+def test_pooled_matches_equal_report_matches(make_plan):
+    '''Applying the pool matches gives the same result as matching each
+    report.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES})
+    definitions = make_reports()
+    pool_matches = ReferencePool.from_reports(definitions).match_elements(
+        plan)
+    for definition in definitions:
+        pooled = Report(definition)
+        pooled.apply_matches(pool_matches, plan)
+        direct = Report(definition)
+        direct.match_elements(plan)
+        assert matches(pooled) == matches(direct)
+        assert pooled.affected_references(plan) == set()
+    # The pool entries themselves never hold a match.
+    first = definitions[0]
+    assert all(reference['match_method'] is None
+               for reference in first.references.values())
+
+
+def test_references_missing_from_the_pool_are_matched(make_plan):
+    '''A pool built without a report still gives that report a complete
+    match.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES})
+    (first, second) = make_reports()
+    pool_matches = ReferencePool.from_reports([first]).match_elements(plan)
+    report = Report(second)
+    report.apply_matches(pool_matches, plan)
+    direct = Report(second)
+    direct.match_elements(plan)
+    assert matches(report) == matches(direct)
+    assert report.references[('Structure', 'Cord', None)].matched_name == \
+        'SpinalCord'
+
+
+def test_rerun_matching_uses_the_pool_for_new_plans(make_plan):
+    '''A report that has not been matched uses the pool matches, and
+    manual changes are re-applied.'''
+    plan = make_plan({name: (10.0, CURVE) for name in PLAN_STRUCTURES})
+    definitions = make_reports()
+    pool_matches = ReferencePool.from_reports(definitions).match_elements(
+        plan)
+    report = Report(definitions[0])
+    history = MatchHistory()
+    cord = report.references[('Structure', 'Cord', None)].match
+    manual = cord._replace(match_status='Manual', plan_Item='SpinalCord')
+    history.add(cord, manual)
+    rerun_matching(report, plan, history, pool_matches)
+    assert matches(report)[('Structure', 'PTV', None)][:2] == ('Auto', 'PTV')
+    assert matches(report)[('Structure', 'Cord', None)][:2] == \
+        ('Manual', 'SpinalCord')
+
+
+#%% Cached Reports
+def test_get_report_pools_loaded_reports(tmp_path):
+    '''Reports already loaded by a refresh are added to the pool.'''
+    write_reports(tmp_path / 'Reports.xml',
+                  report_xml('First', structure_items('PTV', 'Cord')),
+                  report_xml('Second', structure_items('PTV')))
+    report_cache = ReportCache()
+    report_cache.refresh([tmp_path], max_workers=1, template_path=tmp_path)
+    reference_pool = ReferencePool()
+    first = report_cache.get_report('First', reference_pool)
+    second = report_cache.get_report('Second', reference_pool)
+    ptv = ('Structure', 'PTV', None)
+    assert len(reference_pool) == 2
+    assert first.references[ptv] is second.references[ptv]
+
+
+def test_unpickled_reports_share_pool_references(tmp_path):
+    '''Report definitions read from a saved cache are joined to the
+    pool.'''
+    report_dir = tmp_path / 'Reports'
+    report_dir.mkdir()
+    write_reports(report_dir / 'Reports.xml',
+                  report_xml('First', structure_items('PTV', 'Cord')),
+                  report_xml('Second', structure_items('PTV')))
+    report_cache = ReportCache()
+    report_cache.refresh([report_dir], max_workers=1,
+                         template_path=report_dir)
+    report_cache.save(tmp_path / 'ReportCache.pkl')
+    loaded = ReportCache.load(tmp_path / 'ReportCache.pkl')
+    reference_pool = ReferencePool()
+    first = loaded.get_report('First', reference_pool)
+    second = loaded.get_report('Second', reference_pool)
+    ptv = ('Structure', 'PTV', None)
+    assert len(reference_pool) == 2
+    assert first.references[ptv] is second.references[ptv]
@@ -0,0 +1,141 @@
+'''Tests for the compiled report definition cache.
+'''
+
+#%% imports etc.
+import os
+import plan_report
+from plan_report import ReportCache
+from GUI.Testing.sample_data import report_item, report_xml
+from GUI.Testing.sample_data import structure_reference, write_reports
+
+
+def structure_items(*names):
+    '''Return Volume report items for structure references.'''
+    return [report_item(name, reference=structure_reference(name),
+                        constructor='Volume', unit='cc',
+                        cell='A{}'.format(row))
+            for row, name in enumerate(names, 1)]
+
+
+def write_report_file(report_file, *report_names, mtime=None):
+    '''Write a report definition file and set its modification time.'''
+    write_reports(report_file, *[report_xml(name, structure_items('PTV'))
+                                 for name in report_names])
+    if mtime is not None:
+        os.utime(str(report_file), ns=(mtime, mtime))
+    return report_file
+
+
+def refreshed_cache(report_dir, **parameters)->ReportCache:
+    '''Return a cache refreshed from report_dir.'''
+    report_cache = ReportCache()
+    parameters.setdefault('template_path', report_dir)
+    report_cache.refresh([report_dir], max_workers=1, **parameters)
+    return report_cache
+
+
+#%% Refresh
+def test_refresh_reads_report_files_only(tmp_path):
+    '''Only XML files with a ReportDefinitions root are read.'''
+    write_report_file(tmp_path / 'Reports.xml', 'First', 'Second')
+    (tmp_path / 'Config.xml').write_text('<Config><Report/></Config>')
+    report_cache = ReportCache()
+    assert report_cache.refresh([tmp_path], max_workers=1,
+                                template_path=tmp_path) == 1
+    assert sorted(report_cache) == ['First', 'Second']
+    assert report_cache['First'].summary.source == \
+        str(tmp_path / 'Reports.xml')
+    assert list(report_cache.sources) == [str(tmp_path / 'Reports.xml')]
+
+
+def test_refresh_without_changes_reads_nothing(tmp_path):
+    '''Unchanged files are not read again.'''
+    write_report_file(tmp_path / 'Reports.xml', 'First')
+    report_cache = refreshed_cache(tmp_path)
+    first = report_cache.get_report('First')
+    assert report_cache.refresh([tmp_path], max_workers=1,
+                                template_path=tmp_path) == 0
+    assert report_cache.get_report('First') is first
+
+
+def test_changed_files_replace_their_reports(tmp_path):
+    '''Reports from a changed file are replaced; other files are kept.'''
+    changed_file = write_report_file(tmp_path / 'A.xml', 'First',
+                                     mtime=10**18)
+    write_report_file(tmp_path / 'B.xml', 'Other')
+    report_cache = refreshed_cache(tmp_path)
+    other = report_cache.get_report('Other')
+    write_report_file(changed_file, 'Renamed', mtime=2 * 10**18)
+    assert report_cache.refresh([tmp_path], max_workers=1,
+                                template_path=tmp_path) == 1
+    assert sorted(report_cache) == ['Other', 'Renamed']
+    assert 'First' not in report_cache.loaded
+    assert report_cache.get_report('Other') is other
+
+
+def test_removed_files_remove_their_reports(tmp_path):
+    '''Reports from deleted files are removed.'''
+    removed_file = write_report_file(tmp_path / 'A.xml', 'First')
+    write_report_file(tmp_path / 'B.xml', 'Other')
+    report_cache = refreshed_cache(tmp_path)
+    removed_file.unlink()
+    assert report_cache.refresh([tmp_path], max_workers=1,
+                                template_path=tmp_path) == 1
+    assert list(report_cache) == ['Other']
+    assert report_cache.get_report('First') is None
+
+
+def test_changed_settings_rebuild_all_reports(tmp_path):
+    '''Reports built with different report parameters are rebuilt.'''
+    write_report_file(tmp_path / 'Reports.xml', 'First')
+    report_cache = refreshed_cache(tmp_path)
+    first = report_cache.get_report('First')
+    settings = report_cache.settings
+    aliases = {('Structure', 'PTV', None): [('PTV_Eval', None)]}
+    assert report_cache.refresh([tmp_path], max_workers=1,
+                                template_path=tmp_path,
+                                alias_reference=aliases) == 1
+    assert report_cache.settings != settings
+    rebuilt = report_cache.get_report('First')
+    assert rebuilt is not first
+    assert ('PTV_Eval', None) in \
+        rebuilt.references[('Structure', 'PTV', None)]['Aliases']
+
+
+#%% Cache Files
+def test_save_and_load(tmp_path):
+    '''A loaded cache reads only the index, and unpickles reports when they
+    are requested.'''
+    report_dir = tmp_path / 'Reports'
+    report_dir.mkdir()
+    write_report_file(report_dir / 'Reports.xml', 'First', 'Second')
+    report_cache = refreshed_cache(report_dir)
+    cache_file = tmp_path / 'ReportCache.pkl'
+    report_cache.save(cache_file)
+
+    loaded = ReportCache.load(cache_file)
+    assert sorted(loaded) == ['First', 'Second']
+    assert loaded.loaded == dict()
+    assert loaded.settings == report_cache.settings
+    assert loaded['First'].data is None
+    first = loaded.get_report('First')
+    assert first.name == 'First'
+    assert list(first.references) == [('Structure', 'PTV', None)]
+    assert list(loaded.loaded) == ['First']
+    assert loaded.refresh([report_dir], max_workers=1,
+                          template_path=report_dir) == 0
+
+
+def test_out_of_date_cache_files_are_ignored(tmp_path, monkeypatch):
+    '''Cache files with another schema version, or that can not be read,
+    give an empty cache.'''
+    write_report_file(tmp_path / 'Reports.xml', 'First')
+    cache_file = tmp_path / 'ReportCache.pkl'
+    refreshed_cache(tmp_path).save(cache_file)
+    monkeypatch.setattr(plan_report, 'REPORT_CACHE_SCHEMA',
+                        plan_report.REPORT_CACHE_SCHEMA + 1)
+    assert ReportCache.load(cache_file) == dict()
+    damaged = tmp_path / 'Damaged.pkl'
+    damaged.write_bytes(b'short')
+    assert ReportCache.load(damaged) == dict()
+    assert ReportCache.load(tmp_path / 'Missing.pkl') == dict()
@@ -0,0 +1,105 @@
+'''Tests for the lazily loaded report catalog.
+'''
+
+#%% imports etc.
+import os
+import pytest
+from plan_report import ReferencePool, ReportCache, ReportCatalog
+from plan_report import load_report_files, scan_report_files
+from GUI.Testing.sample_data import report_item, report_xml
+from GUI.Testing.sample_data import structure_reference, write_reports
+
+
+PTV = ('Structure', 'PTV', None)
+
+
+def write_report_file(report_file, names, description='Test report',
+                      mtime=None):
+    '''Write a report definition file and set its modification time.'''
+    items = [report_item('PTV', reference=structure_reference('PTV'),
+                         constructor='Volume', unit='cc', cell='A1')]
+    reports = [report_xml(name, items).replace('Test report', description)
+               for name in names]
+    write_reports(report_file, *reports)
+    if mtime is not None:
+        os.utime(str(report_file), ns=(mtime, mtime))
+    return report_file
+
+
+@pytest.fixture
+def saved_cache(tmp_path):
+    '''Return the report directory and a saved cache of its reports.'''
+    report_dir = tmp_path / 'Reports'
+    report_dir.mkdir()
+    write_report_file(report_dir / 'A.xml', ['First', 'Second'],
+                      mtime=10**18)
+    report_cache = ReportCache()
+    report_cache.refresh([report_dir], max_workers=1,
+                         template_path=report_dir)
+    cache_file = tmp_path / 'ReportCache.pkl'
+    report_cache.save(cache_file)
+    return report_dir, cache_file
+
+
+#%% Lazy Loading
+def test_catalog_lists_reports_without_loading_them(saved_cache):
+    '''Names and summaries come from the cache index.'''
+    (_, cache_file) = saved_cache
+    catalog = ReportCatalog(ReportCache.load(cache_file))
+    assert sorted(catalog) == ['First', 'Second']
+    assert len(catalog) == 2
+    assert 'First' in catalog
+    assert 'Missing' not in catalog
+    assert catalog.summary('First').description == 'Test report'
+    assert catalog.summary('Missing') is None
+    assert catalog.loaded() == list()
+    assert catalog.report_cache.loaded == dict()
+
+
+def test_reports_are_loaded_once_when_requested(saved_cache):
+    '''Requested reports are unpickled and kept.'''
+    (_, cache_file) = saved_cache
+    catalog = ReportCatalog(ReportCache.load(cache_file))
+    first = catalog['First']
+    assert first.name == 'First'
+    assert catalog['First'] is first
+    assert catalog.loaded() == ['First']
+    with pytest.raises(KeyError):
+        catalog['Missing']
+
+
+
+def test_loaded_reports_are_pooled_with_learned_aliases(saved_cache):
+    '''Loaded reports share pooled references and get the learned
+    aliases.'''
+    (_, cache_file) = saved_cache
+    reference_pool = ReferencePool()
+    learned = {PTV: [('PTV_Eval', None)]}
+    catalog = ReportCatalog(ReportCache.load(cache_file), reference_pool,
+                            learned)
+    first = catalog['First']
+    assert first.references[PTV] is catalog['Second'].references[PTV]
+    assert ('PTV_Eval', None) in first.references[PTV]['Aliases']
+    for key, reference in reference_pool.items():
+        assert ReferencePool.pool_key(reference) == key
+
+
+#%% Changes
+def test_changed_reports_are_reloaded(saved_cache):
+    '''Loaded copies of replaced reports are dropped.'''
+    (report_dir, cache_file) = saved_cache
+    catalog = ReportCatalog(ReportCache.load(cache_file))
+    first = catalog['First']
+    write_report_file(report_dir / 'A.xml', ['First'],
+                      description='Changed report', mtime=2 * 10**18)
+    parameters = dict(template_path=report_dir)
+    changes = scan_report_files([report_dir], catalog.report_cache.sources)
+    report_files = load_report_files(changes.changed, 1, **parameters)
+    updated = catalog.apply_changes(changes, report_files,
+                                    ReportCache.settings_fingerprint(
+                                        parameters))
+    assert sorted(updated) == ['First', 'Second']
+    assert list(catalog) == ['First']
+    assert catalog['First'] is not first
+    assert catalog['First'].description == 'Changed report'
+    assert catalog.summary('First').description == 'Changed report'
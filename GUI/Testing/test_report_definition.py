@@ -0,0 +1,66 @@
+'''Tests for sharing a report definition between report runs.
+'''
+
+#%% imports etc.
+import pytest
+from plan_report import Report
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+CORD = ('Structure', 'Cord', None)
+
+
+def run_definition():
+    '''A report definition with a matched and an unmatched reference.'''
+    items = [report_item(name, reference=structure_reference(name),
+                         constructor='Volume', unit='cc',
+                         cell='A{}'.format(row))
+             for row, name in enumerate(['PTV', 'Cord'], 1)]
+    return make_definition('Runs', items)
+
+
+def reference_state(references):
+    '''Return a copy of the contents of each reference.'''
+    return {index: dict(reference) for index, reference in references.items()}
+
+
+#%% Report Runs
+def test_report_runs_do_not_change_the_definition(make_plan):
+    '''Matching, manual changes and values are kept in the Report.'''
+    definition = run_definition()
+    references = dict(definition.references)
+    original = reference_state(definition.references)
+    elements = dict(definition.report_elements)
+    plan = make_plan({'PTV': (10.0, CURVE), 'SpinalCord': (5.0, CURVE)})
+    report = Report(definition)
+    report.match_elements(plan)
+    cord = report.references[CORD].match
+    report.update_ref(cord._replace(match_status='Manual',
+                                    plan_Item='SpinalCord'), plan)
+    report.get_values(plan)
+    assert report.values == {'PTV': pytest.approx(10.0),
+                             'Cord': pytest.approx(5.0)}
+    assert reference_state(definition.references) == original
+    assert definition.references == references
+    for index, reference in definition.references.items():
+        assert references[index] is reference
+        assert report.references[index] is not reference
+    assert definition.report_elements == elements
+    assert all(not hasattr(element, 'value')
+               for element in definition.report_elements.values())
+
+
+def test_report_runs_are_independent(make_plan):
+    '''Reports created from one definition do not share matches.'''
+    definition = run_definition()
+    plan = make_plan({'PTV': (10.0, CURVE), 'Cord': (5.0, CURVE)})
+    first = Report(definition)
+    first.match_elements(plan)
+    first.get_values(plan)
+    second = Report(definition)
+    assert second.values == dict()
+    assert all(reference['plan_element'] is None
+               for reference in second.references.values())
+    assert first.references[CORD].matched_name == 'Cord'
@@ -0,0 +1,126 @@
+'''Tests for reading report definition files.
+'''
+
+#%% imports etc.
+import xml.etree.ElementTree as ET
+import pytest
+from plan_report import ROOT_SNIFF_BYTES, is_report_file, sniff_root_tag
+from plan_report import iterate_report_elements, load_report_definitions
+from plan_report import load_report_files, read_report_files
+from GUI.Testing.sample_data import report_item, report_xml
+from GUI.Testing.sample_data import structure_reference, write_reports
+
+
+def structure_items(*names):
+    '''Return Volume report items for structure references.'''
+    return [report_item(name, reference=structure_reference(name),
+                        constructor='Volume', unit='cc',
+                        cell='A{}'.format(row))
+            for row, name in enumerate(names, 1)]
+
+
+#%% Streaming
+def test_reports_are_yielded_one_at_a_time(tmp_path):
+    '''Each Report element is cleared when the next one is requested, and
+    other top level elements are skipped.'''
+    report_file = write_reports(tmp_path / 'Reports.xml',
+                                report_xml('First', structure_items('PTV')),
+                                '<Notes>Not a report</Notes>',
+                                report_xml('Second', structure_items('PTV')))
+    elements = iterate_report_elements(report_file)
+    first = next(elements)
+    assert first.tag == 'Report'
+    assert first.findtext('Name') == 'First'
+    second = next(elements)
+    assert second.findtext('Name') == 'Second'
+    assert len(first) == 0
+    with pytest.raises(StopIteration):
+        next(elements)
+    assert len(second) == 0
+
+
+def test_reports_before_a_parse_error_are_read(tmp_path):
+    '''A damaged file raises a ParseError after the complete reports.'''
+    report_file = tmp_path / 'Reports.xml'
+    report_file.write_text('<ReportDefinitions>{}<Report><Name>'.format(
+        report_xml('First', structure_items('PTV'))), encoding='utf_8')
+    elements = iterate_report_elements(report_file)
+    assert next(elements).findtext('Name') == 'First'
+    with pytest.raises(ET.ParseError):
+        next(elements)
+
+
+#%% Report Files
+def test_report_files_are_returned_in_order(tmp_path):
+    '''Each file is returned with its reports, in the order given.'''
+    report_files = [write_reports(tmp_path / '{}.xml'.format(name),
+                                  report_xml(name, structure_items('PTV')))
+                    for name in ('B', 'A', 'C')]
+    loaded = load_report_files(report_files, max_workers=1,
+                               template_path=tmp_path)
+    assert [(file, list(reports)) for file, reports in loaded] == [
+        (report_files[0], ['B']), (report_files[1], ['A']),
+        (report_files[2], ['C'])]
+
+
+def test_later_files_replace_reports_with_the_same_name(tmp_path):
+    '''Files are read in name order and the last definition is used.'''
+    write_reports(tmp_path / 'B.xml',
+                  report_xml('Shared', structure_items('Heart')),
+                  report_xml('Second', structure_items('PTV')))
+    write_reports(tmp_path / 'A.xml',
+                  report_xml('Shared', structure_items('PTV')),
+                  report_xml('First', structure_items('PTV')),
+                  report_xml('First', structure_items('Cord')))
+    reports = read_report_files([tmp_path], max_workers=1,
+                                template_path=tmp_path)
+    assert sorted(reports) == ['First', 'Second', 'Shared']
+    assert list(reports['Shared'].report_elements) == ['Heart']
+    assert list(reports['First'].report_elements) == ['Cord']
+
+
+def test_invalid_reports_are_left_out(tmp_path):
+    '''Reports that do not match the schema are skipped.'''
+    bad_items = [report_item('Bad', reference=structure_reference('PTV'),
+                             constructor='Mean Volume')]
+    report_file = write_reports(tmp_path / 'Reports.xml',
+                                report_xml('Bad', bad_items),
+                                report_xml('Good', structure_items('PTV')))
+    reports = load_report_definitions(report_file, template_path=tmp_path)
+    assert list(reports) == ['Good']
+
+
+#%% Root Tag
+@pytest.mark.parametrize('prefix', [
+    '', '<?xml version="1.0" encoding="utf-8"?>\n',
+    '\ufeff<?xml version="1.0"?><!-- Reports -->\n',
+    '<!DOCTYPE ReportDefinitions>\n  '])
+def test_root_tag_after_the_xml_preamble(tmp_path, prefix):
+    '''The declaration, comments, a byte order mark and white space are
+    skipped.'''
+    report_file = tmp_path / 'Reports.xml'
+    report_file.write_text(prefix + '<ReportDefinitions/>',
+                           encoding='utf_8')
+    assert sniff_root_tag(report_file) == 'ReportDefinitions'
+    assert is_report_file(report_file)
+
+
+def test_root_tag_after_a_long_comment(tmp_path):
+    '''Files with a preamble longer than the sniffed prefix are parsed.'''
+    report_file = tmp_path / 'Reports.xml'
+    comment = '<!-- {} -->'.format('x' * ROOT_SNIFF_BYTES)
+    report_file.write_text(comment + '<ReportDefinitions/>')
+    assert sniff_root_tag(report_file) == 'ReportDefinitions'
+
+
+def test_other_files_are_not_report_files(tmp_path):
+    '''Other XML, damaged and missing files are not report files.'''
+    config_file = tmp_path / 'Config.xml'
+    config_file.write_text('<PlanEvaluation><ReportDefinitions/>'
+                           '</PlanEvaluation>')
+    assert sniff_root_tag(config_file) == 'PlanEvaluation'
+    assert not is_report_file(config_file)
+    damaged = tmp_path / 'Damaged.xml'
+    damaged.write_text('<!-- ' + 'x' * ROOT_SNIFF_BYTES)
+    assert sniff_root_tag(damaged) is None
+    assert not is_report_file(tmp_path / 'Missing.xml')
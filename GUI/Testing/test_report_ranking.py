@@ -0,0 +1,88 @@
+'''Tests for ranking the loaded reports against a plan.
+'''
+
+#%% imports etc.
+import xml.etree.ElementTree as ET
+import pytest
+from plan_data import PlanDescription
+from plan_report import load_prescriptions, prescription_match
+from plan_report import rank_reports, select_report
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+
+
+def structure_items(*names):
+    '''Return Volume report items for structure references.'''
+    return [report_item(name, reference=structure_reference(name),
+                        constructor='Volume', unit='cc',
+                        cell='A{}'.format(row))
+            for row, name in enumerate(names, 1)]
+
+
+#%% Prescriptions
+@pytest.mark.parametrize('report_text, expected', [
+    ('<Name>A</Name><Prescriptions><Prescription Dose="4800" '
+     'Fractions="4"/><Prescription Dose="6000"/></Prescriptions>',
+     [(4800.0, 4), (6000.0, None)]),
+    ('<Name>A</Name><Description>48 Gy in 4F or 60Gy/5F</Description>',
+     [(4800.0, 4), (6000.0, 5)]),
+    ('<Name>SABR 54 in 3</Name><Description>Lung</Description>',
+     [(5400.0, 3)]),
+    ('<Name>Lung</Name><Description>Lung</Description>', [])])
+def test_prescription_schedules(report_text, expected):
+    '''Schedules come from Prescription elements, then the description,
+    then the report name.'''
+    report_def = ET.fromstring('<Report>{}</Report>'.format(report_text))
+    assert load_prescriptions(report_def) == expected
+
+
+def test_prescription_match_scores():
+    '''Matching dose and fractions score 1, a matching dose alone 0.25.'''
+    schedules = [(4800.0, 4), (6000.0, None)]
+    assert prescription_match(schedules, 4800.0, 4) == 1.0
+    assert prescription_match(schedules, 4810.0) == 1.0
+    assert prescription_match(schedules, 4800.0, 8) == 0.25
+    assert prescription_match(schedules, 6000.0, 8) == 1.0
+    assert prescription_match(schedules, 5400.0, 3) == 0.0
+    assert prescription_match(schedules, None) == 0.0
+    assert prescription_match([], 4800.0, 4) == 0.0
+
+
+#%% Ranking
+def test_reports_are_ranked_by_coverage_and_prescription(make_plan):
+    '''Reports matching more plan structures rank higher, and the
+    prescription separates reports with the same coverage.'''
+    plan = make_plan({'PTV': (10.0, CURVE), 'Cord': (5.0, CURVE)},
+                     dose=5400.0)
+    reports = {
+        'Partial': make_definition('Partial', structure_items('PTV', 'Heart')),
+        'Other Dose': make_definition('Other Dose',
+                                      structure_items('PTV', 'Cord'),
+                                      prescriptions=[(4800, 4)]),
+        'Same Dose': make_definition('Same Dose',
+                                     structure_items('PTV', 'Cord'),
+                                     prescriptions=[(5400, 3)])}
+    ranking = rank_reports(reports, plan)
+    assert [score.report_name for score in ranking] == [
+        'Same Dose', 'Other Dose', 'Partial']
+    assert [score.coverage for score in ranking] == [1.0, 1.0, 0.5]
+    assert ranking[0].prescription == 1.0
+    assert select_report(reports, plan) == 'Same Dose'
+
+
+def test_plan_description_fractions_are_used(make_plan):
+    '''A plan description gives the dose and fractions for the ranking.'''
+    plan = make_plan({'PTV': (10.0, CURVE)})
+    reports = {'Four': make_definition('Four', structure_items('PTV'),
+                                       prescriptions=[(4800, 4)]),
+               'Eight': make_definition('Eight', structure_items('PTV'),
+                                        prescriptions=[(4800, 8)])}
+    plan_desc = PlanDescription(plan.dvh_data_file, 'DVH', 'Test, Patient',
+                                '0001', 'LUNG', dose=4800.0, fractions=8)
+    ranking = rank_reports(reports, plan, plan_desc)
+    assert [(score.report_name, score.prescription)
+            for score in ranking] == [('Eight', 1.0), ('Four', 0.25)]
+    assert select_report(dict(), plan) is None
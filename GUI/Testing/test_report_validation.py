@@ -0,0 +1,118 @@
+'''Tests for checking report items and their targets when a report
+definition is loaded.
+'''
+
+#%% imports etc.
+import xml.etree.ElementTree as ET
+import pytest
+from plan_report import ReportDefinitionError, Target, cell_position
+from plan_report import is_percent_format
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+class SheetCell():
+    '''A stand in for an Excel range.'''
+    def __init__(self):
+        self.number_format = None
+        self.value = None
+
+
+class Sheet(dict):
+    '''A stand in for an Excel worksheet, keyed by (row, column).'''
+    def range(self, cell):
+        return self.setdefault(cell, SheetCell())
+
+
+def make_target(cell: str = None, cell_format: str = None,
+                unit: str = None)->Target:
+    '''Build a Target from its element values.'''
+    target_def = ET.Element('Target')
+    for tag, text in (('Unit', unit), ('CellAddress', cell),
+                      ('CellFormat', cell_format)):
+        if text:
+            ET.SubElement(target_def, tag).text = text
+    return Target(target_def)
+
+
+#%% Targets
+@pytest.mark.parametrize('cell_address, position', [
+    ('A1', (1, 1)), ('$G$12', (12, 7)), ('aa3', (3, 27)),
+    ('XFD1048576', (1048576, 16384))])
+def test_cell_positions(cell_address, position):
+    '''A1 style addresses give (row, column), starting from 1.'''
+    assert cell_position(cell_address) == position
+    assert make_target(cell_address).cell == position
+
+
+@pytest.mark.parametrize('cell_address', ['A0', 'XFE1', 'A1:B2', 'Total'])
+def test_invalid_cell_addresses(cell_address):
+    '''Ranges, names and cells outside the worksheet are not valid.'''
+    with pytest.raises(ValueError):
+        cell_position(cell_address)
+    target = make_target(cell_address)
+    assert target.cell is None
+    assert target.validate() == [
+        'Invalid CellAddress {}'.format(cell_address)]
+
+
+@pytest.mark.parametrize('cell_format, percent', [
+    ('0.0%', True), ('0%;-0%', True), ('0.00', False), (None, False),
+    ('0.0" %"', False), ('0.0\\%', False), ('"of "0%', True)])
+def test_percent_formats(cell_format, percent):
+    '''Quoted and escaped % signs are not percent formats.'''
+    assert is_percent_format(cell_format) is percent
+    assert make_target('A1', cell_format).percent is percent
+
+
+def test_values_are_entered_in_the_precomputed_cell():
+    '''Percent formatted cells are given the value as a fraction.'''
+    sheet = Sheet()
+    make_target('B2', '0.0%').add_value(95.0, sheet)
+    make_target('C3', '0.00').add_value(95.0, sheet)
+    make_target('D4').add_value('Text', sheet)
+    assert {cell: (sheet_cell.number_format, sheet_cell.value)
+            for cell, sheet_cell in sheet.items()} == {
+                (2, 2): ('0.0%', pytest.approx(0.95)),
+                (3, 3): ('0.00', 95.0),
+                (4, 4): (None, 'Text')}
+
+
+#%% Report Items
+def test_valid_items_are_accepted():
+    '''Structure properties, DVH points and items without a target are
+    valid.'''
+    items = [report_item('Volume', reference=structure_reference('PTV'),
+                         constructor='Volume', unit='cc', cell='A1'),
+             report_item('V20', reference=structure_reference('Lung'),
+                         constructor='V20Gy', unit='%', cell='A2'),
+             report_item('Mean', reference=structure_reference('Heart'),
+                         constructor='Mean Dose')]
+    definition = make_definition('Valid', items)
+    assert list(definition.report_elements) == ['Volume', 'V20', 'Mean']
+
+
+def test_all_problems_are_reported_together():
+    '''Every invalid item in a report is listed in one error.'''
+    ptv = structure_reference('PTV')
+    items = [report_item('Volume', reference=ptv, constructor='Volume',
+                         unit='cc', cell='A1'),
+             report_item('Volume', reference=ptv, constructor='Volume',
+                         unit='cc', cell='A2'),
+             report_item('Bad', reference=ptv, constructor='Mean Volume'),
+             report_item('Dose', reference=ptv, constructor='D95rad'),
+             report_item('Cell', reference=ptv, constructor='Volume',
+                         unit='ml', cell='Total'),
+             report_item('Type', reference='<Type>Isocentre</Type>'),
+             report_item('Missing')]
+    with pytest.raises(ReportDefinitionError) as error:
+        make_definition('Invalid', items)
+    assert error.value.report_name == 'Invalid'
+    assert error.value.problems == [
+        'Volume: Duplicate ReportItem name',
+        'Bad: Unknown Structure constructor "Mean Volume"',
+        'Dose: Unknown constructor unit D95rad',
+        'Cell: Invalid CellAddress Total',
+        'Cell: Unknown Target Unit ml',
+        'Type: Unknown PlanReference Type Isocentre',
+        'Missing: No PlanReference or Expression']
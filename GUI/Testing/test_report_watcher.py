@@ -0,0 +1,155 @@
+'''Tests for reloading changed report definitions while the GUI is open.
+'''
+
+#%% imports etc.
+import os
+from pathlib import Path
+import pytest
+from build_plan_report import ReportWatcher, apply_report_update
+from build_plan_report import load_config_snapshot
+from plan_report import ReportCache, ReportCatalog
+from GUI.Testing.sample_data import report_item, report_xml
+from GUI.Testing.sample_data import structure_reference, write_reports
+
+
+CONFIG_FILE_NAME = 'PlanEvaluationConfig.xml'
+REPO_CONFIG = Path(__file__).resolve().parents[2] / CONFIG_FILE_NAME
+PTV_ITEMS = [report_item('PTV', reference=structure_reference('PTV'),
+                         constructor='Volume', unit='cc', cell='A1')]
+
+
+def write_report_file(report_file, *report_names, mtime):
+    '''Write a report definition file and set its modification time.'''
+    write_reports(report_file, *[report_xml(name, PTV_ITEMS)
+                                 for name in report_names])
+    os.utime(str(report_file), ns=(mtime, mtime))
+    return report_file
+
+
+def set_mtime(file_path: Path, mtime: int):
+    '''Set the modification time of a file in nanoseconds.'''
+    os.utime(str(file_path), ns=(mtime, mtime))
+
+
+@pytest.fixture
+def watched(tmp_path, monkeypatch):
+    '''Return a watcher for a catalog of the reports in tmp_path/Reports.'''
+    monkeypatch.chdir(tmp_path)
+    config_file = tmp_path / CONFIG_FILE_NAME
+    config_file.write_bytes(REPO_CONFIG.read_bytes())
+    set_mtime(config_file, 10**18)
+    report_dir = tmp_path / 'Reports'
+    report_dir.mkdir()
+    write_report_file(report_dir / 'A.xml', 'First', mtime=10**18)
+    write_report_file(report_dir / 'B.xml', 'Second', mtime=10**18)
+    settings = load_config_snapshot(tmp_path, CONFIG_FILE_NAME)
+    settings = settings._replace(report_locations=(report_dir,),
+                                 template_path=report_dir)
+    report_cache = ReportCache()
+    report_cache.refresh([report_dir], max_workers=1,
+                         **settings.report_parameters())
+    catalog = ReportCatalog(report_cache)
+    watcher = ReportWatcher(catalog, settings, notify=list().append)
+    return watcher, catalog, report_dir
+
+
+#%% Changes
+def test_unchanged_files_give_no_update(watched):
+    '''Nothing is read when no file has changed.'''
+    (watcher, _, _) = watched
+    assert watcher.check() is None
+
+
+def test_changed_report_files_are_read(watched, tmp_path):
+    '''Only the changed file is read, and the catalog is updated when the
+    change is applied.'''
+    (watcher, catalog, report_dir) = watched
+    write_report_file(report_dir / 'A.xml', 'Renamed', mtime=2 * 10**18)
+    update = watcher.check()
+    assert update.changes.changed == [report_dir / 'A.xml']
+    assert [list(reports) for _, reports in update.report_files] == [
+        ['Renamed']]
+    assert watcher.check() is None
+    apply_report_update(catalog, update, tmp_path / 'ReportCache.pkl')
+    assert sorted(catalog) == ['Renamed', 'Second']
+
+
+#%% Configuration Changes
+def test_changed_report_directories_are_watched(watched, tmp_path):
+    '''The report directories listed in a changed configuration file are
+    watched in place of the previous ones.'''
+    (watcher, catalog, report_dir) = watched
+    other_dir = tmp_path / 'Other'
+    other_dir.mkdir()
+    write_report_file(other_dir / 'C.xml', 'Third', mtime=10**18)
+    config_file = tmp_path / CONFIG_FILE_NAME
+    config_text = config_file.read_text(encoding='utf-8')
+    config_file.write_text(config_text.replace(
+        '<Directory>.\\Data</Directory>', '<Directory>Other</Directory>'),
+                           encoding='utf-8')
+    set_mtime(config_file, 2 * 10**18)
+    update = watcher.check()
+    assert watcher.report_locations == [other_dir.resolve()]
+    assert update.changes.changed == [other_dir.resolve() / 'C.xml']
+    apply_report_update(catalog, update, tmp_path / 'ReportCache.pkl')
+    assert sorted(catalog) == ['Third']
+    write_report_file(report_dir / 'A.xml', 'Ignored', mtime=3 * 10**18)
+    assert watcher.check() is None
+
+
+#%% Failures
+def test_damaged_report_files_are_read_again(watched, tmp_path):
+    '''A report file that can not be parsed is left out of the update,
+    keeps its reports, and is read again once it is fixed.'''
+    (watcher, catalog, report_dir) = watched
+    damaged = report_dir / 'A.xml'
+    damaged.write_text('<ReportDefinitions><Report><Name>')
+    set_mtime(damaged, 2 * 10**18)
+    write_report_file(report_dir / 'B.xml', 'Changed', mtime=2 * 10**18)
+    write_report_file(report_dir / 'C.xml', 'New', mtime=2 * 10**18)
+    update = watcher.check()
+    assert update.changes.changed == [report_dir / 'B.xml',
+                                      report_dir / 'C.xml']
+    assert not update.changes.removed
+    assert watcher.sources[str(damaged)] == 10**18
+    apply_report_update(catalog, update, tmp_path / 'ReportCache.pkl')
+    assert sorted(catalog) == ['Changed', 'First', 'New']
+    assert watcher.check() is None
+    write_report_file(damaged, 'Fixed', mtime=3 * 10**18)
+    update = watcher.check()
+    assert [list(reports) for _, reports in update.report_files] == [
+        ['Fixed']]
+
+
+def test_damaged_new_report_files_are_not_recorded(watched):
+    '''A new report file that can not be parsed is not added to the
+    watched sources.'''
+    (watcher, _, report_dir) = watched
+    damaged = report_dir / 'C.xml'
+    damaged.write_text('<ReportDefinitions><Report><Name>')
+    set_mtime(damaged, 2 * 10**18)
+    assert watcher.check() is None
+    assert str(damaged) not in watcher.sources
+    write_report_file(damaged, 'Fixed', mtime=3 * 10**18)
+    update = watcher.check()
+    assert update.changes.changed == [damaged]
+
+
+def test_damaged_config_files_are_read_again(watched, tmp_path):
+    '''A configuration file that can not be parsed is not used, and is
+    read again once it is fixed.'''
+    (watcher, catalog, _) = watched
+    settings = watcher.settings
+    config_file = tmp_path / CONFIG_FILE_NAME
+    config_text = config_file.read_text(encoding='utf-8')
+    config_file.write_text('<PlanEvaluation>')
+    set_mtime(config_file, 2 * 10**18)
+    assert watcher.check() is None
+    assert watcher.settings is settings
+    assert sorted(catalog) == ['First', 'Second']
+    config_file.write_text(config_text, encoding='utf-8')
+    set_mtime(config_file, 2 * 10**18)
+    update = watcher.check()
+    assert update.settings is watcher.settings
+    assert watcher.settings is not settings
+    assert watcher.config_mtime == 2 * 10**18
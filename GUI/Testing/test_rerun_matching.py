@@ -0,0 +1,110 @@
+'''Tests for matching a report again after the plan is reloaded.
+'''
+
+#%% imports etc.
+from plan_report import MatchHistory, Report, rerun_matching
+from GUI.Testing.sample_data import make_definition, report_item
+from GUI.Testing.sample_data import structure_reference
+
+
+CURVE = [(0.0, 100.0), (6000.0, 0.0)]
+PTV = ('Structure', 'PTV', None)
+CORD = ('Structure', 'Cord', None)
+HEART = ('Structure', 'Heart', None)
+
+
+def rerun_report()->Report:
+    '''A report with exact, aliased and unmatched references.'''
+    references = [('PTV', structure_reference('PTV')),
+                  ('Cord', structure_reference('Cord',
+                                               aliases=['SpinalCord'])),
+                  ('Heart', structure_reference('Heart'))]
+    items = [report_item(name, reference=reference, constructor='Volume',
+                         unit='cc', cell='A{}'.format(row))
+             for row, (name, reference) in enumerate(references, 1)]
+    return Report(make_definition('Rerun', items))
+
+
+def matched_names(report: Report):
+    '''Return the match method and matched name of each reference.'''
+    return {index: (reference['match_method'], reference.matched_name)
+            for index, reference in report.references.items()}
+
+
+def manual(report: Report, reference_index, plan_item: str):
+    '''Return a manual match of a reference to a plan item.'''
+    match = report.references[reference_index].match
+    return match._replace(match_status='Manual', plan_Item=plan_item)
+
+
+#%% Affected References
+def test_all_references_are_matched_for_a_new_laterality(make_plan):
+    '''An unmatched report, or a plan with another laterality, needs a full
+    match.'''
+    report = rerun_report()
+    plan = make_plan({'PTV': (10.0, CURVE)})
+    assert report.affected_references(plan) is None
+    report.match_elements(plan)
+    assert report.affected_references(plan) == set()
+    lateral = make_plan({'PTV': (10.0, CURVE)}, file_name='lateral.dvh',
+                        plan_name='LUNR')
+    assert report.affected_references(lateral) is None
+
+
+def test_only_references_with_changed_candidates_are_affected(make_plan):
+    '''Exact matches are kept when other names change; references without
+    an exact match depend on every name of their type.'''
+    report = rerun_report()
+    plan = make_plan({'PTV': (10.0, CURVE), 'Cord': (5.0, CURVE)})
+    report.match_elements(plan)
+    added = make_plan({'PTV': (10.0, CURVE), 'Cord': (5.0, CURVE),
+                       'SpinalCord': (6.0, CURVE)}, file_name='added.dvh')
+    assert report.affected_references(added) == {CORD, HEART}
+    removed = make_plan({'PTV': (10.0, CURVE)}, file_name='removed.dvh')
+    assert report.affected_references(removed) == {CORD, HEART}
+
+
+#%% Rerun Matching
+def test_rerun_matches_only_the_affected_references(make_plan, monkeypatch):
+    '''Unaffected references are re-pointed to the reloaded plan and the
+    result equals a full match.'''
+    report = rerun_report()
+    plan = make_plan({'PTV': (10.0, CURVE), 'SpinalCord': (5.0, CURVE)})
+    report.match_elements(plan)
+    reloaded = make_plan({'PTV': (10.0, CURVE), 'Cord': (5.0, CURVE)},
+                         file_name='reloaded.dvh')
+    requested = list()
+    match_elements = Report.match_elements
+    def recorded_match(self, plan, reference_indexes=None):
+        requested.append(reference_indexes)
+        return match_elements(self, plan, reference_indexes)
+    monkeypatch.setattr(Report, 'match_elements', recorded_match)
+    rerun_matching(report, reloaded, MatchHistory())
+    assert requested == [{CORD, HEART}]
+    assert report.references[PTV]['plan_element'] is \
+        reloaded.get_data_element('Structure', 'PTV')
+    full = rerun_report()
+    full.match_elements(reloaded)
+    assert matched_names(report) == matched_names(full)
+
+
+def test_manual_matches_are_reapplied(make_plan):
+    '''Manual matches survive a reload, and their reference is matched
+    again only if the manually matched element was removed.'''
+    report = rerun_report()
+    plan = make_plan({'PTV': (10.0, CURVE), 'Cardiac': (5.0, CURVE)})
+    report.match_elements(plan)
+    history = MatchHistory()
+    heart = report.references[HEART].match
+    change = manual(report, HEART, 'Cardiac')
+    report.update_ref(change, plan)
+    history.add(heart, change)
+    same_names = make_plan({'PTV': (20.0, CURVE), 'Cardiac': (6.0, CURVE)},
+                           file_name='same.dvh')
+    assert report.affected_references(same_names) == set()
+    rerun_matching(report, same_names, history)
+    assert matched_names(report)[HEART] == ('Manual', 'Cardiac')
+    assert report.references[HEART]['plan_element'] is \
+        same_names.get_data_element('Structure', 'Cardiac')
+    removed = make_plan({'PTV': (20.0, CURVE)}, file_name='removed.dvh')
+    assert report.affected_references(removed) == {CORD, HEART}
@@ -4,9 +4,9 @@
 #%% imports etc.
 import os
 import sys
+import multiprocessing
 import textwrap as tw
 from pathlib import Path
-from copy import deepcopy
 from functools import partial
 from operator import attrgetter
 import xml.etree.ElementTree as ET
@@ -17,9 +17,13 @@ import xlwings as xw
 import PySimpleGUI as sg
 
 from build_plan_report import load_config, update_reports, load_reports, run_report, load_dvh
-from build_plan_report import IconPaths
+from build_plan_report import IconPaths, load_match_memo, load_config_snapshot
+from build_plan_report import ReportWatcher, ConfigSnapshot, apply_report_update
+from plan_report import ReportCatalog
+from build_plan_report import load_learned_aliases
 from plan_report import Report, ReferenceGroup, MatchList, MatchHistory, rerun_matching
-from plan_data import DvhFile, Plan, PlanItemLookup, PlanElements, scan_for_dvh, PlanDescription, get_default_units, get_laterality_exceptions, find_plan_files
+from plan_report import ReportDefinition, select_report
+from plan_data import DvhFile, Plan, PlanItemLookup, PlanElements, scan_for_dvh, PlanDescription, find_plan_files
 from match_window import manual_match
 from UpdateReports import update_report_definitions
 
@@ -193,6 +197,23 @@ def update_report_header(window: sg.Window, report: Report):
     window['template_sheet'].update(value=wrapped_sheet)
 
 
+def watch_reports(window: sg.Window, report_definitions: ReportCatalog,
+                  settings: ConfigSnapshot)->ReportWatcher:
+    '''Start watching for changed report definitions.
+    Each change is posted to the window as a 'reports_changed' event.
+    Arguments:
+        window {sg.Window} -- The main GUI window.
+        report_definitions {ReportCatalog} -- The loaded reports.
+        settings {ConfigSnapshot} -- The configuration settings.
+    Returns:
+        ReportWatcher -- The running watcher thread.
+    '''
+    notify = partial(window.write_event_value, 'reports_changed')
+    watcher = ReportWatcher(report_definitions, settings, notify)
+    watcher.start()
+    return watcher
+
+
 #%% Actions
 # Plan Status  Text Colour disabled
 def make_report_selection_list(report_definitions):
@@ -200,7 +221,7 @@ def make_report_selection_list(report_definitions):
     report_list += [str(ky) for ky in report_definitions.keys()]
     return report_list
 
-def make_actions_column(report_definitions: Dict[str, Report]):
+def make_actions_column(report_definitions: Dict[str, ReportDefinition]):
     '''Report Selection GUI
     '''
     report_list = make_report_selection_list(report_definitions)
@@ -253,16 +274,12 @@ def main():
     icons = IconPaths(icon_path)
     #%% Load Config file and Report definitions
     config_file = 'PlanEvaluationConfig.xml'
-    config = load_config(base_path, config_file)
-    report_definitions = load_reports(config)
-    plan_dict = find_plan_files(config)
-
-    code_exceptions_def = config.find('LateralityCodeExceptions')
-    plan_parameters = dict(
-        default_units=get_default_units(config),
-        laterality_exceptions=get_laterality_exceptions(code_exceptions_def),
-        name='Plan'
-        )
+    settings = load_config_snapshot(base_path, config_file)
+    report_definitions = load_reports(settings)
+    match_memo = load_match_memo(settings)
+    learned_aliases = load_learned_aliases(settings)
+    plan_dict = find_plan_files(None, settings.dvh_directory)
+    plan_parameters = settings.plan_parameters(name='Plan')
 
     #%% Initial Plan Settings
     load_plan_config = {
@@ -313,6 +330,8 @@ def main():
     report = None
     active_plan = None
     selected_plan_desc = None
+    # Matches of all pooled report references to the active plan.
+    pool_matches = None
     history = MatchHistory()
     sg.change_look_and_feel('LightGreen')
     sg.SetOptions(element_padding=(0,0), margins=(0,0))
@@ -329,6 +348,7 @@ def main():
                        debugger_enabled=True,
                        finalize=True,
                        element_justification="left")
+    watcher = watch_reports(window, report_definitions, settings)
 
     while True:
         event, values = window.Read(timeout=2000)
@@ -339,6 +359,25 @@ def main():
             break
         elif event == sg.TIMEOUT_KEY:
             continue
+        elif event == 'reports_changed':
+            update = values[event]
+            updated = apply_report_update(report_definitions, update)
+            pool_matches = None
+            settings = update.settings
+            plan_parameters = settings.plan_parameters(name='Plan')
+            if report and report.name in updated:
+                definition = report_definitions.get(report.name)
+                report = Report(definition) if definition else None
+                window['generate_report'].update(**generate_config[None])
+                if report:
+                    update_report_header(window, report)
+                else:
+                    window['match_structures'].update(**match_config[None])
+            report_list = make_report_selection_list(report_definitions)
+            selected = report.name if report else report_list[0]
+            window['report_selector'].update(values=report_list,
+                                             value=selected)
+            window.refresh()
         elif event in 'Plan_tree':
             plan_desc = values['Plan_tree'][0]
             selected_plan_desc = plan_dict.get(plan_desc)
@@ -347,7 +386,8 @@ def main():
                 window['load_plan'].update(**load_plan_config['Selected'])
         elif event in 'report_selector':
             selected_report = values['report_selector']
-            report = deepcopy(report_definitions.get(selected_report))
+            definition = report_definitions.get(selected_report)
+            report = Report(definition) if definition else None
             if report:
                 update_report_header(window, report)
                 if active_plan:
@@ -356,8 +396,19 @@ def main():
             window['load_plan'].update(**load_plan_config['Loading'])
             window.refresh()
             active_plan = load_dvh(selected_plan_desc, **plan_parameters)
+            pool_matches = None
             if active_plan:
                 window['load_plan'].update(**load_plan_config['Loaded'])
+                if not report:
+                    # Pre-select the report that best fits the plan.
+                    selected_report = select_report(report_definitions,
+                                                    active_plan,
+                                                    selected_plan_desc)
+                    definition = report_definitions.get(selected_report)
+                    report = Report(definition) if definition else None
+                    if report:
+                        window['report_selector'].update(value=selected_report)
+                        update_report_header(window, report)
                 window.refresh()
                 if report:
                     window['match_structures'].update(**match_config['Selected'])
@@ -366,26 +417,46 @@ def main():
         elif event in 'match_structures':
             window['match_structures'].update(**match_config['Matching'])
             window.refresh()
-            rerun_matching(report, active_plan, history)
-            report = manual_match(report, active_plan, icons)
+            if not match_memo.recall(report, active_plan):
+                if pool_matches is None:
+                    reference_pool = report_definitions.reference_pool
+                    pool_matches = reference_pool.match_elements(active_plan)
+                rerun_matching(report, active_plan, history, pool_matches)
+            report = manual_match(report, active_plan, icons,
+                                  learned_aliases)
+            learned_aliases.save(settings.learned_alias_file)
+            match_memo.store(report, active_plan)
+            match_memo.save(settings.match_memo_file)
             window['match_structures'].update(**match_config['Matched'])
             window['generate_report'].update(**generate_config['Matched'])
         elif event in 'generate_report':
             window['generate_report'].update(**generate_config['Generating'])
             window.refresh()
-            run_report(active_plan, report)
+            run_report(active_plan, report, selected_plan_desc.fractions)
             window['generate_report'].update(**generate_config['Generated'])
         elif event in 'update_report_definitions':
-            report_definitions = update_report_definitions(config, base_path)
+            config = load_config(base_path, config_file)
+            new_definitions = update_report_definitions(config, base_path)
+            if new_definitions is not None:
+                report_definitions = new_definitions
+                pool_matches = None
+                # The config file may have changed since it was last read.
+                settings = load_config_snapshot(base_path, config_file)
+                plan_parameters = settings.plan_parameters(name='Plan')
+                watcher.stop()
+                watcher = watch_reports(window, report_definitions, settings)
             report_list = make_report_selection_list(report_definitions)
             window['report_selector'].update(values=report_list)
             window.refresh()
+    watcher.stop()
 
 
 
 #%% Run Tests
 
 if __name__ == '__main__':
+    # Needed for the report loading worker processes in the frozen build.
+    multiprocessing.freeze_support()
     main()
 
 
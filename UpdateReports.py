@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 from pathlib import Path
+import multiprocessing
 from typing import Any, Dict, Tuple, List
 import xml.etree.ElementTree as ET
 import PySimpleGUI as sg
-from build_plan_report import load_config, update_reports
+from build_plan_report import load_config, update_reports, report_cache_file
 
 '''
     Update the Report Definition Pickle file
@@ -106,7 +107,7 @@ def update_report_definitions(config, base_path, report_locations=None):
     '''Define Folder Paths, load report and plan data.
     '''
     default_directories = config.find(r'./DefaultDirectories')
-    pickle_file = Path(default_directories.findtext('ReportPickleFile'))
+    pickle_file = report_cache_file(config)
     if not report_locations:
          report_dirs = get_report_dir_list(config)
          report_list = report_dir_list(base_path, report_dirs)
@@ -131,7 +132,7 @@ def main():
     config_file = 'PlanEvaluationConfig.xml'
     config = load_config(base_path, config_file)
     default_directories = config.find(r'./DefaultDirectories')
-    pickle_file = Path(default_directories.findtext('ReportPickleFile'))
+    pickle_file = report_cache_file(config)
     report_dirs = get_report_dir_list(config)
     report_list = report_dir_list(base_path, report_dirs)
     new_report_locations = select_locations(report_list, base_path)
@@ -147,5 +148,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # Needed for the report loading worker processes in the frozen build.
+    multiprocessing.freeze_support()
     main()
 
@@ -3,18 +3,36 @@
 
 
 #%% imports etc.
-from typing import Any, Dict, Tuple, List
-from copy import deepcopy
+from typing import Any, Callable, Dict, Tuple, List, FrozenSet, NamedTuple
+from typing import Union
 from operator import attrgetter
 from pathlib import Path
+from pickle import dump, load, UnpicklingError
+import logging
+import threading
 import xml.etree.ElementTree as ET
-from pickle import dump, load
 
-from plan_report import Report, read_report_files
+from plan_report import Report, ReportDefinition, ReportCache, ReportCatalog
+from plan_report import MatchMemo, LearnedAliases
+from plan_report import ReferencePool, ReportChanges
+from plan_report import scan_report_files, load_report_files
 from plan_report import load_default_laterality
 from plan_report import load_aliases, load_laterality_table
 from plan_data import DvhFile, Plan, PlanDescription, find_plan_files
 from plan_data import get_default_units, get_laterality_exceptions, DvhSource
+from dose_models import DoseModel, load_dose_models, apply_dose_models
+from plan_metrics import ConformitySettings, load_conformity_settings
+from plan_metrics import apply_conformity_indices
+from report_conditions import failed_conditions
+from plan_report import AliasRef, LateralityRef
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Increase whenever the ConfigSnapshot fields change.
+CONFIG_CACHE_SCHEMA = 1
+# Seconds between checks for changed report definitions.
+WATCH_INTERVAL = 2.0
 
 
 class IconPaths(dict):
@@ -69,63 +87,582 @@ def load_config(base_path: Path, config_file_name: str)->ET.Element:
     config = config_tree.getroot()
     return config
 
+
+#%% Configuration Snapshot
+class ConfigSnapshot(NamedTuple):
+    '''The fully parsed configuration settings.
+    Built once from the XML configuration file and treated as read only.
+    The snapshot only contains plain data, so it is cheap to pickle and pass
+    to worker processes.
+    Attributes:
+        config_file {Path} -- The XML configuration file.
+        default_units {Dict[str, str]} -- The default units for plan data.
+        laterality_exceptions {FrozenSet[str]} -- Body region codes that do
+            not indicate laterality.
+        template_path {Path} -- The directory containing report templates.
+        alias_reference {AliasRef} -- The alias table.
+        laterality_lookup {LateralityRef} -- The laterality table.
+        lat_patterns {List[str]} -- The default laterality name patterns.
+        report_locations {Tuple[Path, ...]} -- The report definition
+            directories.
+        report_cache_file {Path} -- The report definition cache.
+        match_memo_file {Path} -- The match memo file.
+        learned_alias_file {Path} -- The learned alias file.
+        dvh_directory {Path} -- The default .dvh file directory.
+        dvh_file {Path} -- The default .dvh file name.
+        dose_models {List[DoseModel]} -- The radiobiological models.
+        conformity {ConformitySettings} -- The conformity index structure
+            names, or None.
+    Methods
+        report_parameters()->Dict[str, Any]
+            The ReportDefinition keyword arguments.
+        plan_parameters(**parameters)->Dict[str, Any]
+            The keyword arguments for load_dvh.
+    '''
+    config_file: Path
+    default_units: Dict[str, str]
+    laterality_exceptions: FrozenSet[str]
+    template_path: Path
+    alias_reference: AliasRef
+    laterality_lookup: LateralityRef
+    lat_patterns: List[str]
+    report_locations: Tuple[Path, ...]
+    report_cache_file: Path
+    match_memo_file: Path
+    learned_alias_file: Path
+    dvh_directory: Path
+    dvh_file: Path
+    dose_models: List[DoseModel]
+    conformity: ConformitySettings
+
+    def report_parameters(self)->Dict[str, Any]:
+        '''The ReportDefinition keyword arguments.
+        Learned aliases are not included; they are added by load_reports.
+        Returns:
+            Dict[str, Any] -- See the ReportDefinition class for details.
+        '''
+        return dict(template_path=self.template_path,
+                    alias_reference=self.alias_reference,
+                    laterality_lookup=self.laterality_lookup,
+                    lat_patterns=self.lat_patterns)
+
+    def plan_parameters(self, **parameters)->Dict[str, Any]:
+        '''The keyword arguments for load_dvh.
+        Keyword Arguments:
+            parameters {dict} -- Additional arguments, such as the plan name.
+        Returns:
+            Dict[str, Any] -- The Plan constructor arguments, dose models
+                and conformity settings.
+        '''
+        return dict(default_units=self.default_units,
+                    laterality_exceptions=self.laterality_exceptions,
+                    dose_models=self.dose_models,
+                    conformity=self.conformity,
+                    **parameters)
+
+
+ConfigSource = Union[ET.Element, ConfigSnapshot]
+
+
+def optional_path(path_text: str)->Path:
+    '''Convert a path from the config file, allowing for missing entries.
+    Arguments:
+        path_text {str} -- The path text, or None.
+    Returns:
+        Path -- The path, or None.
+    '''
+    if path_text:
+        return Path(path_text)
+    return None
+
+
+def compile_config(config: ET.Element,
+                   config_file: Path = None)->ConfigSnapshot:
+    '''Parse all configuration settings.
+    Arguments:
+        config {ET.Element} -- The root element of the XML config data.
+    Keyword Arguments:
+        config_file {Path} -- The file the config data was read from.
+            (default: {None})
+    Returns:
+        ConfigSnapshot -- The parsed settings.
+    '''
+    default_directories = config.find(r'./DefaultDirectories')
+    code_exceptions_def = config.find('LateralityCodeExceptions')
+    return ConfigSnapshot(
+        config_file=config_file,
+        default_units=get_default_units(config),
+        laterality_exceptions=get_laterality_exceptions(code_exceptions_def),
+        template_path=Path(default_directories.findtext('ReportTemplates')),
+        alias_reference=load_aliases(config.find('AliasList')),
+        laterality_lookup=load_laterality_table(config.find('LateralityTable')),
+        lat_patterns=load_default_laterality(
+            config.find('DefaultLateralityPatterns')),
+        report_locations=tuple(report_directories(config)),
+        report_cache_file=report_cache_file(config),
+        match_memo_file=match_memo_file(config),
+        learned_alias_file=learned_alias_file(config),
+        dvh_directory=optional_path(default_directories.findtext('DVH')),
+        dvh_file=optional_path(default_directories.findtext('DVH_File')),
+        dose_models=load_dose_models(config),
+        conformity=load_conformity_settings(config))
+
+
+def as_snapshot(config: ConfigSource)->ConfigSnapshot:
+    '''Return the parsed configuration settings.
+    Arguments:
+        config {ConfigSource} -- A ConfigSnapshot, or the root element of the
+            XML config data.
+    Returns:
+        ConfigSnapshot -- The parsed settings.
+    '''
+    if isinstance(config, ConfigSnapshot):
+        return config
+    return compile_config(config)
+
+
+def config_cache_file(config_path: Path)->Path:
+    '''Return the path to the compiled configuration cache.
+    Arguments:
+        config_path {Path} -- The XML configuration file.
+    Returns:
+        Path -- A .pkl file next to the configuration file.
+    '''
+    return config_path.with_suffix('.pkl')
+
+
+def load_config_snapshot(base_path: Path,
+                         config_file_name: str)->ConfigSnapshot:
+    '''Load the parsed configuration settings.
+    The settings are read from the configuration cache if it was written
+    for the current version of the XML configuration file and the current
+    working directory (report directories are resolved relative to it).
+    Otherwise the XML file is parsed and the cache is rewritten.
+    Arguments:
+        base_path {Path} -- The directory containing the config file.
+        config_file_name {str} -- The name of configuration file.
+    Returns:
+        ConfigSnapshot -- The parsed settings.
+    '''
+    config_path = base_path / config_file_name
+    cache_file = config_cache_file(config_path)
+    config_stat = config_path.stat()
+    cache_key = dict(schema=CONFIG_CACHE_SCHEMA,
+                     mtime=config_stat.st_mtime_ns,
+                     size=config_stat.st_size,
+                     working_directory=str(Path.cwd().resolve()))
+    try:
+        with open(str(cache_file), 'rb') as file:
+            (cached_key, snapshot) = load(file)
+    except (OSError, EOFError, UnpicklingError, AttributeError,
+            ImportError, TypeError, ValueError) as err:
+        LOGGER.debug('Configuration cache not loaded: %s', err)
+    else:
+        if cached_key == cache_key:
+            return snapshot
+    snapshot = compile_config(load_config(base_path, config_file_name),
+                              config_path)
+    try:
+        with open(str(cache_file), 'wb') as file:
+            dump((cache_key, snapshot), file)
+    except OSError as err:
+        LOGGER.warning('Configuration cache not saved: %s', err)
+    return snapshot
+
 #%% Report loading Methods
-def update_reports(config: ET.Element,
+def report_directories(config: ET.Element)->List[Path]:
+    '''Return the report definition directories defined in the config file.
+    Arguments:
+        config {ET.Element} -- An XML element containing default paths.
+    Returns:
+        List[Path] -- Full paths to folders containing Report definition .xml
+            files.
+    '''
+    report_locations = list()
+    report_path_element = config.find(r'./DefaultDirectories/ReportDefinitions')
+    for location in report_path_element.findall('Directory'):
+        report_locations.append(Path(location.text).resolve())
+    return report_locations
+
+
+def report_cache_file(config: ET.Element)->Path:
+    '''Return the path to the report definition cache.
+    Arguments:
+        config {ET.Element} -- An XML element containing default paths.
+    Returns:
+        Path -- The ReportCacheFile path from the config file.  For older
+            config files, ReportCache.pkl in the same directory as the
+            ReportPickleFile.
+    '''
+    default_directories = config.find(r'./DefaultDirectories')
+    cache_file = default_directories.findtext('ReportCacheFile')
+    if cache_file:
+        return Path(cache_file)
+    pickle_file = Path(default_directories.findtext('ReportPickleFile'))
+    return pickle_file.parent / 'ReportCache.pkl'
+
+
+def load_report_parameters(config: ConfigSource)->Dict[str, Any]:
+    '''Load the initial parameters and tables used to define reports.
+    Learned aliases are not included; they are added by load_reports.
+    Arguments:
+        config {ConfigSource} -- The configuration settings.
+    Returns:
+        Dict[str, Any] -- The ReportDefinition keyword arguments.  See the
+            ReportDefinition class for details.
+    '''
+    return as_snapshot(config).report_parameters()
+
+
+def report_catalog(config: ConfigSource,
+                   report_cache: ReportCache)->ReportCatalog:
+    '''Return a catalog of the reports in the cache.
+    Reports are loaded when first requested, with the learned aliases
+    added.
+    Arguments:
+        config {ConfigSource} -- The configuration settings.
+        report_cache {ReportCache} -- The report definitions.
+    Returns:
+        ReportCatalog -- The report definitions, keyed by report name.
+    '''
+    settings = as_snapshot(config)
+    # Reports share references with the same name and aliases.
+    reference_pool = ReferencePool(settings.laterality_lookup,
+                                   settings.lat_patterns)
+    # Add aliases learned since the report definitions were built.
+    learned_aliases = load_learned_aliases(settings).alias_reference()
+    return ReportCatalog(report_cache, reference_pool, learned_aliases)
+
+
+def update_reports(config: ConfigSource,
                    report_locations: List[Path] = None,
-                   pickle_file: Path = None)->Dict[str, Report]:
+                   pickle_file: Path = None)->ReportCatalog:
     '''Read in all report definitions from the XML report files
-    located in the given directories.  Store the report definitions as a pickle file.
-    Load the initial parameters and tables.
+    located in the given directories.  Store the report definitions in the
+    report cache.
     Arguments:
-        config {ET.Element} -- An XML element containing default paths.
+        config {ConfigSource} -- The configuration settings.
         report_locations {List[Path]} -- A list of full paths to folders
             containing Report definition .xml files.  If not given, the paths
             defined in the config file are used.
-        config_file {str} -- The name of the config file.
+        pickle_file {Path} -- The report cache file.  If not given, the
+            path defined in the config file is used.
     Returns:
-        Tuple[ET.Element, Dict[str, Report]] -- The configuration data and the
-            report parameters.
+        ReportCatalog -- The report definitions, keyed by report name.
     '''
-    default_directories = config.find(r'./DefaultDirectories')
+    settings = as_snapshot(config)
     if not report_locations:
-        report_locations = list()
-        report_path_element = default_directories.find('ReportDefinitions')
-        for location in report_path_element.findall('Directory'):
-            report_locations.append(Path(location.text).resolve())
-    template_path = Path(default_directories.findtext('ReportTemplates'))
+        report_locations = list(settings.report_locations)
     if not pickle_file:
-        pickle_file = Path(default_directories.findtext('ReportPickleFile'))
-    alias_def = config.find('AliasList')
-    laterality_lookup_def = config.find('LateralityTable')
-    default_patterns_def = config.find('DefaultLateralityPatterns')
-    report_parameters = dict(
-        report_locations=report_locations,
-        template_path=template_path,
-        alias_reference=load_aliases(alias_def),
-        laterality_lookup=load_laterality_table(laterality_lookup_def),
-        lat_patterns=load_default_laterality(default_patterns_def))
-    report_definitions = read_report_files(**report_parameters)
-    file = open(str(pickle_file), 'wb')
-    dump(report_definitions, file)
-    file.close()
-    return report_definitions
-
-
-def load_reports(config: ET.Element,
-                 pickle_file: Path = None)->Dict[str, Report]:
-    default_directories = config.find(r'./DefaultDirectories')
+        pickle_file = settings.report_cache_file
+    report_cache = ReportCache()
+    report_cache.refresh(report_locations, **settings.report_parameters())
+    report_cache.save(pickle_file)
+    return report_catalog(settings, report_cache)
+
+
+def load_reports(config: ConfigSource,
+                 pickle_file: Path = None)->ReportCatalog:
+    '''Load the report definitions from the report cache.
+    Report definition files added, changed or removed since the cache was
+    saved are re-read, and the updated cache is saved.  The report
+    directories last used with update_reports are checked; if there are
+    none, the paths defined in the config file are used.
+    Arguments:
+        config {ConfigSource} -- The configuration settings.
+        pickle_file {Path} -- The report cache file.  If not given, the
+            path defined in the config file is used.
+    Returns:
+        ReportCatalog -- The report definitions, keyed by report name.  Only
+            the report summaries are read until a report is requested.
+    '''
+    settings = as_snapshot(config)
     if not pickle_file:
-        pickle_file = Path(default_directories.findtext('ReportPickleFile'))
-    file = open(str(pickle_file), 'rb')
-    report_definitions = load(file)
-    return report_definitions
+        pickle_file = settings.report_cache_file
+    report_cache = ReportCache.load(pickle_file)
+    report_locations = [Path(location) for location in report_cache.locations]
+    if not report_locations:
+        report_locations = list(settings.report_locations)
+    if report_cache.refresh(report_locations, **settings.report_parameters()):
+        report_cache.save(pickle_file)
+    return report_catalog(settings, report_cache)
+
+
+def data_file(config: ET.Element, file_tag: str, default_name: str)->Path:
+    '''Return the path to a local data file.
+    Arguments:
+        config {ET.Element} -- An XML element containing default paths.
+        file_tag {str} -- The DefaultDirectories tag containing the path.
+        default_name {str} -- The file name to use if the tag is not found.
+    Returns:
+        Path -- The path from the config file, or default_name in the same
+            directory as the report cache file.
+    '''
+    default_directories = config.find(r'./DefaultDirectories')
+    file_path = default_directories.findtext(file_tag)
+    if file_path:
+        return Path(file_path)
+    return report_cache_file(config).parent / default_name
+
+
+def match_memo_file(config: ET.Element)->Path:
+    '''Return the path to the match memo file.
+    Arguments:
+        config {ET.Element} -- An XML element containing default paths.
+    Returns:
+        Path -- The MatchMemoFile path from the config file.
+    '''
+    return data_file(config, 'MatchMemoFile', 'MatchMemo.pkl')
+
+
+def learned_alias_file(config: ET.Element)->Path:
+    '''Return the path to the learned alias file.
+    Arguments:
+        config {ET.Element} -- An XML element containing default paths.
+    Returns:
+        Path -- The LearnedAliasFile path from the config file.
+    '''
+    return data_file(config, 'LearnedAliasFile', 'LearnedAliases.xml')
+
+
+def load_learned_aliases(config: ConfigSource)->LearnedAliases:
+    '''Load the aliases learned from previous manual matches.
+    Arguments:
+        config {ConfigSource} -- The configuration settings.
+    Returns:
+        LearnedAliases -- The learned aliases.
+    '''
+    if isinstance(config, ConfigSnapshot):
+        return LearnedAliases.load(config.learned_alias_file)
+    return LearnedAliases.load(learned_alias_file(config))
+
+
+def load_match_memo(config: ConfigSource)->MatchMemo:
+    '''Load the stored report matches for previously seen plans.
+    Arguments:
+        config {ConfigSource} -- The configuration settings.
+    Returns:
+        MatchMemo -- The stored matches.
+    '''
+    if isinstance(config, ConfigSnapshot):
+        return MatchMemo.load(config.match_memo_file)
+    return MatchMemo.load(match_memo_file(config))
+
+
+#%% Report Watcher
+class ReportUpdate(NamedTuple):
+    '''Report definitions read after a change to the report files or the
+    configuration file.
+    Attributes:
+        settings {ConfigSnapshot} -- The current configuration settings.
+        settings_fingerprint {str} -- The fingerprint of the report
+            parameters used to read the reports.
+        changes {ReportChanges} -- The changed report definition files.
+        report_files {List[Tuple[Path, Dict[str, ReportDefinition]]]} --
+            The reports read from the changed files.
+    '''
+    settings: ConfigSnapshot
+    settings_fingerprint: str
+    changes: ReportChanges
+    report_files: List[Tuple[Path, Dict[str, ReportDefinition]]]
+
+
+class ReportWatcher(threading.Thread):
+    '''A background thread that watches the report definition directories
+    and the configuration file.
+    The changed report files are read in the watcher thread, and the result
+    is passed to notify as a ReportUpdate.  The watcher does not change the
+    catalog; the update is applied with apply_report_update by the thread
+    that uses the catalog.
+    Arguments:
+        catalog {ReportCatalog} -- The loaded reports.
+        settings {ConfigSnapshot} -- The configuration settings.
+        notify {Callable[[ReportUpdate], None]} -- Called from the watcher
+            thread with each update.  e.g. a GUI window's write_event_value
+            method, with the event key bound.
+    Keyword Arguments:
+        poll_interval {float} -- Seconds between checks.
+            (default: {WATCH_INTERVAL})
+    Methods
+        check()->ReportUpdate
+            Read any report definitions changed since the last check.
+        stop()
+            Stop watching.
+    '''
+    def __init__(self, catalog: ReportCatalog, settings: ConfigSnapshot,
+                 notify: Callable[[ReportUpdate], None],
+                 poll_interval: float = WATCH_INTERVAL):
+        '''Start from the state of the catalog's report cache.
+        Arguments:
+            catalog {ReportCatalog} -- The loaded reports.
+            settings {ConfigSnapshot} -- The configuration settings.
+            notify {Callable[[ReportUpdate], None]} -- Called with each
+                update.
+        Keyword Arguments:
+            poll_interval {float} -- Seconds between checks.
+                (default: {WATCH_INTERVAL})
+        '''
+        super().__init__(name='ReportWatcher', daemon=True)
+        report_cache = catalog.report_cache
+        self.settings = settings
+        self.notify = notify
+        self.poll_interval = poll_interval
+        self.report_locations = [Path(location)
+                                 for location in report_cache.locations]
+        if not self.report_locations:
+            self.report_locations = list(settings.report_locations)
+        self.sources = dict(report_cache.sources)
+        self.settings_fingerprint = report_cache.settings
+        self.config_mtime = self.config_time()
+        self.stop_event = threading.Event()
+
+    def config_time(self)->int:
+        '''The modification time of the configuration file.
+        Returns:
+            int -- The time in nanoseconds, or None if the file is unknown
+                or can not be read.
+        '''
+        config_file = self.settings.config_file
+        if not config_file:
+            return None
+        try:
+            return config_file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self)->ReportUpdate:
+        '''Read any report definitions changed since the last check.
+        If the configuration file has changed, it is read again and the
+        report directories it lists are watched.  All reports are read again
+        if the report parameters have changed.  The watcher state is only
+        changed once the configuration has been read.  A report file that
+        can not be parsed is left out of the update and read again at the
+        next check; the reports previously read from it are kept.
+        Returns:
+            ReportUpdate -- The changes, or None if nothing has changed or
+                no changed file could be parsed.
+        '''
+        settings = self.settings
+        report_locations = self.report_locations
+        config_mtime = self.config_time()
+        if config_mtime != self.config_mtime:
+            config_file = settings.config_file
+            try:
+                settings = load_config_snapshot(config_file.parent,
+                                                config_file.name)
+            except ET.ParseError as err:
+                LOGGER.warning('Configuration not reloaded: %s', err)
+                return None
+            report_locations = list(settings.report_locations)
+        parameters = settings.report_parameters()
+        fingerprint = ReportCache.settings_fingerprint(parameters)
+        if fingerprint == self.settings_fingerprint:
+            sources = self.sources
+        else:
+            sources = dict()
+        changes = scan_report_files(report_locations, sources)
+        (changes, report_files) = self.read_changes(changes, sources,
+                                                    parameters)
+        settings_changed = settings is not self.settings
+        self.config_mtime = config_mtime
+        self.report_locations = report_locations
+        self.sources = dict(changes.current)
+        self.settings = settings
+        self.settings_fingerprint = fingerprint
+        if not changes.count and not settings_changed:
+            return None
+        return ReportUpdate(settings, fingerprint, changes, report_files)
+
+    @staticmethod
+    def read_changes(changes: ReportChanges, sources: Dict[str, int],
+                     parameters: Dict[str, Any]
+                     )->Tuple[ReportChanges,
+                              List[Tuple[Path, Dict[str, ReportDefinition]]]]:
+        '''Read the changed report files one at a time.
+        A file that can not be parsed is dropped from the changes.  It keeps
+        its previous modification time, if it had one, so that its reports
+        are not removed and it is read again at the next check.
+        Arguments:
+            changes {ReportChanges} -- The changed report definition files.
+            sources {Dict[str, int]} -- The modification times from the
+                previous scan.
+            parameters {Dict[str, Any]} -- parameters used to define
+                reports.  See the ReportDefinition class for details.
+        Returns:
+            Tuple[ReportChanges,
+                  List[Tuple[Path, Dict[str, ReportDefinition]]]] --
+                The changes that were read and the reports read from each
+                changed file.
+        '''
+        current = dict(changes.current)
+        changed = list()
+        report_files = list()
+        for report_file in changes.changed:
+            try:
+                report_files.extend(load_report_files([report_file],
+                                                      max_workers=1,
+                                                      **parameters))
+            except ET.ParseError as err:
+                LOGGER.warning('Report definitions in %s not reloaded: %s',
+                               report_file, err)
+                source = str(report_file)
+                if source in sources:
+                    current[source] = sources[source]
+                else:
+                    del current[source]
+                continue
+            changed.append(report_file)
+        return (ReportChanges(current, changed, changes.removed),
+                report_files)
+
+    def run(self):
+        '''Check for changes until stopped.
+        '''
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                update = self.check()
+            except OSError as err:
+                LOGGER.warning('Report definitions not checked: %s', err)
+                continue
+            if update:
+                self.notify(update)
+
+    def stop(self):
+        '''Stop watching.
+        '''
+        self.stop_event.set()
+
+
+def apply_report_update(catalog: ReportCatalog, update: ReportUpdate,
+                        pickle_file: Path = None)->List[str]:
+    '''Apply the changes found by a ReportWatcher and save the report cache.
+    Arguments:
+        catalog {ReportCatalog} -- The loaded reports.
+        update {ReportUpdate} -- The changes.
+    Keyword Arguments:
+        pickle_file {Path} -- The report cache file.  If not given, the
+            path defined in the config file is used.
+    Returns:
+        List[str] -- The names of the reports removed, added or replaced.
+    '''
+    settings = update.settings
+    if update.settings_fingerprint != catalog.report_cache.settings:
+        catalog.reference_pool = ReferencePool(settings.laterality_lookup,
+                                               settings.lat_patterns)
+    updated = catalog.apply_changes(update.changes, update.report_files,
+                                    update.settings_fingerprint)
+    if updated or update.changes.count:
+        if not pickle_file:
+            pickle_file = settings.report_cache_file
+        catalog.report_cache.save(pickle_file)
+    return updated
 
 
 #%% Plan loading Methods
-def get_dvh(config: ET.Element, dvh_loc: DvhSource = None)->DvhFile:
+def get_dvh(config: ConfigSource, dvh_loc: DvhSource = None)->DvhFile:
     '''Identify a dvh plan file.
     Arguments:
-        config {ET.Element} -- An XML element containing default paths.
+        config {ConfigSource} -- The configuration settings.
         dvh_loc {DvhSource} -- A DvhFile object, the path, to a .dvh file,
             the name of a .dvh file in the default DVH directory, or a
             directory containing .dvh files. If not given,
@@ -133,53 +670,57 @@ def get_dvh(config: ET.Element, dvh_loc: DvhSource = None)->DvhFile:
     Returns:
         DvhFile -- The requested or the default .dvh file.
     '''
-    default_directories = config.find(r'./DefaultDirectories')
+    settings = as_snapshot(config)
     if isinstance(dvh_loc, DvhFile):
         dvh_data_source = dvh_loc
     elif isinstance(dvh_loc, Path):
         if dvh_loc.is_file():
             dvh_data_source = DvhFile(dvh_loc)
         elif dvh_loc.is_dir():
-            dvh_file_name = Path(default_directories.findtext('DVH_File'))
-            dvh_file = dvh_loc / dvh_file_name
+            dvh_file = dvh_loc / settings.dvh_file
             dvh_data_source = DvhFile(dvh_file)
         else:
             return None
     elif isinstance(dvh_loc, str):
-        dvh_dir = Path(default_directories.findtext('DVH'))
-        dvh_file = dvh_path / dvh_loc
+        dvh_file = settings.dvh_directory / dvh_loc
         dvh_data_source = DvhFile(dvh_file)
     else:
-        dvh_dir = Path(default_directories.findtext('DVH'))
-        dvh_file_name = Path(default_directories.findtext('DVH_File'))
-        dvh_file = dvh_dir / dvh_file_name
+        dvh_file = settings.dvh_directory / settings.dvh_file
         dvh_data_source = DvhFile(dvh_file)
     return dvh_data_source
 
 
-def load_plan(config, plan_path: DvhSource, name='Plan', type='DVH')->Plan:
+def load_plan(config: ConfigSource, plan_path: DvhSource, name='Plan',
+              type='DVH', fractions: int = None)->Plan:
     '''Load plan data from the specified file or folder.
     Arguments:
-        config {ET.Element} -- An XML element containing default paths.
+        config {ConfigSource} -- The configuration settings.
         dvh_loc {DvhSource} -- A DvhFile object, the path, to a .dvh file,
             the name of a .dvh file in the default DVH directory, or a
             directory containing .dvh files. If not given,
             the default DVH directory in config will be used.
+    Keyword Arguments:
+        fractions {int} -- The number of fractions, used for the EQD2
+            conversion of the dose models, as in load_dvh.
+            (default: {None})
     Returns:
         Plan -- The requested or the default plan.
     '''
-    default_units = get_default_units(config)
-    code_exceptions_def = config.find('LateralityCodeExceptions')
-    laterality_exceptions = get_laterality_exceptions(code_exceptions_def)
+    settings = as_snapshot(config)
     if type in 'DVH':
-        dvh_file = get_dvh(config, plan_path)
-        plan = Plan(default_units, laterality_exceptions, dvh_file, name)
+        dvh_file = get_dvh(settings, plan_path)
+        plan = Plan(settings.default_units, settings.laterality_exceptions,
+                    dvh_file, name)
+        apply_dose_models(plan, settings.dose_models, fractions)
+        if settings.conformity:
+            apply_conformity_indices(plan, settings.conformity)
     else:
         plan = None
     return plan
 
 
-def load_dvh(plan_desc: PlanDescription, **plan_parameters)->Plan:
+def load_dvh(plan_desc: PlanDescription, dose_models: List[DoseModel] = None,
+             conformity: ConformitySettings = None, **plan_parameters)->Plan:
     '''Load plan data from the specified file or folder.
     Arguments:
         config {ET.Element} -- An XML element containing default paths.
@@ -187,27 +728,50 @@ def load_dvh(plan_desc: PlanDescription, **plan_parameters)->Plan:
             the name of a .dvh file in the default DVH directory, or a
             directory containing .dvh files. If not given,
             the default DVH directory in config will be used.
+        dose_models {List[DoseModel]} -- Radiobiological models to evaluate
+            for the plan structures. (default: {None})
+        conformity {ConformitySettings} -- The structure names used to
+            calculate conformity indices. (default: {None})
     Returns:
         Plan -- The requested or the default plan.
     '''
     plan_file = plan_desc.plan_file
     dvh_file = DvhFile(plan_file)
     plan = Plan(dvh_data=dvh_file, **plan_parameters)
+    if dose_models:
+        apply_dose_models(plan, dose_models, plan_desc.fractions)
+    if conformity:
+        apply_conformity_indices(plan, conformity)
     return plan
 
 
 #%% Generate report
-def run_report(plan: Plan, report: Report):
-    report.get_values(plan)
+def run_report(plan: Plan, report: Report, fractions: int = None):
+    '''Get the report values, check the report conditions and fill in the
+    report spreadsheet.
+    Arguments:
+        plan {Plan} -- The plan data.
+        report {Report} -- The matched report.
+    Keyword Arguments:
+        fractions {int} -- The plan number of fractions, used to select the
+            condition limits. (default: {None})
+    '''
+    report.get_values(plan, fractions)
+    failed = failed_conditions(report.conditions, include_warnings=True)
+    for result in failed:
+        LOGGER.warning('%s: %s %s = %s (limit %s %s)', result.status,
+                       result.name, result.item, result.value,
+                       result.comparator, result.limit)
     report.build()
 
 
-def build_report(config: ET.Element, report_definitions: Dict[str, Report],
+def build_report(config: ET.Element,
+                 report_definitions: Dict[str, ReportDefinition],
                  report_name: str, plan_file_name: Path,
                  save_file=None, plan_name='plan'):
     '''Load plan data and generate report.
     '''
-    report = deepcopy(report_definitions[report_name])
+    report = Report(report_definitions[report_name])
     if save_file:
         report.save_file = save_file
     plan = Plan(config, plan_name, DvhFile(plan_file_name))
@@ -229,7 +793,7 @@ def main():
 
     # Select a Report
     report_name = 'SABR 48 in 4'
-    #report = deepcopy(report_definitions[report_name])
+    #report = Report(report_definitions[report_name])
 
     # Load Plan File
     #dvh_file_name = 'test.dvh'
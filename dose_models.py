@@ -0,0 +1,314 @@
+'''Radiobiological dose models (LKB NTCP and logistic TCP) evaluated from
+plan DVH data.
+
+Model parameters are defined per structure in the DoseModels section of
+the config file.  All structures of a plan are evaluated in a single
+vectorised pass on a common dose grid, and the same functions accept
+stacked volume arrays to evaluate many plans at once.  Results are stored
+as structure properties so that report items can reference them with the
+constructors 'NTCP', 'TCP', 'NTCP gEUD' and 'TCP gEUD'.
+'''
+
+#%% imports etc.
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+import xml.etree.ElementTree as ET
+import logging
+import numpy as np
+from scipy.special import ndtr
+from plan_data import Plan, Structure, convert_units
+
+
+LOGGER = logging.getLogger(__name__)
+
+DOSE_GRID_STEP = 10.0  # cGy
+MODEL_TYPES = ('NTCP', 'TCP')
+# The structure property holding the gEUD used by each model type.
+GEUD_PROPERTIES = {model_type: model_type + ' gEUD'
+                   for model_type in MODEL_TYPES}
+
+
+#%% Model Parameters
+class DoseModel(NamedTuple):
+    '''Parameters for a radiobiological model applied to one structure.
+    Attributes:
+        structure {str} -- The name of the plan structure the model applies to.
+        model_type {str} -- One of 'NTCP' (Lyman-Kutcher-Burman) or 'TCP'
+            (Niemierko logistic).
+        volume_effect {float} -- The volume effect parameter, n.  The gEUD
+            exponent is a = 1/n.  Use a negative value for TCP models.
+        d50 {float} -- The dose in Gy giving a 50% response (TD50 or TCD50).
+        slope {float} -- m for NTCP models, gamma50 for TCP models.
+        alpha_beta {optional, float} -- The alpha/beta ratio in Gy used to
+            convert the DVH to EQD2 when the number of fractions is known.
+    '''
+    structure: str
+    model_type: str
+    volume_effect: float
+    d50: float
+    slope: float
+    alpha_beta: float = None
+
+
+def load_dose_models(config: ET.Element)->List[DoseModel]:
+    '''Read the radiobiological model parameters from the config file.
+    Arguments:
+        config {ET.Element} -- An XML element containing a DoseModels
+            section.  Each Model element has Type and Structure attributes
+            and n, D50, Slope and optional AlphaBeta sub-elements.
+    Returns:
+        List[DoseModel] -- The model definitions.  Empty if the config does
+            not define any models.
+    '''
+    models = list()
+    models_root = config.find('DoseModels')
+    if models_root is None:
+        return models
+    for element in models_root.findall('Model'):
+        model_type = element.attrib.get('Type', 'NTCP')
+        if model_type not in MODEL_TYPES:
+            LOGGER.warning('Unknown dose model type %s ignored.', model_type)
+            continue
+        alpha_beta = element.findtext('AlphaBeta')
+        model = DoseModel(
+            structure=element.attrib.get('Structure'),
+            model_type=model_type,
+            volume_effect=float(element.findtext('n')),
+            d50=float(element.findtext('D50')),
+            slope=float(element.findtext('Slope')),
+            alpha_beta=float(alpha_beta) if alpha_beta else None)
+        models.append(model)
+    return models
+
+
+#%% Vectorised Model Calculations
+def make_dose_grid(max_dose: float, step: float = DOSE_GRID_STEP)->np.array:
+    '''Build a dose grid covering 0 to max_dose.
+    Arguments:
+        max_dose {float} -- The highest dose required in cGy.
+        step {float} -- The grid spacing in cGy. (default: {DOSE_GRID_STEP})
+    Returns:
+        np.array -- Evenly spaced doses in cGy.
+    '''
+    return np.arange(0.0, max_dose + 2*step, step)
+
+
+def max_dose(structure: Structure)->float:
+    '''Return the highest dose in a structure's DVH curve.
+    Arguments:
+        structure {Structure} -- A structure containing DVH data.
+    Returns:
+        float -- The highest dose in cGy.
+    '''
+    dvh = structure.dose_data
+    (dose_column, _, dvh_unit) = dvh.select_columns('cGy', 'Volume')
+    highest = dvh.dvh_curve[dose_column].max()
+    if dvh_unit:
+        highest = convert_units(highest, dvh_unit, 'cGy')
+    return highest
+
+
+def stack_structures(structures: Sequence[Structure],
+                     dose_grid: np.array)->np.array:
+    '''Resample the cumulative DVHs of a group of structures onto a common
+    dose grid.
+    Arguments:
+        structures {Sequence[Structure]} -- The structures to stack.  Missing
+            structures (None) give a row of NaN.
+        dose_grid {np.array} -- The dose grid in cGy.
+    Returns:
+        np.array -- An (n_structures, n_bins) array of cumulative volume.
+    '''
+    volumes = np.full((len(structures), len(dose_grid)), np.nan)
+    for index, structure in enumerate(structures):
+        if structure and structure.dose_data:
+            volumes[index] = structure.dose_data.resample(dose_grid, 'cGy')
+    return volumes
+
+
+def differential_dvh(dose_grid: np.array,
+                     volumes: np.array)->Tuple[np.array, np.array]:
+    '''Convert cumulative DVHs into normalised differential form.
+    Arguments:
+        dose_grid {np.array} -- The dose grid in cGy.
+        volumes {np.array} -- Cumulative volumes with the dose bins along
+            the last axis.
+    Returns:
+        Tuple[np.array, np.array] -- The bin centre doses in Gy and the
+            fractional volume in each bin.
+    '''
+    bin_dose = (dose_grid[:-1] + dose_grid[1:]) / 200.0
+    bin_volume = -np.diff(volumes, axis=-1)
+    total = volumes[..., :1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bin_volume = np.clip(bin_volume / total, 0.0, None)
+    return bin_dose, bin_volume
+
+
+def generalized_eud(bin_dose: np.array, bin_volume: np.array,
+                    volume_effect: np.array)->np.array:
+    '''Calculate the generalised equivalent uniform dose.
+    Arguments:
+        bin_dose {np.array} -- Bin doses in Gy, broadcastable against
+            bin_volume.
+        bin_volume {np.array} -- Fractional bin volumes with the dose bins
+            along the last axis.
+        volume_effect {np.array} -- The n parameter for each row of
+            bin_volume.
+    Returns:
+        np.array -- The gEUD in Gy, with the dose axis removed.
+    '''
+    exponent = 1.0 / np.asarray(volume_effect, dtype=float)[..., np.newaxis]
+    # Avoid 0**(negative a) for TCP models; empty bins carry no weight.
+    dose = np.maximum(bin_dose, 1e-6)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        weighted = np.sum(bin_volume * dose**exponent, axis=-1)
+        geud = weighted**(1.0 / exponent[..., 0])
+    return geud
+
+
+def eqd2(bin_dose: np.array, alpha_beta: np.array,
+         fractions: int = None)->np.array:
+    '''Convert bin doses to the equivalent dose in 2 Gy fractions.
+    Arguments:
+        bin_dose {np.array} -- Bin doses in Gy.
+        alpha_beta {np.array} -- The alpha/beta ratio for each structure.
+            NaN values leave the dose unchanged.
+        fractions {int} -- The number of fractions.  If None the physical
+            dose is returned unchanged. (default: {None})
+    Returns:
+        np.array -- An (n_structures, n_bins) array of bin doses in Gy.
+    '''
+    alpha_beta = np.asarray(alpha_beta, dtype=float)[:, np.newaxis]
+    dose = np.broadcast_to(bin_dose, (alpha_beta.shape[0], len(bin_dose)))
+    if not fractions:
+        return dose
+    converted = dose * (dose / fractions + alpha_beta) / (2.0 + alpha_beta)
+    return np.where(np.isnan(alpha_beta), dose, converted)
+
+
+def evaluate_models(dose_grid: np.array, volumes: np.array,
+                    models: Sequence[DoseModel],
+                    fractions: int = None)->Dict[str, np.array]:
+    '''Evaluate a set of dose models in one vectorised pass.
+    Arguments:
+        dose_grid {np.array} -- The dose grid in cGy.
+        volumes {np.array} -- Cumulative volumes with shape
+            (..., n_models, n_bins).  Leading axes, such as a plan axis, are
+            evaluated together.
+        models {Sequence[DoseModel]} -- The model for each row of volumes.
+        fractions {int} -- The number of fractions, used for the EQD2
+            conversion. (default: {None})
+    Returns:
+        Dict[str, np.array] -- Arrays with shape (..., n_models) containing:
+            'gEUD' -- The generalised EUD in Gy.
+            'Probability' -- The NTCP or TCP value as a fraction.
+    '''
+    volume_effect = np.array([model.volume_effect for model in models])
+    d50 = np.array([model.d50 for model in models])
+    slope = np.array([model.slope for model in models])
+    alpha_beta = np.array([np.nan if model.alpha_beta is None
+                           else model.alpha_beta for model in models])
+    is_ntcp = np.array([model.model_type == 'NTCP' for model in models])
+
+    bin_dose, bin_volume = differential_dvh(dose_grid, volumes)
+    bin_dose = eqd2(bin_dose, alpha_beta, fractions)
+    geud = generalized_eud(bin_dose, bin_volume, volume_effect)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        ntcp = ndtr((geud - d50) / (slope * d50))
+        tcp = 1.0 / (1.0 + (d50 / geud)**(4.0 * slope))
+    probability = np.where(is_ntcp, ntcp, tcp)
+    return {'gEUD': geud, 'Probability': probability}
+
+
+#%% Plan Level Methods
+def select_models(plan: Plan, models: Sequence[DoseModel])->List[DoseModel]:
+    '''Select the models that apply to structures in the plan.
+    Arguments:
+        plan {Plan} -- The plan data.
+        models {Sequence[DoseModel]} -- All defined models.
+    Returns:
+        List[DoseModel] -- The models whose structure is in the plan and has
+            a DVH.
+    '''
+    structures = plan.data_elements['Structure']
+    selected = list()
+    for model in models:
+        structure = structures.get(model.structure)
+        if structure is None:
+            continue
+        if not structure.dose_data:
+            LOGGER.warning('No DVH for %s; %s model skipped.',
+                           model.structure, model.model_type)
+            continue
+        selected.append(model)
+    return selected
+
+
+def apply_dose_models(plan: Plan, models: Sequence[DoseModel],
+                      fractions: int = None)->Dict[str, Structure]:
+    '''Evaluate all applicable dose models for a plan and store the results
+    as structure properties.
+    The NTCP or TCP value is stored as a percentage under the model type
+    name, and the gEUD is stored in cGy under the model's GEUD_PROPERTIES
+    name, so that NTCP and TCP models with different volume effects on one
+    structure each keep their own gEUD.
+    Arguments:
+        plan {Plan} -- The plan data.
+        models {Sequence[DoseModel]} -- All defined models.
+        fractions {int} -- The number of fractions, used for the EQD2
+            conversion. (default: {None})
+    Returns:
+        Dict[str, Structure] -- The structures that received model values.
+    '''
+    plan_models = select_models(plan, models)
+    if not plan_models:
+        return dict()
+    structures = [plan.get_data_element('Structure', model.structure)
+                  for model in plan_models]
+    dose_grid = make_dose_grid(max(max_dose(structure)
+                                   for structure in structures))
+    volumes = stack_structures(structures, dose_grid)
+    results = evaluate_models(dose_grid, volumes, plan_models, fractions)
+    updated = dict()
+    for index, (model, structure) in enumerate(zip(plan_models, structures)):
+        structure.add_element(dict(name=model.model_type,
+                                   element_type='Plan Property',
+                                   element_value=100*results['Probability'][index],
+                                   unit='%'))
+        structure.add_element(dict(name=GEUD_PROPERTIES[model.model_type],
+                                   element_type='Plan Property',
+                                   element_value=100*results['gEUD'][index],
+                                   unit='cGy'))
+        updated[structure.name] = structure
+        LOGGER.debug('%s for %s: %s', model.model_type, structure.name,
+                     results['Probability'][index])
+    return updated
+
+
+def evaluate_plans(plans: Sequence[Plan], models: Sequence[DoseModel],
+                   dose_grid: np.array = None,
+                   fractions: int = None)->Dict[str, np.array]:
+    '''Evaluate the dose models for many plans in one stacked calculation.
+    Arguments:
+        plans {Sequence[Plan]} -- The plans to evaluate.
+        models {Sequence[DoseModel]} -- All defined models.
+        dose_grid {np.array} -- The common dose grid in cGy.  If not given,
+            a grid covering the highest dose in all plans is used.
+        fractions {int} -- The number of fractions, used for the EQD2
+            conversion. (default: {None})
+    Returns:
+        Dict[str, np.array] -- Arrays with shape (n_plans, n_models).  See
+            evaluate_models.  Structures missing from a plan give NaN.
+    '''
+    structure_sets = [[plan.get_data_element('Structure', model.structure)
+                       for model in models] for plan in plans]
+    if dose_grid is None:
+        highest_dose = max((max_dose(structure)
+                            for structures in structure_sets
+                            for structure in structures
+                            if structure and structure.dose_data),
+                           default=0.0)
+        dose_grid = make_dose_grid(highest_dose)
+    volumes = np.stack([stack_structures(structures, dose_grid)
+                        for structures in structure_sets])
+    return evaluate_models(dose_grid, volumes, models, fractions)
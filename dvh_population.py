@@ -0,0 +1,515 @@
+'''Population statistics for structure DVHs across an archive of plans.
+
+Plans are read one at a time and each structure DVH is resampled onto a
+fixed dose grid and folded into a bounded-memory quantile sketch.  Memory
+use depends only on the dose grid, the volume resolution and the number of
+structures tracked, not on the number of plans.
+
+The same resampled DVHs serve as feature vectors for a nearest-neighbour
+index used to find previous plans with similar structure DVHs.
+'''
+
+#%% imports etc.
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple
+from pathlib import Path
+import logging
+import numpy as np
+from plan_data import DvhFile, Plan, Structure
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+#%% Quantile Sketch
+class QuantileSketch():
+    '''Bounded-memory histogram sketch of the values seen in each bin of a
+    fixed grid.
+    Values are counted in fixed-width levels between lower and upper, so
+    quantiles are exact to within half of the resolution.
+    Arguments:
+        n_bins {int} -- The number of grid bins (e.g. dose points).
+    Keyword Arguments:
+        lower {float} -- The smallest expected value. (default: {0.0})
+        upper {float} -- The largest expected value. (default: {100.0})
+        resolution {float} -- The width of each counting level.
+            (default: {0.1})
+    Attributes:
+        counts {np.array} -- An (n_bins, n_levels) array of value counts.
+        total {int} -- The number of value sets added.
+    Methods:
+        add(values: np.array)
+            Add one or more sets of values to the sketch.
+        quantiles(fractions: Sequence[float])->np.array
+            Return the requested quantiles for each bin.
+    '''
+    def __init__(self, n_bins: int, lower: float = 0.0, upper: float = 100.0,
+                 resolution: float = 0.1):
+        '''Create an empty sketch.
+        Arguments:
+            n_bins {int} -- The number of grid bins.
+        Keyword Arguments:
+            lower {float} -- The smallest expected value. (default: {0.0})
+            upper {float} -- The largest expected value. (default: {100.0})
+            resolution {float} -- The width of each counting level.
+                (default: {0.1})
+        '''
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.resolution = float(resolution)
+        n_levels = int(np.ceil((upper - lower) / resolution)) + 1
+        self.counts = np.zeros((n_bins, n_levels), dtype=np.int32)
+        self.total = 0
+
+    def add(self, values: np.array):
+        '''Add one or more sets of values to the sketch.
+        Values outside the sketch range are counted in the end levels.
+        NaN values are ignored.
+        Arguments:
+            values {np.array} -- An (n_bins,) or (n_sets, n_bins) array.
+        '''
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        (n_bins, n_levels) = self.counts.shape
+        valid = ~np.isnan(values)
+        levels = np.floor((np.nan_to_num(values) - self.lower)
+                          / self.resolution)
+        levels = np.clip(levels, 0, n_levels - 1).astype(np.intp)
+        bins = np.broadcast_to(np.arange(n_bins), values.shape)
+        np.add.at(self.counts, (bins[valid], levels[valid]), 1)
+        self.total += values.shape[0]
+
+    def quantiles(self, fractions: Sequence[float])->np.array:
+        '''Return the requested quantiles for each bin.
+        Arguments:
+            fractions {Sequence[float]} -- Quantiles as fractions between
+                0 and 1.
+        Returns:
+            np.array -- An (n_fractions, n_bins) array.  Bins with no values
+                give NaN.
+        '''
+        cumulative = np.cumsum(self.counts, axis=1)
+        bin_totals = cumulative[:, -1]
+        result = np.full((len(fractions), self.counts.shape[0]), np.nan)
+        for index, fraction in enumerate(fractions):
+            rank = np.maximum(np.ceil(fraction * bin_totals), 1)
+            level = np.argmax(cumulative >= rank[:, np.newaxis], axis=1)
+            value = self.lower + (level + 0.5) * self.resolution
+            value = np.clip(value, self.lower, self.upper)
+            result[index] = np.where(bin_totals > 0, value, np.nan)
+        return result
+
+
+#%% Population DVH
+class PopulationDvh():
+    '''Streaming aggregation of structure DVHs over many plans.
+    Arguments:
+        dose_grid {np.array} -- The fixed dose points at which volumes are
+            collected.
+    Keyword Arguments:
+        dose_unit {str} -- The units of dose_grid.  '%' is relative to the
+            plan prescription dose. (default: {'%'})
+        resolution {float} -- The volume resolution, in %, of the quantile
+            sketches. (default: {0.1})
+        name_map {Dict[str, str]} -- Optional mapping from plan structure
+            names to population structure names.  Structures not in the map
+            keep their plan name. (default: {None})
+    Attributes:
+        sketches {Dict[str, QuantileSketch]} -- One sketch per structure name.
+        plan_count {int} -- The number of plans added.
+    Methods:
+        add_structure(name: str, structure: Structure, **conversion)
+            Add one structure DVH to the population.
+        add_plan(plan: Plan, structure_names: List[str] = None)
+            Add the structure DVHs from a plan.
+        bands(percentiles: Sequence[float])->Dict[str, np.array]
+            Return percentile bands for each structure.
+    '''
+    def __init__(self, dose_grid: np.array, dose_unit: str = '%',
+                 resolution: float = 0.1, name_map: Dict[str, str] = None):
+        '''Create an empty population.
+        Arguments:
+            dose_grid {np.array} -- The fixed dose points.
+        Keyword Arguments:
+            dose_unit {str} -- The units of dose_grid. (default: {'%'})
+            resolution {float} -- The volume resolution in %.
+                (default: {0.1})
+            name_map {Dict[str, str]} -- Plan to population structure names.
+                (default: {None})
+        '''
+        self.dose_grid = np.asarray(dose_grid, dtype=float)
+        self.dose_unit = dose_unit
+        self.resolution = resolution
+        self.name_map = name_map if name_map else dict()
+        self.sketches = dict()
+        self.plan_count = 0
+
+    def add_structure(self, name: str, structure: Structure, **conversion):
+        '''Add one structure DVH to the population.
+        The volumes are collected as % of the structure volume, so cc
+        volume DVHs are converted before they are added to the sketch.
+        Arguments:
+            name {str} -- The population structure name.
+            structure {Structure} -- The structure containing a DVH.
+            conversion {ConversionParameters} -- Data used for any dose unit
+                conversion, usually the prescription 'dose'.
+        '''
+        if not structure.dose_data:
+            return
+        volumes = structure.dose_data.resample(self.dose_grid, self.dose_unit,
+                                               volume_unit='%', **conversion)
+        sketch = self.sketches.get(name)
+        if sketch is None:
+            sketch = QuantileSketch(len(self.dose_grid),
+                                    resolution=self.resolution)
+            self.sketches[name] = sketch
+        sketch.add(volumes)
+
+    def add_plan(self, plan: Plan, structure_names: List[str] = None):
+        '''Add the structure DVHs from a plan.
+        Arguments:
+            plan {Plan} -- The plan data.
+        Keyword Arguments:
+            structure_names {List[str]} -- The population structure names to
+                collect.  If None, all structures are collected.
+                (default: {None})
+        '''
+        conversion = dict(dose=plan.prescription_dose.element_value)
+        for plan_name, structure in plan.data_elements['Structure'].items():
+            name = self.name_map.get(plan_name, plan_name)
+            if structure_names and name not in structure_names:
+                continue
+            self.add_structure(name, structure, **conversion)
+        self.plan_count += 1
+
+    def bands(self, percentiles: Sequence[float] = DEFAULT_PERCENTILES
+             )->Dict[str, np.array]:
+        '''Return percentile bands for each structure.
+        Arguments:
+            percentiles {Sequence[float]} -- The percentiles to report.
+                (default: {DEFAULT_PERCENTILES})
+        Returns:
+            Dict[str, np.array] -- For each structure, an
+                (n_percentiles, n_dose_points) array of volume in %.
+        '''
+        fractions = [pct / 100.0 for pct in percentiles]
+        return {name: sketch.quantiles(fractions)
+                for name, sketch in self.sketches.items()}
+
+
+#%% DVH Shape Index
+class IndexEntry(NamedTuple):
+    '''Identifies one structure DVH stored in a DvhShapeIndex.
+    Attributes:
+        plan_id {str} -- A unique identifier for the plan.
+        structure {str} -- The structure name.
+        body_region {optional, str} -- The body region code of the plan.
+        prescription {optional, float} -- The prescription dose in cGy.
+    '''
+    plan_id: str
+    structure: str
+    body_region: str = None
+    prescription: float = None
+
+
+Neighbour = Tuple[IndexEntry, float]
+PartitionKey = Tuple[str, str, float]
+
+
+class DvhShapeIndex():
+    '''Nearest-neighbour index of structure DVH shapes.
+    Each (plan, structure) is represented by the structure's volume at a
+    fixed set of dose points.  Entries are partitioned by structure name,
+    body region and prescription so that a query only compares against
+    comparable plans.
+    Arguments:
+        dose_points {np.array} -- The dose points used for the feature vector.
+    Keyword Arguments:
+        dose_unit {str} -- The units of dose_points.  '%' is relative to the
+            plan prescription dose. (default: {'%'})
+    Attributes:
+        entries {List[IndexEntry]} -- The identifiers of the indexed DVHs.
+    Methods:
+        feature_vector(structure: Structure, **conversion)->np.array
+            Return the feature vector for a structure DVH.
+        add(entry: IndexEntry, features: np.array)
+            Add a feature vector to the index.
+        add_plan(plan: Plan, plan_id: str = None,
+                 structure_names: List[str] = None)->List[IndexEntry]
+            Add the structure DVHs from a plan.
+        query(features: np.array, structure: str, k: int = 5,
+              body_region: str = None, prescription: float = None
+              )->List[Neighbour]
+            Return the k nearest indexed DVHs.
+        query_plan(plan: Plan, k: int = 5, partition: bool = True,
+                   structure_names: List[str] = None
+                   )->Dict[str, List[Neighbour]]
+            Return the nearest indexed DVHs for each structure in a plan.
+        save(file_name: Path)
+            Save the index as a .npz file.
+        load(file_name: Path)->DvhShapeIndex
+            Load an index saved with save.
+    '''
+    def __init__(self, dose_points: np.array, dose_unit: str = '%'):
+        '''Create an empty index.
+        Arguments:
+            dose_points {np.array} -- The dose points for the feature vector.
+        Keyword Arguments:
+            dose_unit {str} -- The units of dose_points. (default: {'%'})
+        '''
+        self.dose_points = np.asarray(dose_points, dtype=float)
+        self.dose_unit = dose_unit
+        self.entries = list()
+        self._pending = list()
+        self._features = np.empty((0, len(self.dose_points)))
+        self._norms = np.empty(0)
+        self._partitions = dict()
+
+    @staticmethod
+    def partition_key(structure: str, body_region: str = None,
+                      prescription: float = None)->PartitionKey:
+        '''Build the partition key for a structure.
+        Prescriptions are rounded to the nearest cGy.
+        '''
+        if prescription is not None:
+            prescription = round(float(prescription))
+        return (structure, body_region, prescription)
+
+    @staticmethod
+    def plan_keys(plan: Plan)->Tuple[str, float]:
+        '''Return the body region and prescription dose for a plan.
+        The body region is the four letter region code of the plan name,
+        including the laterality letter, as used by Plan.get_laterality.
+        '''
+        return plan.get_body_region(), plan.prescription_dose.element_value
+
+    def feature_vector(self, structure: Structure, **conversion)->np.array:
+        '''Return the feature vector for a structure DVH.
+        Arguments:
+            structure {Structure} -- The structure containing a DVH.
+            conversion {ConversionParameters} -- Data used for any dose unit
+                conversion, usually the prescription 'dose'.
+        Returns:
+            np.array -- The structure volume, in % of the structure volume,
+                at each of the dose points.
+        '''
+        return structure.dose_data.resample(self.dose_points, self.dose_unit,
+                                            volume_unit='%', **conversion)
+
+    def add(self, entry: IndexEntry, features: np.array):
+        '''Add a feature vector to the index.
+        Arguments:
+            entry {IndexEntry} -- The identifier for the DVH.
+            features {np.array} -- The DVH feature vector.
+        '''
+        self.entries.append(entry)
+        self._pending.append(np.asarray(features, dtype=float))
+
+    def add_plan(self, plan: Plan, plan_id: str = None,
+                 structure_names: List[str] = None)->List[IndexEntry]:
+        '''Add the structure DVHs from a plan.
+        Arguments:
+            plan {Plan} -- The plan data.
+        Keyword Arguments:
+            plan_id {str} -- A unique identifier for the plan.  If not given
+                the .dvh file path is used. (default: {None})
+            structure_names {List[str]} -- The structures to index.  If None,
+                all structures with DVH data are indexed. (default: {None})
+        Returns:
+            List[IndexEntry] -- The entries added.
+        '''
+        if plan_id is None:
+            plan_id = str(plan.dvh_data_file)
+        (body_region, prescription) = self.plan_keys(plan)
+        conversion = dict(dose=prescription)
+        added = list()
+        for name, structure in plan.data_elements['Structure'].items():
+            if structure_names and name not in structure_names:
+                continue
+            if not structure.dose_data:
+                continue
+            entry = IndexEntry(plan_id, name, body_region, prescription)
+            self.add(entry, self.feature_vector(structure, **conversion))
+            added.append(entry)
+        return added
+
+    def compile(self):
+        '''Stack pending feature vectors and rebuild the partition lookup.
+        Called automatically by query when entries have been added.
+        '''
+        if self._pending:
+            self._features = np.vstack([self._features,
+                                        np.stack(self._pending)])
+            self._pending = list()
+        self._norms = np.einsum('ij,ij->i', self._features, self._features)
+        partitions = dict()
+        for index, entry in enumerate(self.entries):
+            keys = (self.partition_key(entry.structure),
+                    self.partition_key(*entry[1:]))
+            for key in keys:
+                partitions.setdefault(key, list()).append(index)
+        self._partitions = {key: np.array(indexes, dtype=np.intp)
+                            for key, indexes in partitions.items()}
+
+    def query(self, features: np.array, structure: str, k: int = 5,
+              body_region: str = None,
+              prescription: float = None)->List[Neighbour]:
+        '''Return the k nearest indexed DVHs.
+        If body_region and prescription are both given, only DVHs from the
+        matching partition are compared; otherwise all DVHs of the same
+        structure are compared.
+        Arguments:
+            features {np.array} -- The query feature vector.
+            structure {str} -- The structure name.
+        Keyword Arguments:
+            k {int} -- The number of neighbours to return. (default: {5})
+            body_region {str} -- The body region of the query plan.
+                (default: {None})
+            prescription {float} -- The prescription dose of the query plan.
+                (default: {None})
+        Returns:
+            List[Neighbour] -- (IndexEntry, distance) pairs, closest first.
+                The distance is the RMS volume difference in %.
+        '''
+        if self._pending:
+            self.compile()
+        if body_region is not None and prescription is not None:
+            key = self.partition_key(structure, body_region, prescription)
+        else:
+            key = self.partition_key(structure)
+        candidates = self._partitions.get(key)
+        if candidates is None or not len(candidates):
+            return list()
+        query = np.asarray(features, dtype=float)
+        squared = (self._norms[candidates]
+                   - 2.0 * self._features[candidates] @ query
+                   + query @ query)
+        k = min(k, len(candidates))
+        nearest = np.argpartition(squared, k - 1)[:k]
+        nearest = nearest[np.argsort(squared[nearest])]
+        distance = np.sqrt(np.maximum(squared[nearest], 0.0)
+                           / len(self.dose_points))
+        return [(self.entries[candidates[index]], float(dist))
+                for index, dist in zip(nearest, distance)]
+
+    def query_plan(self, plan: Plan, k: int = 5, partition: bool = True,
+                   structure_names: List[str] = None
+                  )->Dict[str, List[Neighbour]]:
+        '''Return the nearest indexed DVHs for each structure in a plan.
+        Arguments:
+            plan {Plan} -- The plan to compare.
+        Keyword Arguments:
+            k {int} -- The number of neighbours to return. (default: {5})
+            partition {bool} -- Only compare against plans with the same
+                body region and prescription. (default: {True})
+            structure_names {List[str]} -- The structures to compare.  If
+                None, all structures with DVH data are compared.
+                (default: {None})
+        Returns:
+            Dict[str, List[Neighbour]] -- The neighbours for each structure.
+        '''
+        (body_region, prescription) = self.plan_keys(plan)
+        if not partition:
+            body_region = prescription = None
+        conversion = dict(dose=plan.prescription_dose.element_value)
+        neighbours = dict()
+        for name, structure in plan.data_elements['Structure'].items():
+            if structure_names and name not in structure_names:
+                continue
+            if not structure.dose_data:
+                continue
+            features = self.feature_vector(structure, **conversion)
+            neighbours[name] = self.query(features, name, k,
+                                          body_region, prescription)
+        return neighbours
+
+    def save(self, file_name: Path):
+        '''Save the index as a .npz file.
+        Arguments:
+            file_name {Path} -- The file to write.
+        '''
+        if self._pending:
+            self.compile()
+        columns = list(zip(*self.entries)) if self.entries else [()] * 4
+        np.savez(str(file_name),
+                 dose_points=self.dose_points,
+                 dose_unit=np.array(self.dose_unit),
+                 features=self._features,
+                 plan_id=np.array(columns[0], dtype=str),
+                 structure=np.array(columns[1], dtype=str),
+                 body_region=np.array(columns[2], dtype=object),
+                 prescription=np.array(columns[3], dtype=object))
+
+    @classmethod
+    def load(cls, file_name: Path)->'DvhShapeIndex':
+        '''Load an index saved with save.
+        Arguments:
+            file_name {Path} -- The .npz file to read.
+        Returns:
+            DvhShapeIndex -- The loaded index.
+        '''
+        with np.load(str(file_name), allow_pickle=True) as data:
+            index = cls(data['dose_points'], str(data['dose_unit']))
+            columns = zip(data['plan_id'], data['structure'],
+                          data['body_region'], data['prescription'])
+            index.entries = [IndexEntry(str(plan_id), str(structure),
+                                        region, dose)
+                             for (plan_id, structure, region, dose) in columns]
+            index._features = data['features']
+        index.compile()
+        return index
+
+
+#%% Archive Methods
+def iterate_plans(plan_files: Sequence[Path],
+                  **plan_parameters)->Iterator[Plan]:
+    '''Load plans one at a time, skipping files that fail to load.
+    Arguments:
+        plan_files {Sequence[Path]} -- The .dvh files to read.
+        plan_parameters {dict} -- Passed to the Plan constructor
+            (default_units and laterality_exceptions).
+    Yields:
+        Plan -- The next successfully loaded plan.
+    '''
+    for plan_file in plan_files:
+        dvh = DvhFile(plan_file)
+        try:
+            plan = Plan(dvh_data=dvh, **plan_parameters)
+        except (EOFError, OSError, TypeError, ValueError,
+                AttributeError, IndexError) as err:
+            LOGGER.warning('Skipping %s: %s', plan_file, err)
+            continue
+        finally:
+            del dvh  # Close the dvh file
+        yield plan
+
+
+def population_bands(plan_path: Path, dose_grid: np.array,
+                     percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                     structure_names: List[str] = None,
+                     name_map: Dict[str, str] = None,
+                     dose_unit: str = '%',
+                     **plan_parameters)->Dict[str, np.array]:
+    '''Calculate DVH percentile bands for every .dvh file in a directory tree.
+    Arguments:
+        plan_path {Path} -- The top directory of the plan archive.
+        dose_grid {np.array} -- The fixed dose points.
+    Keyword Arguments:
+        percentiles {Sequence[float]} -- The percentiles to report.
+            (default: {DEFAULT_PERCENTILES})
+        structure_names {List[str]} -- The population structure names to
+            collect.  If None, all structures are collected. (default: {None})
+        name_map {Dict[str, str]} -- Plan to population structure names.
+            (default: {None})
+        dose_unit {str} -- The units of dose_grid. (default: {'%'})
+        plan_parameters {dict} -- Passed to the Plan constructor.
+    Returns:
+        Dict[str, np.array] -- For each structure, an
+            (n_percentiles, n_dose_points) array of volume in %.
+    '''
+    population = PopulationDvh(dose_grid, dose_unit, name_map=name_map)
+    plan_files = sorted(plan_path.rglob('*.dvh'))
+    for plan in iterate_plans(plan_files, **plan_parameters):
+        population.add_plan(plan, structure_names)
+    LOGGER.info('Population DVH built from %d plans.', population.plan_count)
+    return population.bands(percentiles)
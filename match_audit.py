@@ -0,0 +1,334 @@
+'''Audit automatic reference matching across an archive of plans.
+
+Every .dvh file in a directory tree is matched against one or more reports
+in a process pool.  The per-plan results are folded into a single summary
+giving, for each report reference, how often it matched automatically, how
+often it needed a manual match, and the plan names that came closest to
+matching it.  Plan structure names that no reference matched are counted
+as well.  References with many manual matches and a consistent near miss
+are the best candidates for new aliases.
+'''
+
+#%% imports etc.
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import csv
+import logging
+from plan_data import Plan
+from plan_report import Report, ReportDefinition, ReferenceIndex
+from plan_report import ReferencePool
+from dvh_population import iterate_plans
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Unmatched references whose best fuzzy name match scores at least this
+# are reported as near misses.
+NEAR_MISS_THRESHOLD = 0.5
+PLANS_PER_TASK = 4
+
+AuditKey = Tuple[str, ReferenceIndex]  # (report name, reference index)
+
+
+#%% Per-plan Results
+class ReferenceOutcome(NamedTuple):
+    '''The match result for one reference in one plan.
+    Attributes:
+        status {str} -- How the reference was matched.  One of:
+            'Auto', 'Suggested' or None if not matched.
+        near_miss {str} -- For references that were not matched
+            automatically, the closest plan element name. (default: {None})
+        score {float} -- The fuzzy name match score of near_miss.
+            (default: {0.0})
+    '''
+    status: str
+    near_miss: str = None
+    score: float = 0.0
+
+
+class PlanAudit(NamedTuple):
+    '''The match results for all audited references in one plan.
+    Attributes:
+        plan_file {str} -- The .dvh file the plan was read from.
+        outcomes {Dict[AuditKey, ReferenceOutcome]} -- The result for each
+            (report name, reference index).
+        unused_names {List[str]} -- Plan structure names that were not
+            matched to any reference.
+    '''
+    plan_file: str
+    outcomes: Dict[AuditKey, ReferenceOutcome]
+    unused_names: List[str]
+
+
+def audit_plan(plan: Plan, reports: Dict[str, Report],
+               plan_file: str = '',
+               reference_pool: ReferencePool = None)->PlanAudit:
+    '''Match a plan against each report and record the outcome for every
+    reference.
+    Arguments:
+        plan {Plan} -- The plan data to match.
+        reports {Dict[str, Report]} -- The reports to audit, keyed by name.
+            The reports' match state is replaced.
+    Keyword Arguments:
+        plan_file {str} -- The file the plan was read from. (default: {''})
+        reference_pool {ReferencePool} -- If given, the plan is matched once
+            with the pooled references of all reports. (default: {None})
+    Returns:
+        PlanAudit -- The match outcomes.
+    '''
+    outcomes = dict()
+    used_names = set()
+    if reference_pool is not None:
+        pool_matches = reference_pool.match_elements(plan)
+    for report_name, report in reports.items():
+        if reference_pool is None:
+            report.match_elements(plan)
+        else:
+            report.apply_matches(pool_matches, plan)
+        compiled = report.match_index(plan.laterality)
+        for reference_index, reference in report.references.items():
+            status = reference['match_method']
+            if status == 'Auto':
+                used_names.add(reference.matched_name)
+                outcome = ReferenceOutcome(status)
+            elif status == 'Suggested':
+                outcome = ReferenceOutcome(status,
+                                           reference['suggested_element'].name,
+                                           reference['match_score'])
+            else:
+                outcome = ReferenceOutcome(None)
+                name_index = plan.get_name_index(reference['reference_type'])
+                if name_index is not None:
+                    names = compiled.candidates[reference_index]
+                    (plan_element, score) = name_index.best_match(names)
+                    if plan_element and score >= NEAR_MISS_THRESHOLD:
+                        outcome = ReferenceOutcome(None, plan_element.name,
+                                                   score)
+            outcomes[(report_name, reference_index)] = outcome
+    unused_names = [name for name in plan.data_elements['Structure']
+                    if name not in used_names]
+    return PlanAudit(str(plan_file), outcomes, unused_names)
+
+
+#%% Worker Methods
+# Each worker process holds its own report runs.
+_WORKER_STATE = dict()
+
+
+def _init_worker(report_definitions: Dict[str, ReportDefinition],
+                 plan_parameters: dict):
+    '''Create the report runs and reference pool and store the plan
+    parameters for the worker process.
+    Arguments:
+        report_definitions {Dict[str, ReportDefinition]} -- The reports to
+            audit.
+        plan_parameters {dict} -- Passed to the Plan constructor.
+    '''
+    _WORKER_STATE['reports'] = {name: Report(definition)
+                                for name, definition
+                                in report_definitions.items()}
+    _WORKER_STATE['reference_pool'] = ReferencePool.from_reports(
+        report_definitions.values())
+    _WORKER_STATE['plan_parameters'] = plan_parameters
+
+
+def _audit_plan_file(plan_file: Path)->PlanAudit:
+    '''Load and audit one plan in a worker process.
+    Arguments:
+        plan_file {Path} -- The .dvh file to read.
+    Returns:
+        PlanAudit -- The match outcomes, or None if the plan could not be
+            loaded.
+    '''
+    plan_parameters = _WORKER_STATE['plan_parameters']
+    plan = next(iterate_plans([plan_file], **plan_parameters), None)
+    if plan is None:
+        return None
+    return audit_plan(plan, _WORKER_STATE['reports'], plan_file,
+                      _WORKER_STATE['reference_pool'])
+
+
+#%% Aggregation
+class AuditRow(NamedTuple):
+    '''Summary of the matching of one report reference.
+    Attributes:
+        report {str} -- The report name.
+        reference_name {str} -- The reference name.
+        reference_type {str} -- The type of PlanElement.
+        laterality {str} -- The reference laterality.
+        plans {int} -- The number of plans audited.
+        matched {int} -- The number of plans matched automatically.
+        suggested {int} -- The number of plans with a fuzzy match suggestion.
+        unmatched {int} -- The number of plans with no match or suggestion.
+        hit_rate {float} -- The fraction of plans matched automatically.
+        near_miss {str} -- The most frequent near miss plan element name.
+        near_miss_count {int} -- The number of plans with that near miss.
+    '''
+    report: str
+    reference_name: str
+    reference_type: str
+    laterality: str
+    plans: int
+    matched: int
+    suggested: int
+    unmatched: int
+    hit_rate: float
+    near_miss: str
+    near_miss_count: int
+
+
+class MatchAudit():
+    '''Aggregated reference match results over many plans.
+    Attributes:
+        plan_count {int} -- The number of plans audited.
+        skipped {List[str]} -- Files that could not be loaded.
+        outcomes {Dict[AuditKey, Counter]} -- Counts of each match status
+            for each reference.
+        near_misses {Dict[AuditKey, Counter]} -- Counts of the near miss
+            plan element names for each reference.
+        unused_names {Counter} -- The number of plans in which each structure
+            name was not matched to any reference.
+    Methods
+        add(plan_audit: PlanAudit)
+            Add the results for one plan.
+        summary()->List[AuditRow]
+            Return one row per reference, most manual matches first.
+        save(file_name: Path)
+            Write the summary table as a .csv file.
+    '''
+    def __init__(self):
+        '''Create an empty audit.
+        '''
+        self.plan_count = 0
+        self.skipped = list()
+        self.outcomes = defaultdict(Counter)
+        self.near_misses = defaultdict(Counter)
+        self.unused_names = Counter()
+
+    def add(self, plan_audit: PlanAudit):
+        '''Add the results for one plan.
+        Arguments:
+            plan_audit {PlanAudit} -- The match outcomes for the plan.
+        '''
+        self.plan_count += 1
+        for audit_key, outcome in plan_audit.outcomes.items():
+            self.outcomes[audit_key][outcome.status] += 1
+            if outcome.near_miss:
+                self.near_misses[audit_key][outcome.near_miss] += 1
+        self.unused_names.update(plan_audit.unused_names)
+
+    def summary(self)->List[AuditRow]:
+        '''Return one row per reference, most manual matches first.
+        Returns:
+            List[AuditRow] -- The summary table.
+        '''
+        rows = list()
+        for audit_key, counts in self.outcomes.items():
+            (report_name, (ref_type, ref_name, ref_lat)) = audit_key
+            plans = sum(counts.values())
+            near_misses = self.near_misses[audit_key].most_common(1)
+            (near_miss, near_miss_count) = (near_misses[0] if near_misses
+                                            else (None, 0))
+            rows.append(AuditRow(report=report_name,
+                                 reference_name=ref_name,
+                                 reference_type=ref_type,
+                                 laterality=ref_lat,
+                                 plans=plans,
+                                 matched=counts['Auto'],
+                                 suggested=counts['Suggested'],
+                                 unmatched=counts[None],
+                                 hit_rate=counts['Auto'] / plans,
+                                 near_miss=near_miss,
+                                 near_miss_count=near_miss_count))
+        rows.sort(key=lambda row: (row.matched - row.plans, row.report,
+                                   row.reference_name))
+        return rows
+
+    def save(self, file_name: Path):
+        '''Write the summary table as a .csv file.
+        Arguments:
+            file_name {Path} -- The .csv file to write.
+        '''
+        with open(str(file_name), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(AuditRow._fields)
+            writer.writerows(self.summary())
+
+
+#%% Archive Methods
+def audit_plans(plan_files: Sequence[Path],
+                reports: Dict[str, ReportDefinition],
+                max_workers: int = None, **plan_parameters)->MatchAudit:
+    '''Audit reference matching for a list of plan files.
+    Arguments:
+        plan_files {Sequence[Path]} -- The .dvh files to read.
+        reports {Dict[str, ReportDefinition]} -- The reports to audit, keyed
+            by name.
+    Keyword Arguments:
+        max_workers {int} -- The number of worker processes.  If 1, the
+            plans are audited in the current process.  If None, one process
+            per CPU is used. (default: {None})
+        plan_parameters {dict} -- Passed to the Plan constructor
+            (default_units and laterality_exceptions).
+    Returns:
+        MatchAudit -- The aggregated results.
+    '''
+    audit = MatchAudit()
+    if max_workers == 1:
+        _init_worker(reports, plan_parameters)
+        results = map(_audit_plan_file, plan_files)
+        collect(audit, plan_files, results)
+        _WORKER_STATE.clear()
+        return audit
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(reports, plan_parameters)) as executor:
+        results = executor.map(_audit_plan_file, plan_files,
+                               chunksize=PLANS_PER_TASK)
+        collect(audit, plan_files, results)
+    return audit
+
+
+def collect(audit: MatchAudit, plan_files: Sequence[Path],
+            results: Iterable[PlanAudit]):
+    '''Add the per-plan results to an audit.
+    Arguments:
+        audit {MatchAudit} -- The audit to add to.
+        plan_files {Sequence[Path]} -- The .dvh files, in the same order as
+            results.
+        results {Iterable[PlanAudit]} -- The per-plan results.  None for
+            plans that could not be loaded.
+    '''
+    for plan_file, plan_audit in zip(plan_files, results):
+        if plan_audit is None:
+            audit.skipped.append(str(plan_file))
+        else:
+            audit.add(plan_audit)
+
+
+def audit_archive(plan_path: Path, reports: Dict[str, ReportDefinition],
+                  report_names: List[str] = None, max_workers: int = None,
+                  **plan_parameters)->MatchAudit:
+    '''Audit reference matching for every .dvh file in a directory tree.
+    Arguments:
+        plan_path {Path} -- The top directory of the plan archive.
+        reports {Dict[str, ReportDefinition]} -- The available reports,
+            keyed by name.
+    Keyword Arguments:
+        report_names {List[str]} -- The reports to audit.  If None, all
+            reports are audited. (default: {None})
+        max_workers {int} -- The number of worker processes.
+            (default: {None}, one per CPU)
+        plan_parameters {dict} -- Passed to the Plan constructor.
+    Returns:
+        MatchAudit -- The aggregated results.
+    '''
+    if report_names:
+        reports = {name: reports[name] for name in report_names}
+    plan_files = sorted(Path(plan_path).rglob('*.dvh'))
+    audit = audit_plans(plan_files, reports, max_workers, **plan_parameters)
+    LOGGER.info('Match audit of %d plans; %d skipped.', audit.plan_count,
+                len(audit.skipped))
+    return audit
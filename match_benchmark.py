@@ -0,0 +1,368 @@
+'''Benchmark the speed and accuracy of automatic reference matching.
+
+The matcher is run over the structure names of real plans and over
+synthetic variants of those names (changed case, underscores, missing
+spaces, truncated names and swapped plan laterality).  For each corpus the
+number of references matched per second and the number of references
+resolved at each matching stage are recorded and written to a JSON file,
+so that results from different versions of the matcher can be compared.
+'''
+
+#%% imports etc.
+from typing import Callable, Dict, Iterator, List, NamedTuple, Sequence, Tuple
+from collections import Counter
+from copy import copy
+from datetime import datetime
+from pathlib import Path
+import argparse
+import json
+import logging
+import platform
+import time
+from plan_data import Plan
+from plan_report import Report, ReportDefinition, PlanReference
+from plan_report import LateralityResolver, ReferencePool
+from dvh_population import iterate_plans
+
+
+LOGGER = logging.getLogger(__name__)
+
+STAGES = ('exact', 'laterality', 'alias', 'fuzzy', 'suggested', 'unmatched')
+DEFAULT_REPEATS = 5
+# Relative drop in throughput or hit rate reported as a regression.
+REGRESSION_TOLERANCE = 0.1
+
+NameChange = Callable[[str], str]
+SYNTHETIC_VARIANTS = {
+    'upper': str.upper,
+    'underscore': lambda name: name.replace(' ', '_'),
+    'compact': lambda name: name.replace(' ', ''),
+    'truncated': lambda name: name[:-1] if len(name) > 4 else name,
+    }
+MIRRORED_LATERALITY = {'Right': 'Left', 'Left': 'Right'}
+
+
+#%% Stage Classification
+def match_stage(reference: PlanReference,
+                resolver: LateralityResolver)->str:
+    '''Identify the matching stage that resolved a reference.
+    Arguments:
+        reference {PlanReference} -- A reference after matching.
+        resolver {LateralityResolver} -- The laterality variants for the
+            plan.
+    Returns:
+        str -- One of STAGES.
+    '''
+    status = reference['match_method']
+    if status == 'Suggested':
+        return 'suggested'
+    if status != 'Auto':
+        return 'unmatched'
+    matched_name = reference.matched_name
+    reference_name = reference['reference_name']
+    if matched_name == reference_name:
+        return 'exact'
+    lateral_names = resolver.name_variants(
+        reference_name, reference.get('reference_laterality'))
+    if matched_name in lateral_names:
+        return 'laterality'
+    report_names = reference_names(reference, resolver)
+    if matched_name in report_names:
+        return 'alias'
+    return 'fuzzy'
+
+
+def reference_names(reference: PlanReference,
+                    resolver: LateralityResolver)->List[str]:
+    '''List the alias names of a reference, including laterality variants.
+    Arguments:
+        reference {PlanReference} -- The reference.
+        resolver {LateralityResolver} -- The laterality variants for the
+            plan.
+    Returns:
+        List[str] -- The alias names.
+    '''
+    reference_laterality = reference.get('reference_laterality')
+    names = list()
+    for (pattern, size) in reference.get('Aliases', {}):
+        if size:
+            lat_indicator = resolver.indicator(reference_laterality, size)
+            if lat_indicator:
+                names.append(pattern.format(LatIndicator=lat_indicator))
+        else:
+            names.append(pattern)
+            names.extend(resolver.name_variants(pattern,
+                                                reference_laterality))
+    return names
+
+
+#%% Corpus
+def synthetic_plan(plan: Plan, name_change: NameChange = None,
+                   laterality: str = None)->Plan:
+    '''Make a copy of a plan with changed structure names.
+    Arguments:
+        plan {Plan} -- The plan to copy.  It is not changed.
+    Keyword Arguments:
+        name_change {NameChange} -- Converts each structure name.
+            (default: {None}, names unchanged)
+        laterality {str} -- The laterality of the copy.
+            (default: {None}, the plan laterality)
+    Returns:
+        Plan -- The modified copy.
+    '''
+    new_plan = copy(plan)
+    new_plan.data_elements = dict(plan.data_elements)
+    new_plan.name_indexes = dict()
+    if laterality:
+        new_plan.laterality = laterality
+    if name_change:
+        structures = dict()
+        for structure in plan.data_elements['Structure'].values():
+            new_structure = copy(structure)
+            new_structure.name = name_change(structure.name)
+            structures.setdefault(new_structure.name, new_structure)
+        new_plan.data_elements['Structure'] = structures
+    return new_plan
+
+
+def synthetic_plans(plan: Plan)->Iterator[Tuple[str, Plan]]:
+    '''Generate the synthetic variants of a plan.
+    Arguments:
+        plan {Plan} -- The source plan.
+    Yields:
+        Tuple[str, Plan] -- The corpus name and the modified plan.
+    '''
+    for variant, name_change in SYNTHETIC_VARIANTS.items():
+        yield (variant, synthetic_plan(plan, name_change))
+    mirrored = MIRRORED_LATERALITY.get(plan.laterality)
+    if mirrored:
+        yield ('mirrored', synthetic_plan(plan, laterality=mirrored))
+
+
+#%% Benchmark
+class BenchmarkResult(NamedTuple):
+    '''Matching performance for one corpus.
+    Attributes:
+        corpus {str} -- The corpus name.  'real' for the plans as loaded.
+        plans {int} -- The number of plans matched.
+        references {int} -- The number of references matched per repeat.
+        seconds {float} -- The total matching time for all repeats.
+        repeats {int} -- The number of times each plan was matched.
+        stages {Dict[str, int]} -- The number of references resolved at
+            each stage, counted once per plan.
+    '''
+    corpus: str
+    plans: int
+    references: int
+    seconds: float
+    repeats: int
+    stages: Dict[str, int]
+
+    @property
+    def matches_per_second(self)->float:
+        '''The number of references matched per second.'''
+        if not self.seconds:
+            return 0.0
+        return self.references * self.repeats / self.seconds
+
+    @property
+    def hit_rate(self)->float:
+        '''The fraction of references matched automatically.'''
+        if not self.references:
+            return 0.0
+        manual = self.stages['suggested'] + self.stages['unmatched']
+        return 1.0 - manual / self.references
+
+    def as_dict(self)->Dict[str, object]:
+        '''Return the result as a JSON compatible dictionary.'''
+        result = self._asdict()
+        result['stages'] = dict(self.stages)
+        result['matches_per_second'] = self.matches_per_second
+        result['hit_rate'] = self.hit_rate
+        return result
+
+
+class CorpusTally():
+    '''Accumulates the benchmark measurements for one corpus.
+    '''
+    def __init__(self, corpus: str):
+        self.corpus = corpus
+        self.plans = 0
+        self.references = 0
+        self.seconds = 0.0
+        self.stages = Counter({stage: 0 for stage in STAGES})
+
+    def result(self, repeats: int)->BenchmarkResult:
+        '''Return the accumulated measurements.'''
+        return BenchmarkResult(self.corpus, self.plans, self.references,
+                               self.seconds, repeats, dict(self.stages))
+
+
+def benchmark_plan(plan: Plan, reports: Dict[str, Report], tally: CorpusTally,
+                   repeats: int = DEFAULT_REPEATS,
+                   reference_pool: ReferencePool = None):
+    '''Time the matching of one plan against each report and count the
+    matching stages.
+    Arguments:
+        plan {Plan} -- The plan data to match.
+        reports {Dict[str, Report]} -- The reports to match.
+        tally {CorpusTally} -- The corpus measurements to add to.
+    Keyword Arguments:
+        repeats {int} -- The number of times to match each report.
+            (default: {DEFAULT_REPEATS})
+        reference_pool {ReferencePool} -- If given, the plan is matched once
+            with the pooled references of all reports. (default: {None})
+    '''
+    def match_reports():
+        if reference_pool is None:
+            for report in reports.values():
+                report.match_elements(plan)
+        else:
+            pool_matches = reference_pool.match_elements(plan)
+            for report in reports.values():
+                report.apply_matches(pool_matches, plan)
+
+    tally.plans += 1
+    # Compile the lookups outside of the timed loop.
+    match_reports()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        match_reports()
+    tally.seconds += time.perf_counter() - start
+    for report in reports.values():
+        resolver = LateralityResolver(plan.laterality,
+                                      report.laterality_lookup,
+                                      report.lat_patterns)
+        for reference in report.references.values():
+            tally.stages[match_stage(reference, resolver)] += 1
+            tally.references += 1
+
+
+def run_benchmark(plan_files: Sequence[Path],
+                  report_definitions: Dict[str, ReportDefinition],
+                  repeats: int = DEFAULT_REPEATS, synthetic: bool = True,
+                  **plan_parameters)->List[BenchmarkResult]:
+    '''Benchmark matching over a set of plans and their synthetic variants.
+    Arguments:
+        plan_files {Sequence[Path]} -- The .dvh files to read.
+        report_definitions {Dict[str, ReportDefinition]} -- The reports to
+            match.
+    Keyword Arguments:
+        repeats {int} -- The number of times to match each plan.
+            (default: {DEFAULT_REPEATS})
+        synthetic {bool} -- Include the synthetic name variants.
+            (default: {True})
+        plan_parameters {dict} -- Passed to the Plan constructor
+            (default_units and laterality_exceptions).
+    Returns:
+        List[BenchmarkResult] -- The results for each corpus, real plans
+            first.
+    '''
+    reports = {name: Report(definition)
+               for name, definition in report_definitions.items()}
+    reference_pool = ReferencePool.from_reports(report_definitions.values())
+    tallies = {'real': CorpusTally('real')}
+    for plan in iterate_plans(plan_files, **plan_parameters):
+        benchmark_plan(plan, reports, tallies['real'], repeats,
+                       reference_pool)
+        if not synthetic:
+            continue
+        for (corpus, variant_plan) in synthetic_plans(plan):
+            tally = tallies.setdefault(corpus, CorpusTally(corpus))
+            benchmark_plan(variant_plan, reports, tally, repeats,
+                           reference_pool)
+    results = [tally.result(repeats) for tally in tallies.values()]
+    for result in results:
+        LOGGER.info('%s: %.0f matches/s, hit rate %.3f', result.corpus,
+                    result.matches_per_second, result.hit_rate)
+    return results
+
+
+#%% Result Files
+def save_benchmark(results: List[BenchmarkResult], file_name: Path):
+    '''Write benchmark results as a JSON file.
+    Arguments:
+        results {List[BenchmarkResult]} -- The benchmark results.
+        file_name {Path} -- The .json file to write.
+    '''
+    benchmark = dict(created=datetime.now().isoformat(timespec='seconds'),
+                     python=platform.python_version(),
+                     machine=platform.node(),
+                     corpora=[result.as_dict() for result in results])
+    with open(str(file_name), 'w') as json_file:
+        json.dump(benchmark, json_file, indent=2)
+
+
+def load_benchmark(file_name: Path)->Dict[str, Dict[str, object]]:
+    '''Read benchmark results written by save_benchmark.
+    Arguments:
+        file_name {Path} -- The .json file to read.
+    Returns:
+        Dict[str, Dict[str, object]] -- The result values for each corpus.
+    '''
+    with open(str(file_name), 'r') as json_file:
+        benchmark = json.load(json_file)
+    return {corpus['corpus']: corpus for corpus in benchmark['corpora']}
+
+
+def compare_benchmarks(results: List[BenchmarkResult],
+                       baseline: Dict[str, Dict[str, object]],
+                       tolerance: float = REGRESSION_TOLERANCE)->List[str]:
+    '''Compare benchmark results with a baseline.
+    Arguments:
+        results {List[BenchmarkResult]} -- The new results.
+        baseline {Dict[str, Dict[str, object]]} -- Results from
+            load_benchmark.
+    Keyword Arguments:
+        tolerance {float} -- The relative drop reported as a regression.
+            (default: {REGRESSION_TOLERANCE})
+    Returns:
+        List[str] -- A description of each regression.  Empty if none.
+    '''
+    regressions = list()
+    for result in results:
+        previous = baseline.get(result.corpus)
+        if not previous:
+            continue
+        for measure in ('matches_per_second', 'hit_rate'):
+            old_value = previous[measure]
+            new_value = getattr(result, measure)
+            if new_value < old_value * (1.0 - tolerance):
+                regressions.append('%s %s dropped from %.4g to %.4g' % (
+                    result.corpus, measure, old_value, new_value))
+    return regressions
+
+
+#%% Main
+def main():
+    '''Benchmark matching for the .dvh files in a directory tree.
+    '''
+    from build_plan_report import load_config_snapshot, load_reports
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('plan_path', type=Path,
+                        help='Directory containing .dvh files.')
+    parser.add_argument('-o', '--output', type=Path,
+                        default=Path('MatchBenchmark.json'),
+                        help='The JSON results file to write.')
+    parser.add_argument('-b', '--baseline', type=Path,
+                        help='Earlier results to compare with.')
+    parser.add_argument('-r', '--repeats', type=int, default=DEFAULT_REPEATS)
+    args = parser.parse_args()
+
+    settings = load_config_snapshot(Path.cwd(), 'PlanEvaluationConfig.xml')
+    reports = load_reports(settings)
+    plan_parameters = dict(
+        default_units=settings.default_units,
+        laterality_exceptions=settings.laterality_exceptions)
+    plan_files = sorted(args.plan_path.rglob('*.dvh'))
+    results = run_benchmark(plan_files, reports, args.repeats,
+                            **plan_parameters)
+    save_benchmark(results, args.output)
+    if args.baseline:
+        for regression in compare_benchmarks(results,
+                                             load_benchmark(args.baseline)):
+            print(regression)
+
+
+if __name__ == '__main__':
+    main()
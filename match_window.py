@@ -5,13 +5,13 @@
 #%% imports etc.
 from pathlib import Path
 from operator import attrgetter
-from copy import deepcopy
 from typing import Dict, Tuple, List, NamedTuple
 import xml.etree.ElementTree as ET
 import tkinter as tk
 import PySimpleGUI as sg
 from build_plan_report import load_config, load_reports, IconPaths, load_dvh
-from plan_report import Report, ReferenceGroup, MatchHistory
+from plan_report import Report, ReferenceGroup, MatchHistory, LearnedAliases
+from plan_report import ReferencePool
 from plan_data import DvhFile, Plan, PlanItemLookup, PlanElements, get_default_units, get_laterality_exceptions, find_plan_files
 
 Values = Dict[str, List[str]]
@@ -283,7 +283,9 @@ def build_tree_data(reference_data: Dict[Tuple[str], ReferenceGroup],
                     sort_list: List[str] = None
                     )->sg.TreeData:
     '''Assemble the reference data into a tree format, grouping by matched
-    status.
+    status.  Suggested fuzzy matches are listed in their own group with the
+    suggested plan item filled in.  A suggestion is only accepted if it is
+    selected from the Match menu.
     Arguments:
         reference_data {Dict[Tuple[str], ReferenceGroup} -- The Report
             references to the plan.
@@ -299,12 +301,16 @@ def build_tree_data(reference_data: Dict[Tuple[str], ReferenceGroup],
     treedata = sg.TreeData()
     treedata.Insert('','matched', 'Matched', [],
                     icon=icons.path('match_icon'))
+    treedata.Insert('','suggested', 'Suggested', [],
+                    icon=icons.path('changed_icon'))
     treedata.Insert('','not_matched', 'Not Matched', [],
                     icon=icons.path('not_matched_icon'))
     for ref in reference_set:
         idx = ref.reference_index
         name = ref.match_name
-        if ref.match_status:
+        if ref.match_status == 'Suggested':
+            treedata.Insert('suggested', idx, name, ref)
+        elif ref.match_status:
             treedata.Insert('matched', idx, name, ref)
         else:
             treedata.Insert('not_matched', idx, name, ref)
@@ -386,7 +392,19 @@ def match_window(icons: IconPaths, plan_elements: PlanItemLookup,
                        return_keyboard_events=False,  finalize=True)
     return window
 
-def manual_match(report: Report, plan: Plan, icons: IconPaths)->Report:
+def manual_match(report: Report, plan: Plan, icons: IconPaths,
+                 learned_aliases: LearnedAliases = None)->Report:
+    '''Show the match window and apply the approved matches to the report.
+    Arguments:
+        report {Report} -- The report being matched.
+        plan {Plan} -- The plan data.
+        icons {IconPaths} -- Path to the icon files.
+    Keyword Arguments:
+        learned_aliases {LearnedAliases} -- If given, the matches selected
+            by the user are recorded as learned aliases. (default: {None})
+    Returns:
+        Report -- The report with the approved matches.
+    '''
     reference_data = report.get_matches()
     plan_elements = plan.items()
     element_types = {name: elmt.element_type
@@ -415,8 +433,14 @@ def manual_match(report: Report, plan: Plan, icons: IconPaths)->Report:
         elif event == sg.TIMEOUT_KEY:
             continue
         elif event in 'Approve':
-            for new_match in history.changed():
+            # Only the matches selected by the user are applied.  Suggested
+            # matches that were not selected remain unmatched.
+            accepted = history.changed()
+            for new_match in accepted:
                 report.update_ref(new_match, plan)
+            if learned_aliases is not None:
+                learned_aliases.record(accepted, plan.laterality,
+                                       report.laterality_lookup)
             #num_updates = len(history.changed())
             break
         else:
@@ -429,9 +453,11 @@ def manual_match(report: Report, plan: Plan, icons: IconPaths)->Report:
 
 
 #%% Run Tests
-def load_test_data(data_path: Path,
-                   test_path: Path)->Tuple[ET.Element, Plan, Report]:
+def load_test_data(data_path: Path, test_path: Path
+                   )->Tuple[ET.Element, Plan, Report, ReferencePool]:
     ''' Load test data.
+    Returns the config, plan, report and the pool of loaded report
+    references.
     '''
     # Define Folder Paths
     # Load Config file and Report definitions
@@ -441,7 +467,7 @@ def load_test_data(data_path: Path,
     # Load Report definitions
     report_name = 'SABR 54 in 3'
     report_definitions = load_reports(config)
-    report = deepcopy(report_definitions[report_name])
+    report = Report(report_definitions[report_name])
     # Load DVH plan
     plan_id = 'Plan: LUNR         [June-07-2019 13:50:12]'
     #dvh_file = 'SABR1.dvh'
@@ -453,7 +479,7 @@ def load_test_data(data_path: Path,
     plan_dict = find_plan_files(config, test_path)
     selected_plan_desc = plan_dict[plan_id]
     plan = load_dvh(selected_plan_desc, **plan_parameters)
-    return(config, plan, report)
+    return(config, plan, report, report_definitions.reference_pool)
 
 
 def main():
@@ -468,8 +494,9 @@ def main():
     icon_path = code_path / 'icons'
     icons = IconPaths(icon_path)
 
-    (config, plan, report) = load_test_data(data_path, test_path)
-    report.match_elements(plan)
+    (config, plan, report, reference_pool) = load_test_data(data_path,
+                                                            test_path)
+    report.apply_matches(reference_pool.match_elements(plan), plan)
     report = manual_match(report, plan, icons)
 
 
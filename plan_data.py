@@ -8,7 +8,8 @@ elements for analysis.
 
 
 #%% imports etc.
-from typing import Union, NamedTuple, Tuple, Dict, List, Any
+from typing import Union, NamedTuple, Tuple, Dict, List, Any, Callable
+from typing import FrozenSet
 from pathlib import Path
 from collections import OrderedDict
 from operator import attrgetter
@@ -16,7 +17,7 @@ import xml.etree.ElementTree as ET
 import re
 import logging
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.interpolate import PchipInterpolator
 
 
 Value = Union[int, float, str]
@@ -31,12 +32,23 @@ DvhConstructor = Tuple[str, float, str] # (y_type, x_value, x_unit)
 # TODO Make DvhIndex a named tuple
 DvhIndex = Tuple[int, int, str]
 #x_column, y_column, desired_x_unit
+Interpolator = Callable[[float], float]
+
+# Available DVH interpolation kernels:
+#   'linear': piecewise linear (the default).
+#   'log': linear in the logarithm of the volume axis; better behaved near
+#       steep dose fall-off where volumes approach zero.
+#   'pchip': monotone piecewise cubic Hermite interpolation.
+INTERPOLATION_KERNELS = ('linear', 'log', 'pchip')
+DEFAULT_KERNEL = 'linear'
+MIN_LOG_VOLUME = 1e-6
+NameMatch = Tuple[Any, float] # (plan element, match score)
 
 LOGGER = logging.getLogger(__name__)
 
 
 #%% Laterality Methods
-def get_laterality_exceptions(region_code_root: ET.Element)->List[str]:
+def get_laterality_exceptions(region_code_root: ET.Element)->FrozenSet[str]:
     '''Load list of body region codes that appear to have a laterality,
         but do not.
     Arguments:
@@ -44,14 +56,14 @@ def get_laterality_exceptions(region_code_root: ET.Element)->List[str]:
             body region codes that end in "L", "R" or "B", where the letter
             does not indicate laterality. e.e "ORAL".
     Returns:
-        List[str] -- a list of 4-letter body region codes which should not be
-            treated as indicating laterality in the plan.
+        FrozenSet[str] -- a set of 4-letter body region codes which should not
+            be treated as indicating laterality in the plan.
     '''
-    region_code_list = list()
+    region_codes = set()
     for element in region_code_root.findall('BodyRegion'):
         region_code = element.attrib.get('Name')
-        region_code_list.append(region_code)
-    return region_code_list
+        region_codes.add(region_code)
+    return frozenset(region_codes)
 
 
 #%% Units Methods
@@ -228,12 +240,13 @@ class PlanDataItem():
                 self.unit = None
         return (self.element_value, self.unit)
 
-    def get_value(self, constructor: str = '',
+    def get_value(self, constructor: str = '', interpolation: str = None,
                   **conversion: ConversionParameters)->Value:
         '''Returns the requested value in the desired units.
         Arguments:
             constructor {str} -- A string describing the method for generating
                 the requested value from this plan element.
+            interpolation {str} -- Not used for single value items.
             conversion {ConversionParameters} -- A dictionary containing the
                 data used to perform any necessary unit conversion.
         Returns:
@@ -291,11 +304,19 @@ class DVH():
         select_columns(x_unit: str, y_type: str,
                        y_unit: str = None)->Tuple[int, int, str]
             Select the appropriate x and y DVH columns.
-        get_dvh_point(self, x_column: int, y_column: int, x_value: float)->float
+        interpolator(x_column: int, y_column: int,
+                     kernel: str = 'linear')->Interpolator
+            Return a cached interpolation function for a pair of columns.
+        get_dvh_point(self, x_column: int, y_column: int, x_value: float,
+                      kernel: str = 'linear')->float
             Interpolate DVH curve to select a value.
         get_value(self, dvh_constructor: DvhConstructor,
-                  **conversion_parameters)->PlanElement
+                  kernel: str = 'linear', **conversion_parameters)->PlanElement
             Return the value in the requested units.
+        resample(self, dose_grid: np.array, dose_unit: str = 'cGy',
+                 volume_unit: str = None,
+                 **conversion_parameters)->np.array
+            Interpolate the cumulative volume curve onto a fixed dose grid.
     '''
     def __init__(self, columns: Header, dvh_curve: DvhData):
         '''Initialize a DVH data set.
@@ -305,6 +326,7 @@ class DVH():
         '''
         self.dvh_columns = columns
         self.dvh_curve = np.array(dvh_curve).T
+        self._interpolators = dict()
 
     def select_columns(self, x_unit: str, y_type: str,
                        y_unit: str = None)->Tuple[int, int, str]:
@@ -352,31 +374,82 @@ class DVH():
             y_column = y_possible
         return x_column, y_column, desired_x_unit
 
-    def get_dvh_point(self, x_column: int, y_column: int, x_value: float)->float:
+    def interpolator(self, x_column: int, y_column: int,
+                     kernel: str = DEFAULT_KERNEL)->Interpolator:
+        '''Return a cached interpolation function for a pair of columns.
+        The sorted curve data and any kernel coefficients are calculated the
+        first time a column pair and kernel is requested and reused for all
+        later points.
+        Arguments:
+            x_column {int} -- Index to x dvh column.
+            y_column {int} -- Index to y dvh column.
+            kernel {str} -- One of INTERPOLATION_KERNELS.
+                (default: {DEFAULT_KERNEL})
+        Returns:
+            Interpolator -- A function returning the y value at an x value.
+        '''
+        key = (x_column, y_column, kernel)
+        function = self._interpolators.get(key)
+        if function is not None:
+            return function
+        if kernel not in INTERPOLATION_KERNELS:
+            raise ValueError('Unknown interpolation kernel: {}'.format(kernel))
+        # Sort on x so that volume (decreasing) can also be used as the x axis.
+        order = np.argsort(self.dvh_curve[x_column], kind='mergesort')
+        x_data = self.dvh_curve[x_column][order]
+        y_data = self.dvh_curve[y_column][order]
+        if kernel == 'linear':
+            def function(x_value):
+                return np.interp(x_value, x_data, y_data)
+        elif kernel == 'log':
+            if 'Volume' in self.dvh_columns[y_column]['Data Type']:
+                log_y = np.log(np.maximum(y_data, MIN_LOG_VOLUME))
+                def function(x_value):
+                    return np.exp(np.interp(x_value, x_data, log_y))
+            else:
+                log_x = np.log(np.maximum(x_data, MIN_LOG_VOLUME))
+                def function(x_value):
+                    log_value = np.log(max(x_value, MIN_LOG_VOLUME))
+                    return np.interp(log_value, log_x, y_data)
+        else:
+            # PCHIP requires strictly increasing x values.
+            (unique_x, first) = np.unique(x_data, return_index=True)
+            function = PchipInterpolator(unique_x, y_data[first],
+                                         extrapolate=False)
+        self._interpolators[key] = function
+        return function
+
+    def get_dvh_point(self, x_column: int, y_column: int, x_value: float,
+                      kernel: str = DEFAULT_KERNEL)->float:
         '''Interpolate DVH curve to select a value.
         Arguments:
             x_column {int} -- Index to x dvh column.
             y_column {int} -- Index to y dvh column.
             x_value {float} -- x value to use in the interpolation.
+            kernel {str} -- One of INTERPOLATION_KERNELS.
+                (default: {DEFAULT_KERNEL})
         Returns:
             float -- The y value interpolated to the x point.
         '''
         data = self.dvh_curve
         # x_value must be within the range of the x data.
         if min(data[x_column]) < float(x_value) < max(data[x_column]):
-            linear_interp = interp1d(data[x_column], data[y_column])
-            target_value = float(linear_interp(x_value))
+            function = self.interpolator(x_column, y_column, kernel)
+            target_value = float(function(float(x_value)))
         else:
             # Question should I raise an error if the dvh interpolation fails?
             target_value = None
         return target_value
 
     def get_value(self, dvh_constructor: DvhConstructor,
+                  kernel: str = DEFAULT_KERNEL,
                   **conversion_parameters)->PlanDataItem:
         '''Return the value in the requested units.
         Keyword Arguments:
             dvh_constructor {DvhConstructor} -- The parameters required to
                 extract a point from the dvh curve. (default: {None})
+            kernel {str} -- The interpolation kernel, one of
+                INTERPOLATION_KERNELS. (default: {DEFAULT_KERNEL})
             conversion_parameters: {ConversionParameters} -- A dictionary
                 containing the data used to perform any necessary unit
                 conversion.
@@ -390,7 +463,7 @@ class DVH():
             x_value = convert_units(float(x_value), x_unit,
                                     target_units=desired_x_unit,
                                     **conversion_parameters)
-        dvh_value = self.get_dvh_point(x_column, y_column, x_value)
+        dvh_value = self.get_dvh_point(x_column, y_column, x_value, kernel)
         dvh_unit = self.dvh_columns[y_column]['Unit']
         dvh_name = ''.join(dvh_constructor)
         dvh_point = PlanDataItem(name=dvh_name,
@@ -398,6 +471,47 @@ class DVH():
                                 unit=dvh_unit)
         return dvh_point
 
+    def resample(self, dose_grid: np.array, dose_unit: str = 'cGy',
+                 volume_unit: str = None,
+                 **conversion_parameters)->np.array:
+        '''Interpolate the cumulative volume curve onto a fixed dose grid.
+        Arguments:
+            dose_grid {np.array} -- Increasing dose values at which the
+                volume is required.
+            dose_unit {str} -- The units of dose_grid. (default: {'cGy'})
+            volume_unit {str} -- The units of the returned volumes.  If None,
+                the units of the DVH volume column are used.  A cc DVH is
+                converted to % of the total structure volume, which is the
+                largest volume in the curve unless a 'volume' conversion
+                parameter is given. (default: {None})
+            conversion_parameters: {ConversionParameters} -- A dictionary
+                containing the data used to perform any necessary unit
+                conversion.
+        Returns:
+            np.array -- The volume receiving at least each dose in
+                dose_grid.  Doses above the maximum in the curve receive
+                zero volume.
+        '''
+        (x_column, y_column, desired_x_unit) = \
+            self.select_columns(dose_unit, 'Volume', volume_unit)
+        grid = np.asarray(dose_grid, dtype=float)
+        if desired_x_unit:
+            factor = convert_units(1.0, dose_unit, target_units=desired_x_unit,
+                                   **conversion_parameters)
+            grid = grid * factor
+        dose = self.dvh_curve[x_column]
+        volume = self.dvh_curve[y_column]
+        volumes = np.interp(grid, dose, volume, left=volume[0], right=0.0)
+        dvh_unit = self.dvh_columns[y_column]['Unit']
+        if volume_unit and dvh_unit != volume_unit:
+            parameters = dict(conversion_parameters)
+            if parameters.get('volume') is None and dvh_unit == 'cc':
+                parameters['volume'] = float(np.max(volume))
+            factor = convert_units(1.0, dvh_unit, target_units=volume_unit,
+                                   **parameters)
+            volumes = volumes * factor
+        return volumes
+
 
 class Structure():
     '''Plan data associated with a particular structure.
@@ -457,12 +571,15 @@ class Structure():
         self.structure_properties[element.name] = element
         return element
 
-    def get_value(self, constructor: str = '',
+    def get_value(self, constructor: str = '', interpolation: str = None,
                   **conversion: ConversionParameters)->Value:
         '''Return the requested value in the desired units.
         Keyword Arguments:
             constructor {str} -- The structure property or a DVH point
                 description. (default: {''})
+            interpolation {str} -- The DVH interpolation kernel used for DVH
+                point constructors.  One of INTERPOLATION_KERNELS.
+                (default: {None}, use DEFAULT_KERNEL)
             conversion {ConversionParameters} -- A dictionary containing the
                 data used to perform any necessary unit conversion.
                 (default: {None})
@@ -479,7 +596,8 @@ class Structure():
             conversion['volume'] = 1.0
         dvh_constructor = parse_constructor(constructor)
         if dvh_constructor:
-            element = self.dose_data.get_value(dvh_constructor)
+            kernel = interpolation if interpolation else DEFAULT_KERNEL
+            element = self.dose_data.get_value(dvh_constructor, kernel)
         else:
             element = self.structure_properties.get(constructor)
         if element:
@@ -909,6 +1027,119 @@ class PlanDescription(NamedTuple):
         return text
 
 
+#%% Name Index
+def normalise_name(name: str)->str:
+    '''Fold a plan element name for approximate matching.
+    Case is ignored and white space and underscores are removed, so that
+    "Spinal_Cord", "SpinalCord" and "spinal cord" give the same key.
+    Arguments:
+        name {str} -- The plan element name.
+    Returns:
+        str -- The normalised name.
+    '''
+    return re.sub(r'[\s_]+', '', str(name).casefold())
+
+
+def name_trigrams(name: str)->set:
+    '''Return the set of character trigrams in a normalised name.
+    The name is padded so that short names and name starts are represented.
+    Arguments:
+        name {str} -- A normalised plan element name.
+    Returns:
+        set -- The three character sub-strings of the padded name.
+    '''
+    padded = '  {} '.format(name)
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class NameIndex():
+    '''Approximate name lookup for one group of plan elements.
+    Built once per plan and element type.  Provides exact lookup on the
+    normalised name and ranked fuzzy lookup using the Dice coefficient of
+    the name trigrams.
+    Arguments:
+        plan_elements {Dict[str, PlanElements]} -- The plan elements to index,
+            keyed by name.
+    Attributes:
+        normalised {Dict[str, PlanElements]} -- Plan elements keyed by their
+            normalised name.  If more than one element has the same normalised
+            name, the first is kept.
+        trigrams {Dict[str, List[str]]} -- The normalised names containing
+            each trigram.
+        trigram_counts {Dict[str, int]} -- The number of trigrams in each
+            normalised name.
+    Methods
+        search(name: str, limit: int = 5)->List[NameMatch]
+            Return ranked fuzzy matches for a name.
+        best_match(names: List[str])->NameMatch
+            Return the best plan element for a list of candidate names.
+    '''
+    def __init__(self, plan_elements: Dict[str, Any]):
+        '''Build the normalised name and trigram lookups.
+        Arguments:
+            plan_elements {Dict[str, PlanElements]} -- The plan elements to
+                index, keyed by name.
+        '''
+        self.normalised = dict()
+        self.trigrams = dict()
+        self.trigram_counts = dict()
+        for name, element in plan_elements.items():
+            if not element:
+                continue
+            key = normalise_name(name)
+            if key in self.normalised:
+                continue
+            self.normalised[key] = element
+            grams = name_trigrams(key)
+            self.trigram_counts[key] = len(grams)
+            for gram in grams:
+                self.trigrams.setdefault(gram, list()).append(key)
+
+    def search(self, name: str, limit: int = 5)->List[NameMatch]:
+        '''Return ranked fuzzy matches for a name.
+        Arguments:
+            name {str} -- The name to look up.
+        Keyword Arguments:
+            limit {int} -- The maximum number of matches to return.
+                (default: {5})
+        Returns:
+            List[NameMatch] -- (plan element, score) tuples in order of
+                decreasing score.  A score of 1.0 is an exact normalised match.
+        '''
+        key = normalise_name(name)
+        grams = name_trigrams(key)
+        shared = dict()
+        for gram in grams:
+            for other in self.trigrams.get(gram, ()):
+                shared[other] = shared.get(other, 0) + 1
+        scores = [(2.0 * count / (len(grams) + self.trigram_counts[other]),
+                   other) for other, count in shared.items()]
+        scores.sort(key=lambda score: -score[0])
+        return [(self.normalised[other], score)
+                for score, other in scores[:limit]]
+
+    def best_match(self, names: List[str])->NameMatch:
+        '''Return the best plan element for a list of candidate names.
+        An exact normalised match is preferred, taking the candidate names in
+        order.  Otherwise the highest scoring fuzzy match is returned.
+        Arguments:
+            names {List[str]} -- Candidate names, in order of preference.
+        Returns:
+            NameMatch -- The (plan element, score) tuple.  (None, 0.0) if no
+                plan element shares a trigram with any of the names.
+        '''
+        for name in names:
+            element = self.normalised.get(normalise_name(name))
+            if element:
+                return (element, 1.0)
+        best = (None, 0.0)
+        for name in names:
+            matches = self.search(name, limit=1)
+            if matches and matches[0][1] > best[1]:
+                best = matches[0]
+        return best
+
+
 class Plan():
     '''Contains all plan elements for a single plan.
     Class Attributes:
@@ -952,13 +1183,16 @@ class Plan():
             Store Dose, Fractions, DosePerFraction in plan_properties.
         get_info
             Prompt for required, additional identifiers
+        get_name_index
+            Return the approximate name lookup for a type of plan element.
         dose
             returns the prescription dose in the requested units
         fractions
             returns the number of fractions in the prescription.
     '''
     def __init__(self, default_units: Dict[str, str], 
-                 laterality_exceptions: List[str], dvh_data: DvhFile = None,
+                 laterality_exceptions: FrozenSet[str],
+                 dvh_data: DvhFile = None,
                  name: str = 'Plan'):
         '''Load  the plan data.
         Arguments:
@@ -970,9 +1204,9 @@ class Plan():
                     DoseUnit: One of ('Gy', 'cGy', '%')
                     VolumeUnit: One of ('cc', '%')
                     DistanceUnit: ('mm', 'cm')
-            laterality_exceptions {List[str]} -- A list of 4-letter body region
-                codes which should not be treated as indicating laterality in
-                the plan.
+            laterality_exceptions {FrozenSet[str]} -- A set of 4-letter body
+                region codes which should not be treated as indicating
+                laterality in the plan.
             dvh_data {DvhFile} -- A DvhFile object containing dvh plan data.
                 (default: {None})
             name {str} -- The name of the plan. Default is 'Plan'
@@ -986,6 +1220,7 @@ class Plan():
         self.data_elements = {'Plan Property': dict(),
                                 'Structure': dict(),
                                 'Reference Point': dict()}
+        self.name_indexes = dict()
         self.dvh_data_file = Path(dvh_data.file_name)
 
         # Load the dvh data
@@ -994,7 +1229,7 @@ class Plan():
         self.data_elements['Structure'].update(plan_structures)
 
         # Derive laterality and dose
-        self.laterality = self.get_laterality(laterality_exceptions)
+        self.laterality = self.get_laterality(frozenset(laterality_exceptions))
         self.prescription_dose = self.set_prescription()
 
 
@@ -1009,6 +1244,7 @@ class Plan():
         '''
         element_entry = {element.name: element}
         self.data_elements[element_category].update(element_entry)
+        self.name_indexes.pop(element_category, None)
         LOGGER.debug('Created %s: %s', element_category, element.name)
 
     def get_data_element(self, data_type: str, element_name: str)->PlanElements:
@@ -1026,15 +1262,52 @@ class Plan():
         element = data_group.get(element_name) if data_group else None
         return element
 
-    def get_laterality(self, lat_exceptions: List[str])->Union[str, None]:
+    def get_name_index(self, data_type: str)->NameIndex:
+        '''Return the approximate name lookup for a type of plan element.
+        The index is built the first time it is requested.
+        Arguments:
+            data_type {str} -- The element type.  One of:
+                'Plan Property'
+                'Structure'
+                'Reference Point'
+        Returns:
+            NameIndex -- The name lookup, or None if the plan has no elements
+                of the requested type.
+        '''
+        name_index = self.name_indexes.get(data_type)
+        if name_index is None:
+            data_group = self.data_elements.get(data_type)
+            if not data_group:
+                return None
+            name_index = NameIndex(data_group)
+            self.name_indexes[data_type] = name_index
+        return name_index
+
+    def get_body_region(self)->Union[str, None]:
+        '''Return the body region code of the plan.
+        The body region code is the first four letters of the plan name,
+        ending in the laterality letter.
+        Returns:
+            Union[str, None] -- The body region code, or None if the plan
+                has no name.
+        '''
+        plan_name = self.get_data_element(
+            data_type='Plan Property',
+            element_name='Plan')
+        if not plan_name or not plan_name.element_value:
+            return None
+        return str(plan_name.element_value)[0:4]
+
+    def get_laterality(self, lat_exceptions: FrozenSet[str])->Union[str, None]:
         '''Look for laterality indicator in plan name and use to set plan
             laterality.
-        List[str] --
+        The first four letters of the plan name are the body region code,
+        ending in the laterality letter.
 
         Arguments:
-            lat_exceptions {List[str]} -- A list of 4-letter body region codes
-                which should not be treated as indicating laterality in the
-                plan.
+            lat_exceptions {FrozenSet[str]} -- A set of 4-letter body region
+                codes which should not be treated as indicating laterality in
+                the plan.
         Returns:
             Union[str, None] -- The plan laterality.  One of:
                 'Right', 'Left', 'Both'
@@ -1042,13 +1315,10 @@ class Plan():
         '''
         # TODO need to deal with BOOS plan names
         lat_options = {'R': 'Right', 'L': 'Left', 'B': 'Both'}
-        plan_name = self.get_data_element(
-            data_type='Plan Property',
-            element_name='Plan')
-        body_region = plan_name.element_value[0:3]
-        if body_region in lat_exceptions:
+        body_region = self.get_body_region()
+        if body_region is None or body_region in lat_exceptions:
             return None
-        lat_code = plan_name.element_value[3]
+        lat_code = body_region[3:4]
         return lat_options.get(lat_code, None)
 
     def set_prescription(self)->PlanDataItem:
@@ -0,0 +1,186 @@
+'''Conformity and dose gradient indices derived from plan DVH data.
+
+The RTOG conformity index, the Paddick conformity index, R50% and the
+Paddick gradient index are calculated from the target DVH and the body
+DVH (or the prescription and half-prescription isodose structures).  The
+results are stored once as plan properties, so every report that needs
+them reads the cached values instead of re-sampling the same curves.
+'''
+
+#%% imports etc.
+from typing import Dict, List, NamedTuple
+import xml.etree.ElementTree as ET
+import logging
+import numpy as np
+from plan_data import Plan, PlanDataItem, Structure
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Relative isodose levels (% of prescription) used by the indices.
+ISODOSE_LEVELS = np.array([100.0, 50.0])
+INDEX_NAMES = ('RTOG CI', 'Paddick CI', 'R50%', 'Gradient Index')
+
+
+#%% Settings
+class ConformitySettings(NamedTuple):
+    '''Structure names used to calculate conformity indices.
+    Attributes:
+        targets {List[str]} -- Candidate target structure names, in order of
+            preference.
+        bodies {List[str]} -- Candidate body structure names, in order of
+            preference.
+        prescription_isodoses {List[str]} -- Candidate names for the
+            prescription isodose structure.  Used if no body DVH is found.
+        half_isodoses {List[str]} -- Candidate names for the 50% isodose
+            structure.  Used if no body DVH is found.
+    '''
+    targets: List[str]
+    bodies: List[str]
+    prescription_isodoses: List[str] = list()
+    half_isodoses: List[str] = list()
+
+
+def load_conformity_settings(config: ET.Element)->ConformitySettings:
+    '''Read the structure names used for conformity indices.
+    Arguments:
+        config {ET.Element} -- An XML element containing a ConformityIndices
+            section.
+    Returns:
+        ConformitySettings -- The candidate structure names, or None if the
+            config does not contain a ConformityIndices section.
+    '''
+    settings_root = config.find('ConformityIndices')
+    if settings_root is None:
+        return None
+    def names(tag: str)->List[str]:
+        return [element.text for element in settings_root.findall(tag)]
+    return ConformitySettings(targets=names('Target'),
+                              bodies=names('Body'),
+                              prescription_isodoses=names('PrescriptionIsodose'),
+                              half_isodoses=names('HalfIsodose'))
+
+
+#%% Vectorised Index Calculations
+def conformity_indices(target_volume: np.array, covered_volume: np.array,
+                       isodose_volumes: np.array)->Dict[str, np.array]:
+    '''Calculate conformity and gradient indices.
+    All arguments may be arrays with matching leading dimensions to
+    evaluate many plans at once.
+    Arguments:
+        target_volume {np.array} -- The target volume in cc (TV).
+        covered_volume {np.array} -- The target volume in cc receiving the
+            prescription dose (TV_PIV).
+        isodose_volumes {np.array} -- The volume in cc enclosed by the
+            prescription and half-prescription isodoses, with the isodose
+            levels along the last axis (V100, V50).
+    Returns:
+        Dict[str, np.array] -- The 'RTOG CI', 'Paddick CI', 'R50%' and
+            'Gradient Index' values.
+    '''
+    target_volume = np.asarray(target_volume, dtype=float)
+    covered_volume = np.asarray(covered_volume, dtype=float)
+    isodose_volumes = np.asarray(isodose_volumes, dtype=float)
+    v100 = isodose_volumes[..., 0]
+    v50 = isodose_volumes[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        indices = {'RTOG CI': v100 / target_volume,
+                   'Paddick CI': covered_volume**2 / (target_volume * v100),
+                   'R50%': v50 / target_volume,
+                   'Gradient Index': v50 / v100}
+    return indices
+
+
+#%% Plan Level Methods
+def find_structure(plan: Plan, names: List[str])->Structure:
+    '''Return the first structure in the plan matching one of the names.
+    Arguments:
+        plan {Plan} -- The plan data.
+        names {List[str]} -- Candidate structure names in order of preference.
+    Returns:
+        Structure -- The matching structure, or None if none are found.
+    '''
+    structures = plan.data_elements['Structure']
+    for name in names:
+        structure = structures.get(name)
+        if structure:
+            return structure
+    return None
+
+
+def structure_volume(structure: Structure)->float:
+    '''Return the volume of a structure in cc.
+    Arguments:
+        structure {Structure} -- The structure.
+    Returns:
+        float -- The structure volume, or NaN if it is not defined.
+    '''
+    volume = structure.get_value('Volume', target_units='cc')
+    if volume is None:
+        return np.nan
+    return float(volume)
+
+
+def isodose_volumes(plan: Plan, settings: ConformitySettings)->np.array:
+    '''Return the volumes enclosed by the 100% and 50% isodoses.
+    Uses the body DVH if available; otherwise the isodose structures.
+    Arguments:
+        plan {Plan} -- The plan data.
+        settings {ConformitySettings} -- The candidate structure names.
+    Returns:
+        np.array -- (V100, V50) in cc.  Missing values are NaN.
+    '''
+    conversion = dict(dose=plan.prescription_dose.element_value)
+    body = find_structure(plan, settings.bodies)
+    if body and body.dose_data:
+        coverage = body.dose_data.resample(ISODOSE_LEVELS, '%',
+                                           volume_unit='%', **conversion)
+        return structure_volume(body) * coverage / 100.0
+    volumes = np.full(len(ISODOSE_LEVELS), np.nan)
+    isodose_names = (settings.prescription_isodoses, settings.half_isodoses)
+    for index, names in enumerate(isodose_names):
+        isodose = find_structure(plan, names)
+        if isodose:
+            volumes[index] = structure_volume(isodose)
+    return volumes
+
+
+def apply_conformity_indices(plan: Plan, settings: ConformitySettings,
+                             recalculate: bool = False
+                            )->Dict[str, PlanDataItem]:
+    '''Calculate the conformity indices for a plan and store them as plan
+    properties.
+    The values are only calculated once per plan; later calls return the
+    stored values unless recalculate is True.
+    Arguments:
+        plan {Plan} -- The plan data.
+        settings {ConformitySettings} -- The candidate structure names.
+    Keyword Arguments:
+        recalculate {bool} -- Replace any previously stored values.
+            (default: {False})
+    Returns:
+        Dict[str, PlanDataItem] -- The index values, keyed by index name.
+            Empty if no target structure is found.
+    '''
+    properties = plan.data_elements['Plan Property']
+    if not recalculate and all(name in properties for name in INDEX_NAMES):
+        return {name: properties[name] for name in INDEX_NAMES}
+    target = find_structure(plan, settings.targets)
+    if not (target and target.dose_data):
+        LOGGER.debug('No target found for conformity indices.')
+        return dict()
+    conversion = dict(dose=plan.prescription_dose.element_value)
+    target_volume = structure_volume(target)
+    coverage = target.dose_data.resample(ISODOSE_LEVELS[:1], '%',
+                                         volume_unit='%', **conversion)[0]
+    covered_volume = target_volume * coverage / 100.0
+    indices = conformity_indices(target_volume, covered_volume,
+                                 isodose_volumes(plan, settings))
+    items = dict()
+    for name, value in indices.items():
+        value = float(value)
+        item = PlanDataItem(name=name, element_type='Plan Property',
+                            element_value=None if np.isnan(value) else value)
+        plan.add_data_item('Plan Property', item)
+        items[name] = item
+    return items
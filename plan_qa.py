@@ -0,0 +1,385 @@
+'''Check the report conditions for an archive of plans.
+
+Every .dvh file in a directory tree is matched against one or more reports
+in a process pool and the report item values are calculated.  The worker
+processes only return the values used by Condition report items.  The
+conditions of each report are then evaluated for all plans in a single
+batch, giving a table of pass/warn/fail results that flags failing plans
+without building the report spreadsheets.
+'''
+
+#%% imports etc.
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+from typing import Union
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import csv
+import logging
+from plan_data import Plan, PlanDescription
+from plan_report import Report, ReportDefinition, ReferencePool
+from report_conditions import CONDITION_STATUS, WARN, FAIL
+from dvh_population import iterate_plans
+
+
+LOGGER = logging.getLogger(__name__)
+
+PLANS_PER_TASK = 4
+
+# A .dvh file, or a plan description giving the file and its fractions.
+PlanSource = Union[Path, PlanDescription]
+
+
+#%% Per-plan Values
+class PlanValues(NamedTuple):
+    '''The report item values used by the conditions of one report for one
+    plan.
+    Attributes:
+        plan_file {str} -- The .dvh file the plan was read from.
+        report {str} -- The report name.
+        values {Dict[str, Any]} -- The values of the report items checked
+            by the report conditions, keyed by report item name.
+        fractions {optional, int} -- The number of fractions used to select
+            the condition limits, or None if not known.
+    '''
+    plan_file: str
+    report: str
+    values: Dict[str, Any]
+    fractions: int = None
+
+
+def condition_items(definition: ReportDefinition)->List[str]:
+    '''List the report items checked by the report conditions.
+    Arguments:
+        definition {ReportDefinition} -- The report definition.
+    Returns:
+        List[str] -- The report item names.
+    '''
+    return list({constraint.item: None
+                 for constraint in definition.conditions.constraints})
+
+
+def plan_values(plan: Plan, reports: Dict[str, Report],
+                plan_file: str = '', reference_pool: ReferencePool = None,
+                fractions: int = None)->List[PlanValues]:
+    '''Match a plan against each report and collect the values used by the
+    report conditions.
+    Arguments:
+        plan {Plan} -- The plan data.
+        reports {Dict[str, Report]} -- The reports to check, keyed by name.
+            The reports' match state and values are replaced.
+    Keyword Arguments:
+        plan_file {str} -- The file the plan was read from. (default: {''})
+        reference_pool {ReferencePool} -- If given, the plan is matched once
+            with the pooled references of all reports. (default: {None})
+        fractions {int} -- The plan number of fractions.  If None, each
+            report uses the fractions of its prescriptions when they all
+            agree. (default: {None})
+    Returns:
+        List[PlanValues] -- The values for each report.
+    '''
+    results = list()
+    if reference_pool is not None:
+        pool_matches = reference_pool.match_elements(plan)
+    for report_name, report in reports.items():
+        if reference_pool is None:
+            report.match_elements(plan)
+        else:
+            report.apply_matches(pool_matches, plan)
+        report_fractions = fractions
+        if report_fractions is None:
+            report_fractions = report.definition.default_fractions
+        report.get_values(plan, report_fractions)
+        values = {item_name: report.values.get(item_name)
+                  for item_name in condition_items(report.definition)}
+        results.append(PlanValues(str(plan_file), report_name, values,
+                                  report_fractions))
+    return results
+
+
+def plan_source_file(plan_source: PlanSource)->Path:
+    '''Return the .dvh file of a plan source.
+    Arguments:
+        plan_source {PlanSource} -- A .dvh file or a plan description.
+    Returns:
+        Path -- The .dvh file.
+    '''
+    if isinstance(plan_source, PlanDescription):
+        return plan_source.plan_file
+    return plan_source
+
+
+#%% Worker Methods
+# Each worker process holds its own report runs.
+_WORKER_STATE = dict()
+
+
+def _init_worker(report_definitions: Dict[str, ReportDefinition],
+                 plan_parameters: dict, fractions: int = None):
+    '''Create the report runs and reference pool and store the plan
+    parameters for the worker process.
+    Arguments:
+        report_definitions {Dict[str, ReportDefinition]} -- The reports to
+            check.
+        plan_parameters {dict} -- Passed to the Plan constructor.
+    Keyword Arguments:
+        fractions {int} -- The number of fractions used for plans whose
+            fractions are not known. (default: {None})
+    '''
+    _WORKER_STATE['reports'] = {name: Report(definition)
+                                for name, definition
+                                in report_definitions.items()}
+    _WORKER_STATE['reference_pool'] = ReferencePool.from_reports(
+        report_definitions.values())
+    _WORKER_STATE['plan_parameters'] = plan_parameters
+    _WORKER_STATE['fractions'] = fractions
+
+
+def _plan_file_values(plan_source: PlanSource)->List[PlanValues]:
+    '''Load one plan and collect its condition values in a worker process.
+    Arguments:
+        plan_source {PlanSource} -- The .dvh file to read, or a plan
+            description giving the file and its number of fractions.
+    Returns:
+        List[PlanValues] -- The values for each report, or None if the plan
+            could not be loaded.
+    '''
+    plan_file = plan_source_file(plan_source)
+    fractions = getattr(plan_source, 'fractions', None)
+    if fractions is None:
+        fractions = _WORKER_STATE['fractions']
+    plan_parameters = _WORKER_STATE['plan_parameters']
+    plan = next(iterate_plans([plan_file], **plan_parameters), None)
+    if plan is None:
+        return None
+    return plan_values(plan, _WORKER_STATE['reports'], plan_file,
+                       _WORKER_STATE['reference_pool'], fractions)
+
+
+#%% Batch Results
+class QaRow(NamedTuple):
+    '''The result of one condition for one plan.
+    Attributes:
+        plan_file {str} -- The .dvh file the plan was read from.
+        report {str} -- The report name.
+        fractions {int} -- The number of fractions used to select the
+            limits, or None if not known.
+        condition {str} -- The Condition report item name.
+        item {str} -- The report item checked.
+        value {Any} -- The value of the checked item.
+        comparator {str} -- The comparison used.
+        limit {float} -- The limit applied.
+        warning {float} -- The warning level applied, or None.
+        status {str} -- One of 'Pass', 'Warn', 'Fail', or None if the value
+            could not be evaluated.
+    '''
+    plan_file: str
+    report: str
+    fractions: int
+    condition: str
+    item: str
+    value: Any
+    comparator: str
+    limit: float
+    warning: float
+    status: str
+
+
+class PlanQa():
+    '''Condition results for many plans.
+    Attributes:
+        plan_count {int} -- The number of plans checked.
+        skipped {List[str]} -- Files that could not be loaded.
+        rows {List[QaRow]} -- One row per plan, report and condition.
+    Methods
+        add_batch(definition: ReportDefinition,
+                  batch: Sequence[PlanValues], fractions: int = None)
+            Evaluate the conditions of one report for a batch of plans.
+        status_counts()->Dict[Tuple[str, str], Counter]
+            Count the results of each condition.
+        failing_plans(include_warnings: bool = False)->List[str]
+            List the plans with at least one failed condition.
+        save(file_name: Path)
+            Write the results table as a .csv file.
+    '''
+    def __init__(self):
+        '''Create an empty result table.
+        '''
+        self.plan_count = 0
+        self.skipped = list()
+        self.rows = list()
+
+    def add_batch(self, definition: ReportDefinition,
+                  batch: Sequence[PlanValues], fractions: int = None):
+        '''Evaluate the conditions of one report for a batch of plans.
+        Arguments:
+            definition {ReportDefinition} -- The report definition.
+            batch {Sequence[PlanValues]} -- The condition values for each
+                plan.  The limits are selected by the fractions of each
+                plan.
+        Keyword Arguments:
+            fractions {int} -- The number of fractions used for plans whose
+                fractions are not known.  If None, the default limits are
+                used. (default: {None})
+        '''
+        condition_set = definition.conditions
+        if not batch or not len(condition_set):
+            return
+        plan_fractions = [fractions if plan_result.fractions is None
+                          else plan_result.fractions
+                          for plan_result in batch]
+        status = condition_set.evaluate_batch(
+            [plan_result.values for plan_result in batch], plan_fractions)
+        for row_status, plan_result, row_fractions in zip(status, batch,
+                                                          plan_fractions):
+            for code, name, constraint in zip(row_status, condition_set.names,
+                                              condition_set.constraints):
+                tolerance = constraint.tolerance(row_fractions)
+                self.rows.append(QaRow(
+                    plan_file=plan_result.plan_file,
+                    report=plan_result.report,
+                    fractions=row_fractions,
+                    condition=name,
+                    item=constraint.item,
+                    value=plan_result.values.get(constraint.item),
+                    comparator=constraint.comparator,
+                    limit=tolerance.limit,
+                    warning=tolerance.warning,
+                    status=CONDITION_STATUS[code]))
+
+    def status_counts(self)->Dict[Tuple[str, str], Counter]:
+        '''Count the results of each condition.
+        Returns:
+            Dict[Tuple[str, str], Counter] -- The number of plans with each
+                status, keyed by (report name, condition name).
+        '''
+        counts = defaultdict(Counter)
+        for row in self.rows:
+            counts[(row.report, row.condition)][row.status] += 1
+        return dict(counts)
+
+    def failing_plans(self, include_warnings: bool = False)->List[str]:
+        '''List the plans with at least one failed condition.
+        Keyword Arguments:
+            include_warnings {bool} -- Also list plans with a Warn status.
+                (default: {False})
+        Returns:
+            List[str] -- The plan files, in the order checked.
+        '''
+        flagged = {CONDITION_STATUS[FAIL]}
+        if include_warnings:
+            flagged.add(CONDITION_STATUS[WARN])
+        plans = {row.plan_file: None for row in self.rows
+                 if row.status in flagged}
+        return list(plans)
+
+    def save(self, file_name: Path):
+        '''Write the results table as a .csv file.
+        Arguments:
+            file_name {Path} -- The .csv file to write.
+        '''
+        with open(str(file_name), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(QaRow._fields)
+            writer.writerows(self.rows)
+
+
+#%% Archive Methods
+def check_plans(plan_files: Sequence[PlanSource],
+                reports: Dict[str, ReportDefinition],
+                max_workers: int = None, fractions: int = None,
+                **plan_parameters)->PlanQa:
+    '''Check the report conditions for a list of plan files.
+    Arguments:
+        plan_files {Sequence[PlanSource]} -- The .dvh files to read.  Plan
+            descriptions with a number of fractions use the condition limits
+            for those fractions.
+        reports {Dict[str, ReportDefinition]} -- The reports to check, keyed
+            by name.  Reports without conditions are ignored.
+    Keyword Arguments:
+        max_workers {int} -- The number of worker processes.  If 1, the
+            plans are read in the current process.  If None, one process
+            per CPU is used. (default: {None})
+        fractions {int} -- The number of fractions used for plans whose
+            fractions are not known.  If None, each report uses the fractions
+            of its prescriptions when they all agree. (default: {None})
+        plan_parameters {dict} -- Passed to the Plan constructor
+            (default_units and laterality_exceptions).
+    Returns:
+        PlanQa -- The condition results.
+    '''
+    reports = {name: definition for name, definition in reports.items()
+               if len(definition.conditions)}
+    qa_results = PlanQa()
+    if max_workers == 1:
+        _init_worker(reports, plan_parameters, fractions)
+        results = map(_plan_file_values, plan_files)
+        batches = collect(qa_results, plan_files, results)
+        _WORKER_STATE.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(reports, plan_parameters,
+                                           fractions)) as executor:
+            results = executor.map(_plan_file_values, plan_files,
+                                   chunksize=PLANS_PER_TASK)
+            batches = collect(qa_results, plan_files, results)
+    for report_name, batch in batches.items():
+        qa_results.add_batch(reports[report_name], batch)
+    return qa_results
+
+
+def collect(qa_results: PlanQa, plan_files: Sequence[PlanSource],
+            results: Iterable[List[PlanValues]]
+            )->Dict[str, List[PlanValues]]:
+    '''Group the per-plan values by report.
+    Arguments:
+        qa_results {PlanQa} -- Updated with the plan count and skipped files.
+        plan_files {Sequence[PlanSource]} -- The .dvh files, in the same
+            order as results.
+        results {Iterable[List[PlanValues]]} -- The per-plan values.  None
+            for plans that could not be loaded.
+    Returns:
+        Dict[str, List[PlanValues]] -- The values of all plans, keyed by
+            report name.
+    '''
+    batches = defaultdict(list)
+    for plan_file, plan_result in zip(plan_files, results):
+        if plan_result is None:
+            qa_results.skipped.append(str(plan_source_file(plan_file)))
+            continue
+        qa_results.plan_count += 1
+        for report_values in plan_result:
+            batches[report_values.report].append(report_values)
+    return batches
+
+
+def check_archive(plan_path: Path, reports: Dict[str, ReportDefinition],
+                  report_names: List[str] = None, max_workers: int = None,
+                  fractions: int = None, **plan_parameters)->PlanQa:
+    '''Check the report conditions for every .dvh file in a directory tree.
+    Arguments:
+        plan_path {Path} -- The top directory of the plan archive.
+        reports {Dict[str, ReportDefinition]} -- The available reports,
+            keyed by name.
+    Keyword Arguments:
+        report_names {List[str]} -- The reports to check.  If None, all
+            reports with conditions are checked. (default: {None})
+        max_workers {int} -- The number of worker processes.
+            (default: {None}, one per CPU)
+        fractions {int} -- The number of fractions used to select the
+            condition limits.  If None, each report uses the fractions of its
+            prescriptions when they all agree. (default: {None})
+        plan_parameters {dict} -- Passed to the Plan constructor.
+    Returns:
+        PlanQa -- The condition results.
+    '''
+    if report_names:
+        reports = {name: reports[name] for name in report_names}
+    plan_files = sorted(Path(plan_path).rglob('*.dvh'))
+    qa_results = check_plans(plan_files, reports, max_workers, fractions,
+                             **plan_parameters)
+    LOGGER.info('Condition check of %d plans; %d failing, %d skipped.',
+                qa_results.plan_count, len(qa_results.failing_plans()),
+                len(qa_results.skipped))
+    return qa_results
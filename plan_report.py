@@ -1,13 +1,26 @@
 '''Report on Plan parameters based on defined Criteria'''
 
 #%% imports etc.
-from typing import Optional, Union, Any, Dict, Tuple, List, Set
-from typing import NamedTuple
+from typing import Optional, Union, Any, Dict, Tuple, List, Set, Iterator
+from typing import NamedTuple, Iterable, Match
+from collections.abc import Mapping
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from operator import attrgetter
 from pathlib import Path
+from pickle import dump, load, dumps, loads, UnpicklingError
+import ast
+import hashlib
 import logging
+import re
 import xml.etree.ElementTree as ET
 import xlwings as xw
 from plan_data import Plan, PlanDataItem, ConversionParameters, Structure
+from plan_data import INTERPOLATION_KERNELS, PlanDescription, convert_units
+from plan_data import parse_constructor
+from dose_models import MODEL_TYPES, GEUD_PROPERTIES
+from report_conditions import ConditionSet, ConditionResult, load_constraint
 
 
 Alias = Union[List[Tuple[str, Optional[int]]],
@@ -16,6 +29,66 @@ AliasIndex = Tuple[str, str, str]
 AliasRef = Dict[AliasIndex, Alias]
 LateralityIndex = Tuple[str, str, Optional[int]]
 LateralityRef = Dict[LateralityIndex, str]
+ReferenceIndex = Tuple[str, str, str]
+MatchIndex = Dict[Tuple[str, str], List[Tuple[ReferenceIndex, int]]]
+
+MemoKey = Tuple[str, str, str, str]
+# (report name, report version, plan laterality, structure name fingerprint)
+
+Prescription = Tuple[float, Optional[int]]  # (dose in cGy, fractions)
+PoolKey = Tuple[ReferenceIndex, frozenset]  # (ref_index, alias set)
+
+# Increase whenever a change to the report classes makes previously cached
+# report definitions unusable.
+REPORT_CACHE_SCHEMA = 8
+
+# The root tag of report definition files is read from this many bytes.
+ROOT_SNIFF_BYTES = 4096
+# Fewer report files than this are parsed without starting worker processes.
+PARALLEL_REPORT_FILES = 4
+XML_PREAMBLE = re.compile(rb'<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>|\s+',
+                          re.DOTALL)
+XML_START_TAG = re.compile(rb'<([^\s/>!?]+)')
+
+# Report item schema.
+# Structure properties read from the DVH file header or added by the dose
+# models and plan metrics.
+STRUCTURE_PROPERTIES = frozenset((
+    'Volume', 'Min Dose', 'Max Dose', 'Mean Dose', 'Median Dose',
+    'Modal Dose', 'STD', 'Dose Cover', 'Sampling Cover',
+    'Equiv. Sphere Diam.', 'Conformity Index', 'Gradient Measure',
+    'Approval Status', 'Course', 'Plan', *MODEL_TYPES,
+    *GEUD_PROPERTIES.values()))
+# Constructors allowed for reference types that do not use the structure
+# properties.
+REFERENCE_CONSTRUCTORS = {'Plan Property': ('',),
+                          'Reference Point': ('',),
+                          'Ratio': ('Ratio',)}
+REPORT_UNITS = ('cGy', 'Gy', '%', 'cc')
+CELL_ADDRESS = re.compile(r'^\$?([A-Za-z]{1,3})\$?([0-9]+)$')
+MAX_EXCEL_ROW = 1048576
+MAX_EXCEL_COLUMN = 16384
+# Quoted text and escaped characters in Excel number formats.
+FORMAT_LITERALS = re.compile(r'"[^"]*"|\\.')
+
+# Report item expressions.
+# Item names that are not valid identifiers are written as {item name}.
+ITEM_PLACEHOLDER = re.compile(r'\{([^{}]+)\}')
+EXPRESSION_FUNCTIONS = {'min': min, 'max': max, 'abs': abs, 'round': round}
+EXPRESSION_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+# Fuzzy name matches scoring at least this are offered as suggestions.
+FUZZY_THRESHOLD = 0.7
+# Weight of a matching prescription relative to full reference coverage
+# when ranking reports for a plan.
+PRESCRIPTION_WEIGHT = 1.0
+# Relative tolerance for prescription dose comparisons.
+DOSE_TOLERANCE = 0.01
 
 MatchList = List[PlanDataItem]
 
@@ -43,6 +116,57 @@ def optional_load(xml_element: ET.Element, element_name: str,
     return default_value
 
 
+class ReportDefinitionError(ValueError):
+    '''A report definition that does not match the report item schema.
+    Arguments:
+        report_name {str} -- The name of the report.
+        problems {List[str]} -- A description of each problem found.
+    '''
+    def __init__(self, report_name: str, problems: List[str]):
+        self.report_name = report_name
+        self.problems = problems
+        message = 'Invalid report definition {}:\n\t{}'.format(
+            report_name, '\n\t'.join(problems))
+        super().__init__(message)
+
+
+def cell_position(cell_address: str)->Tuple[int, int]:
+    '''Convert an "A1" style cell address to row and column numbers.
+    Arguments:
+        cell_address {str} -- The Excel cell address, e.g. 'G12' or '$G$12'.
+    Raises:
+        ValueError -- If the address is not a single cell within the Excel
+            worksheet limits.
+    Returns:
+        Tuple[int, int] -- The (row, column) of the cell, starting from 1.
+    '''
+    address = CELL_ADDRESS.match(cell_address.strip())
+    if not address:
+        raise ValueError('Invalid cell address: {}'.format(cell_address))
+    (column_letters, row_text) = address.groups()
+    column = 0
+    for letter in column_letters.upper():
+        column = column * 26 + ord(letter) - ord('A') + 1
+    row = int(row_text)
+    if not (0 < row <= MAX_EXCEL_ROW and column <= MAX_EXCEL_COLUMN):
+        raise ValueError('Cell address out of range: {}'.format(cell_address))
+    return (row, column)
+
+
+def is_percent_format(cell_format: str)->bool:
+    '''Check whether an Excel number format displays values as percent.
+    Excel multiplies values by 100 for these formats.  A % inside quoted
+    text or escaped with a backslash is displayed as is.
+    Arguments:
+        cell_format {str} -- The Excel number format.
+    Returns:
+        bool -- True if the format contains a percent placeholder.
+    '''
+    if not cell_format:
+        return False
+    return '%' in FORMAT_LITERALS.sub('', cell_format)
+
+
 #%% Alias Methods
 def load_alias_list(aliases: ET.Element)->Alias:
     '''Read in a list of alias patterns.
@@ -68,10 +192,15 @@ def load_alias_list(aliases: ET.Element)->Alias:
     return alias_list
 
 
-def load_aliases(alias_root: ET.Element)->AliasRef:
+def load_aliases(alias_root: ET.Element,
+                 learned_aliases: AliasRef = None)->AliasRef:
     '''Read lists of alternate names for ReportElements from a .xml element.
     Arguments:
         aliases: {ET.Element} -- .xml element containing the alias lists.
+    Keyword Arguments:
+        learned_aliases {AliasRef} -- Aliases learned from manual matching.
+            These are added after the aliases defined in alias_root.
+            (default: {None})
     Returns {AliasRef}
         A dictionary for looking up Aliases for report elements.
         The key is a four element tuple:
@@ -105,6 +234,25 @@ def load_aliases(alias_root: ET.Element)->AliasRef:
             alias_list = load_alias_list(aliases)
             alias_index = (ref_type, ref_name, laterality)
             alias_reference[alias_index] = alias_list
+    if learned_aliases:
+        merge_aliases(alias_reference, learned_aliases)
+    return alias_reference
+
+
+def merge_aliases(alias_reference: AliasRef,
+                  new_aliases: AliasRef)->AliasRef:
+    '''Add aliases to an alias reference, skipping any already present.
+    Arguments:
+        alias_reference {AliasRef} -- The alias reference to add to.
+        new_aliases {AliasRef} -- The aliases to add.
+    Returns:
+        AliasRef -- The updated alias_reference.
+    '''
+    for alias_index, alias_list in new_aliases.items():
+        current = alias_reference.setdefault(alias_index, list())
+        for alias in alias_list:
+            if alias not in current:
+                current.append(alias)
     return alias_reference
 
 
@@ -125,23 +273,30 @@ def match_alias(aliases: Alias, plan_elements: List[PlanDataItem],
             laterality_lookup {LateralityRef} -- A dictionary for converting
                 reference and plan laterality in to a laterality indicator.
                 (default: {None})
+            resolver {LateralityResolver} -- The precomputed laterality
+                variants for the plan.  Replaces plan_laterality,
+                lat_patterns and laterality_lookup. (default: {None})
     Returns:
         PlanElement -- The matching item from the plan.
     '''
-    plan_laterality = lat_param['plan_laterality']
-    reference_laterality = lat_param['reference_laterality']
-    laterality_lookup = lat_param['laterality_lookup']
+    resolver = lat_param.get('resolver')
+    if resolver is None:
+        resolver = LateralityResolver(lat_param.get('plan_laterality'),
+                                      lat_param.get('laterality_lookup'),
+                                      lat_param.get('lat_patterns'))
+    reference_laterality = lat_param.get('reference_laterality')
     matched_element = None
     for (pattern, size) in aliases:
         if not size:
             matched_element = plan_elements.get(pattern)
             if matched_element:
                 break
-            matched_element = match_laterality(pattern, plan_elements,
-                                               **lat_param)
+            matched_element = match_laterality(
+                pattern, plan_elements,
+                reference_laterality=reference_laterality,
+                resolver=resolver)
         else:
-            lat_index = (plan_laterality, reference_laterality, size)
-            lat_indicator = laterality_lookup.get(lat_index)
+            lat_indicator = resolver.indicator(reference_laterality, size)
             if lat_indicator:
                 lookup_name = pattern.format(LatIndicator=lat_indicator)
                 matched_element = plan_elements.get(lookup_name)
@@ -211,7 +366,8 @@ def match_laterality(reference_name: str,
                      plan_laterality: str = None,
                      reference_laterality: str = None,
                      lat_patterns: Alias = None,
-                     laterality_lookup: LateralityRef = None)->PlanDataItem:
+                     laterality_lookup: LateralityRef = None,
+                     resolver: 'LateralityResolver' = None)->PlanDataItem:
     '''Identify the plan element that matches this reference.
     Arguments:
         reference_name: {str} -- The base name to use for matching.
@@ -226,22 +382,389 @@ def match_laterality(reference_name: str,
         laterality_lookup {LateralityRef} -- A dictionary for converting
             reference and plan laterality in to a laterality indicator.
             (default: {None})
+        resolver {LateralityResolver} -- The precomputed laterality variants
+            for the plan.  Replaces plan_laterality, lat_patterns and
+            laterality_lookup. (default: {None})
     Returns:
         PlanElement -- The matching item from the plan.
     '''
+    if resolver is None:
+        resolver = LateralityResolver(plan_laterality, laterality_lookup,
+                                      lat_patterns)
     matched_element = None
-    if reference_laterality:
-        for (pattern, size) in lat_patterns:
-            lat_index = (plan_laterality, reference_laterality, size)
-            lat_indicator = laterality_lookup[lat_index]
-            lookup_name = pattern.format(Base=reference_name,
-                                         LatIndicator=lat_indicator)
-            matched_element = plan_elements.get(lookup_name)
-            if matched_element:
-                break
+    for lookup_name in resolver.name_variants(reference_name,
+                                              reference_laterality):
+        matched_element = plan_elements.get(lookup_name)
+        if matched_element:
+            break
     return matched_element
 
 
+class LateralityResolver():
+    '''The laterality indicators and name patterns for one plan laterality.
+    Built once for a plan laterality, so that laterality aware matching only
+    needs dictionary lookups.  Combinations missing from the laterality
+    table have no variants, rather than raising an error.
+    Arguments:
+        plan_laterality {str} -- The laterality of the plan.  One of:
+            'Right', 'Left', 'Both' or None.
+        laterality_lookup {LateralityRef} -- A dictionary for converting
+            reference and plan laterality in to a laterality indicator.
+            (default: {None})
+        lat_patterns {Alias} -- A list of default Reference Name laterality
+            modifiers (default: {None})
+    Attributes:
+        indicators {Dict[Tuple[str, int], str]} -- The laterality indicator
+            for each (reference laterality, size).
+        name_patterns {Dict[str, List[str]]} -- The default laterality
+            patterns for each reference laterality, in order, with the
+            laterality indicator filled in.  Each contains "{Base}".
+    Methods
+        indicator(reference_laterality: str, size: int)->str
+            Return the laterality indicator, or None if not defined.
+        name_variants(reference_name: str, reference_laterality: str)->List[str]
+            Return the lateral names to try for a reference name, in order.
+    '''
+    def __init__(self, plan_laterality: str,
+                 laterality_lookup: LateralityRef = None,
+                 lat_patterns: Alias = None):
+        '''Precompute the laterality indicators and name patterns.
+        Arguments:
+            plan_laterality {str} -- The laterality of the plan.
+            laterality_lookup {LateralityRef} -- A dictionary for converting
+                reference and plan laterality in to a laterality indicator.
+                (default: {None})
+            lat_patterns {Alias} -- A list of default Reference Name
+                laterality modifiers (default: {None})
+        '''
+        self.plan_laterality = plan_laterality
+        # The laterality table uses 'None' for plans without laterality.
+        plan_keys = {plan_laterality, str(plan_laterality)}
+        self.indicators = dict()
+        for (plan_lat, report_lat, size), text in (laterality_lookup or
+                                                   {}).items():
+            if plan_lat in plan_keys:
+                self.indicators[(report_lat, size)] = text
+        self.name_patterns = dict()
+        for (report_lat, _) in self.indicators:
+            if report_lat in self.name_patterns:
+                continue
+            patterns = list()
+            for (pattern, size) in lat_patterns or []:
+                lat_indicator = self.indicators.get((report_lat, size))
+                if lat_indicator is not None:
+                    patterns.append(pattern.replace('{LatIndicator}',
+                                                    lat_indicator))
+            self.name_patterns[report_lat] = patterns
+
+    def indicator(self, reference_laterality: str, size: int)->str:
+        '''Return the laterality indicator for a reference laterality.
+        Arguments:
+            reference_laterality {str} -- The laterality of the report item.
+            size {int} -- The size of the Laterality indicator.
+        Returns:
+            str -- The laterality indicator, or None if not defined.
+        '''
+        return self.indicators.get((reference_laterality, size))
+
+    def name_variants(self, reference_name: str,
+                      reference_laterality: str)->List[str]:
+        '''Return the lateral names to try for a reference name, in order.
+        Arguments:
+            reference_name {str} -- The base name.
+            reference_laterality {str} -- The laterality of the report item.
+        Returns:
+            List[str] -- The names to look up.  Empty for non-lateral report
+                items.
+        '''
+        if not reference_laterality:
+            return list()
+        return [pattern.replace('{Base}', reference_name)
+                for pattern in self.name_patterns.get(reference_laterality, [])]
+
+
+#%% Match Index Methods
+def reference_candidates(reference: 'PlanReference',
+                         resolver: LateralityResolver)->List[str]:
+    '''List the names that PlanReference.match_element would try, in order.
+    Arguments:
+        reference {PlanReference} -- The reference to expand.
+        resolver {LateralityResolver} -- The precomputed laterality variants
+            for the plan laterality.
+    Returns:
+        List[str] -- The candidate names in order of priority.
+    '''
+    reference_laterality = reference.get('reference_laterality')
+    reference_name = reference['reference_name']
+    candidates = [reference_name]
+    candidates.extend(resolver.name_variants(reference_name,
+                                             reference_laterality))
+    for (pattern, size) in reference.get('Aliases', {}):
+        if not size:
+            candidates.append(pattern)
+            candidates.extend(resolver.name_variants(pattern,
+                                                     reference_laterality))
+        else:
+            lat_indicator = resolver.indicator(reference_laterality, size)
+            if lat_indicator:
+                candidates.append(pattern.format(LatIndicator=lat_indicator))
+    return candidates
+
+
+class MatchState(NamedTuple):
+    '''The plan details used in the last match of a report.
+    Attributes:
+        laterality {str} -- The plan laterality.
+        names {Dict[str, frozenset]} -- The plan element names for each
+            element type.
+    '''
+    laterality: str
+    names: Dict[str, frozenset]
+
+    @classmethod
+    def of_plan(cls, plan: Plan)->'MatchState':
+        '''Return the match details of a plan.
+        Arguments:
+            plan {Plan} -- The plan data.
+        Returns:
+            MatchState -- The plan laterality and element names.
+        '''
+        return cls(plan.laterality,
+                   {element_type: frozenset(plan_elements)
+                    for element_type, plan_elements
+                    in plan.data_elements.items()})
+
+
+class CompiledMatches(NamedTuple):
+    '''The compiled reference lookup for one plan laterality.
+    Attributes:
+        lookup {MatchIndex} -- The key is a (reference_type, candidate name)
+            tuple.  The value is a list of (reference index, priority) tuples,
+            where a lower priority is tried first by the ordered search.
+        candidates {Dict[ReferenceIndex, List[str]]} -- The candidate names
+            for each reference, in order of priority.
+    '''
+    lookup: MatchIndex
+    candidates: Dict[ReferenceIndex, List[str]]
+
+
+def compile_match_index(references: Dict[ReferenceIndex, 'PlanReference'],
+                        resolver: LateralityResolver)->CompiledMatches:
+    '''Build a lookup from every candidate plan element name to the
+        references it would match for one plan laterality.
+    Arguments:
+        references {Dict[ReferenceIndex, PlanReference]} -- The report
+            references.
+        resolver {LateralityResolver} -- The precomputed laterality variants
+            for the plan laterality.
+    Returns:
+        CompiledMatches -- The candidate name lookup.
+    '''
+    match_index = dict()
+    reference_names = dict()
+    for reference_index, reference in references.items():
+        candidates = reference_candidates(reference, resolver)
+        reference_names[reference_index] = candidates
+        reference_type = reference['reference_type']
+        for priority, name in enumerate(candidates):
+            hits = match_index.setdefault((reference_type, name), list())
+            if all(hit[0] != reference_index for hit in hits):
+                hits.append((reference_index, priority))
+    return CompiledMatches(match_index, reference_names)
+
+
+def match_references(references: Dict[Any, 'PlanReference'],
+                     compiled: CompiledMatches, plan: Plan,
+                     reference_indexes: Set[Any] = None
+                    )->Dict[Any, Tuple[int, PlanDataItem]]:
+    '''Match a group of references to the plan elements.
+    See Report.match_elements for the matching steps.
+    Arguments:
+        references {Dict[Any, PlanReference]} -- The references to match.
+        compiled {CompiledMatches} -- The compiled lookup for the references
+            and plan laterality.
+        plan {Plan} -- The plan data to match
+    Keyword Arguments:
+        reference_indexes {Set[Any]} -- Only match these references.
+            (default: {None}, match all references)
+    Returns:
+        Dict[Any, Tuple[int, PlanDataItem]] -- The (priority, plan element)
+            of each automatically matched reference.
+    '''
+    (match_index, candidates) = compiled
+    best_matches = dict()
+    if reference_indexes is None:
+        reference_indexes = set(references)
+        for element_type, plan_elements in plan.data_elements.items():
+            for element_name, plan_element in plan_elements.items():
+                hits = match_index.get((element_type, element_name))
+                if not (hits and plan_element):
+                    continue
+                for reference_index, priority in hits:
+                    best = best_matches.get(reference_index)
+                    if best is None or priority < best[0]:
+                        best_matches[reference_index] = (priority,
+                                                         plan_element)
+    else:
+        # For a few references, probing their candidate names is faster
+        # than scanning the plan.
+        for reference_index in reference_indexes:
+            reference_type = references[reference_index]['reference_type']
+            plan_elements = plan.data_elements.get(reference_type, {})
+            for priority, name in enumerate(candidates[reference_index]):
+                plan_element = plan_elements.get(name)
+                if plan_element:
+                    best_matches[reference_index] = (priority, plan_element)
+                    break
+    for reference_index in reference_indexes:
+        references[reference_index].clear_match()
+    for reference_index in reference_indexes:
+        if reference_index in best_matches:
+            continue
+        reference = references[reference_index]
+        name_index = plan.get_name_index(reference['reference_type'])
+        if name_index is None:
+            continue
+        names = candidates[reference_index]
+        (plan_element, score) = name_index.best_match(names)
+        if score >= 1.0:
+            best_matches[reference_index] = (None, plan_element)
+        elif score >= FUZZY_THRESHOLD:
+            LOGGER.debug('Suggested %s for %s, score %4.2f',
+                         plan_element.name, reference['reference_name'],
+                         score)
+            reference.suggest(plan_element, score)
+    for reference_index, (_, plan_element) in best_matches.items():
+        reference = references[reference_index]
+        reference['plan_element'] = plan_element
+        reference['match_method'] = 'Auto'
+    return best_matches
+
+
+#%% Report Item Expressions
+class ItemExpression():
+    '''A calculation using the values of other report items.
+    Expressions use Python arithmetic, comparison and boolean syntax, the
+    functions min, max, abs and round, and the names of other report items
+    in the same report.  Item names that are not valid Python identifiers
+    are written in braces, e.g. "100 * {V105- PTV} / PTV_Volume".
+    Arguments:
+        text {str} -- The expression.
+    Attributes:
+        text {str} -- The expression as written.
+        dependencies {Tuple[str, ...]} -- The report item names used.
+    Raises:
+        ValueError -- If the expression is not valid or uses anything other
+            than the allowed operators, functions and item names.
+    Methods
+        evaluate(values: Dict[str, Any])->Any
+            Calculate the expression from the item values.
+    '''
+    def __init__(self, text: str):
+        '''Parse and check the expression.
+        Arguments:
+            text {str} -- The expression.
+        '''
+        self.text = text.strip()
+        self.placeholders = dict()
+        def placeholder(item_name: Match)->str:
+            key = '_item_{}'.format(len(self.placeholders))
+            self.placeholders[key] = item_name.group(1).strip()
+            return key
+        self.source = ITEM_PLACEHOLDER.sub(placeholder, self.text)
+        try:
+            tree = ast.parse(self.source, mode='eval')
+        except SyntaxError as err:
+            raise ValueError('Invalid expression "{}": {}'.format(
+                self.text, err.msg)) from err
+        dependencies = list()
+        for node in ast.walk(tree):
+            if not isinstance(node, EXPRESSION_NODES):
+                raise ValueError('{} not allowed in expression "{}"'.format(
+                    type(node).__name__, self.text))
+            if isinstance(node, ast.Call):
+                if not (isinstance(node.func, ast.Name) and
+                        node.func.id in EXPRESSION_FUNCTIONS and
+                        not node.keywords):
+                    raise ValueError('Unknown function in expression '
+                                     '"{}"'.format(self.text))
+            elif isinstance(node, ast.Name):
+                if node.id in EXPRESSION_FUNCTIONS:
+                    continue
+                item_name = self.placeholders.get(node.id, node.id)
+                if item_name not in dependencies:
+                    dependencies.append(item_name)
+        self.dependencies = tuple(dependencies)
+        self._code = None
+
+    def __getstate__(self)->Dict[str, Any]:
+        '''Leave out the compiled code, which can not be pickled.'''
+        state = self.__dict__.copy()
+        state['_code'] = None
+        return state
+
+    def evaluate(self, values: Dict[str, Any])->Any:
+        '''Calculate the expression from the item values.
+        Arguments:
+            values {Dict[str, Any]} -- The report item values, keyed by item
+                name.  Must contain all of the dependencies.
+        Returns:
+            Any -- The result, or None if any dependency value is None or
+                the calculation fails.
+        '''
+        names = dict(EXPRESSION_FUNCTIONS)
+        for item_name in self.dependencies:
+            value = values.get(item_name)
+            if value is None:
+                return None
+            names[item_name] = value
+        for key, item_name in self.placeholders.items():
+            names[key] = names[item_name]
+        if self._code is None:
+            self._code = compile(self.source, '<report item>', 'eval')
+        try:
+            return eval(self._code, {'__builtins__': {}}, names)
+        except (ArithmeticError, TypeError, ValueError) as err:
+            LOGGER.warning('Expression "%s" not evaluated: %s', self.text, err)
+            return None
+
+    def __repr__(self)->str:
+        return 'ItemExpression({!r})'.format(self.text)
+
+
+def evaluation_order(report_elements: Dict[str, 'ReportElement'])->List[str]:
+    '''Sort report items so that each item follows the items it uses.
+    Items keep their definition order where possible.
+    Arguments:
+        report_elements {Dict[str, ReportElement]} -- The report items.
+    Raises:
+        ValueError -- If the item expressions refer to each other in a loop.
+    Returns:
+        List[str] -- The item names in evaluation order.
+    '''
+    order = list()
+    state = dict()  # item name: False while visiting, True when done
+    def visit(item_name: str, path: List[str]):
+        visited = state.get(item_name)
+        if visited:
+            return
+        if visited is False:
+            loop = path[path.index(item_name):] + [item_name]
+            raise ValueError('Circular item references: {}'.format(
+                ' -> '.join(loop)))
+        state[item_name] = False
+        element = report_elements[item_name]
+        if element.expression:
+            for dependency in element.expression.dependencies:
+                if dependency in report_elements:
+                    visit(dependency, path + [item_name])
+        state[item_name] = True
+        order.append(item_name)
+    for item_name in report_elements:
+        visit(item_name, [])
+    return order
+
+
 #%% Report classes
 class ReferenceGroup(NamedTuple):
     '''Match Parameters for a PlanReference.
@@ -287,7 +810,7 @@ class PlanReference(dict):
             structure reference.  Can be one of:
                 ('Ipsilateral', 'Contralateral', 'Proximal', 'Both')
         match_method: {str} -- How a plan value was obtained.  One of:
-            	One of Auto, Manual, Direct Entry, None
+            	One of Auto, Manual, Direct Entry, Suggested, None
 
         constructor:
             A string describing the method for extracting the required value.
@@ -298,6 +821,11 @@ class PlanReference(dict):
         Aliases: {AliasRef} -- A dictionary for looking up Aliases for report
             elements.
         plan_element: {PlanElement} -- THe matched element from the Plan.
+        suggested_element: {PlanElement} -- A fuzzy name match from the Plan
+            offered for manual approval.  Only set when match_method is
+            'Suggested'.
+        match_score: {float} -- The fuzzy name match score for the suggested
+            element.
     Arguments:
         reference_def {ET.Element} -- .xml element containing information
             used to link a ReportElement to an individual Plan item and
@@ -329,6 +857,8 @@ class PlanReference(dict):
         self['Aliases'] = self.add_aliases(aliases_def, alias_reference)
         self['plan_element'] = None
         self['match_method'] = None
+        self['suggested_element'] = None
+        self['match_score'] = None
 
     def get_plan_item_name(self)->str:
         '''Return the name of the matched PlanElement, or None if no match.
@@ -361,7 +891,7 @@ class PlanReference(dict):
         ref_type = self.get('reference_type')
         ref_lat = self.get('reference_laterality')
         alias_index = (ref_type, ref_name, ref_lat)
-        aliases = alias_reference.get(alias_index, [])
+        aliases = list(alias_reference.get(alias_index, []))
         if ref_lat:
             alias_index = (ref_type, ref_name, None)
             aliases.extend(alias_reference.get(alias_index, []))
@@ -403,6 +933,9 @@ class PlanReference(dict):
             laterality_lookup {LateralityRef} -- A dictionary for converting
                 reference and plan laterality in to a laterality indicator.
                 (default: {None})
+            resolver {LateralityResolver} -- The precomputed laterality
+                variants for the plan.  Replaces plan_laterality,
+                lat_patterns and laterality_lookup. (default: {None})
         Returns:
             PlanElement -- The matching item from the plan.
         '''
@@ -412,6 +945,11 @@ class PlanReference(dict):
         matched_element = plan_elements.get(reference_name)
         if not matched_element:
             # Try laterality
+            if lat_param.get('resolver') is None:
+                lat_param['resolver'] = LateralityResolver(
+                    lat_param.pop('plan_laterality', None),
+                    lat_param.pop('laterality_lookup', None),
+                    lat_param.pop('lat_patterns', None))
             lat_param['reference_laterality'] = self.get('reference_laterality')
             matched_element = match_laterality(reference_name, plan_elements,
                                                **lat_param)
@@ -425,16 +963,54 @@ class PlanReference(dict):
             self['match_method'] = 'Auto'
         return matched_element
 
+    def copy(self, keep_match: bool = False)->'PlanReference':
+        '''Return a copy of the reference.
+        The copy shares the alias set, which is part of the definition.
+        Keyword Arguments:
+            keep_match {bool} -- Keep the match in the copy.
+                (default: {False})
+        Returns:
+            PlanReference -- The copied reference.
+        '''
+        reference = PlanReference.__new__(PlanReference)
+        reference.update(self)
+        if not keep_match:
+            reference.clear_match()
+        return reference
+
+    def clear_match(self):
+        '''Remove any match, suggestion or entered value.
+        '''
+        self['plan_element'] = None
+        self['match_method'] = None
+        self['suggested_element'] = None
+        self['match_score'] = None
+
+    def suggest(self, plan_element: PlanDataItem, score: float):
+        '''Record a fuzzy name match to be offered for manual approval.
+        Arguments:
+            plan_element {PlanElement} -- The suggested plan element.
+            score {float} -- The name match score.
+        '''
+        self['plan_element'] = None
+        self['match_method'] = 'Suggested'
+        self['suggested_element'] = plan_element
+        self['match_score'] = score
+
     def reference_group(self)->ReferenceGroup:
         '''Return a tuple of match parameters
         Report Item name, match status, plan item type, Plan Item name
+        For suggested matches the Plan Item name is the suggested element.
         '''
+        plan_item = self.matched_name
+        if self['match_method'] == 'Suggested':
+            plan_item = self['suggested_element'].name
         return ReferenceGroup(self.ref_index,
                               self['reference_name'],
                               self['reference_type'],
                               self['reference_laterality'],
                               self['match_method'],
-                              self.matched_name)
+                              plan_item)
 
     match = property(reference_group)
 
@@ -476,9 +1052,17 @@ class Target(dict):
                     Examples:
                         ('General', '@', '0.00', '0.00%', 'yyyy-mm-dd')
                         If not specified, 'General' is used.
+    Attributes:
+        cell {Tuple[int, int]} -- The (row, column) of CellAddress, or None
+            if CellAddress is not given or is not valid.
+        percent {bool} -- True if CellFormat is a percent format, for which
+            values are divided by 100 before they are entered.
     Methods
         __init__(self, **parameters)
-        define(self, cell_address=None, cell_format='General', **parameters)
+        validate()->List[str]
+            Check the target against the report item schema.
+        add_value(value: Any, sheet: xw.Sheet)
+            Enter the value into the spreadsheet.
         '''
     def __init__(self, target_def: ET.Element):
         '''Create the base dictionary and set the supplied target values.
@@ -505,6 +1089,28 @@ class Target(dict):
         self['Unit'] = read_item(target_def, 'Unit')
         self['CellAddress'] = read_item(target_def, 'CellAddress')
         self['CellFormat'] = read_item(target_def, 'CellFormat')
+        self.percent = is_percent_format(self['CellFormat'])
+        try:
+            self.cell = cell_position(self['CellAddress'])
+        except (ValueError, AttributeError):
+            self.cell = None
+
+    def validate(self)->List[str]:
+        '''Check the target against the report item schema.
+        Returns:
+            List[str] -- A description of each problem found.  Empty if the
+                target is valid.
+        '''
+        problems = list()
+        cell_address = self.get('CellAddress')
+        if not cell_address:
+            problems.append('Target has no CellAddress')
+        elif self.cell is None:
+            problems.append('Invalid CellAddress {}'.format(cell_address))
+        unit = self.get('Unit')
+        if unit and unit not in REPORT_UNITS:
+            problems.append('Unknown Target Unit {}'.format(unit))
+        return problems
 
     def add_value(self, value: Any, sheet: xw.Sheet):
         '''Enter the value into the spreadsheet.
@@ -512,17 +1118,17 @@ class Target(dict):
             value {Any} -- The value to be placed in the target cell.
             sheet {xw.Sheet} -- The Excel worksheet containing the target cell.
         '''
-        cell_address = self.get('CellAddress')
-        if cell_address:
+        if self.cell:
+            cell = sheet.range(self.cell)
             cell_format = self.get('CellFormat')
             if cell_format:
                 # Set the cell format
-                sheet.range(cell_address).number_format = cell_format
-                if '%' in cell_format:
+                cell.number_format = cell_format
+                if self.percent:
                     value = value/100
                     # spreadsheet expects percent values as a decimal
             # Set the cell Value
-            sheet.range(cell_address).value = value
+            cell.value = value
 
     def __repr__(self)->str:
         '''Build an Target list string.
@@ -552,23 +1158,36 @@ class ReportElement():
                 optional items.
         category {str} -- Defines the subclass of the ReportElement. One of:
                 ('Info', 'Property', 'Condition')
-                If not specified, 'Info' is used. Currently not used.
-        value {Any} -- The item value extracted from the plan data. Initialized
-            as None. If value is a number the units are those specified in the
-            target attribute.
+                If not specified, 'Info' is used.  Condition items check the
+                value of another report item; see report_conditions.
+        interpolation {Optional, str} -- The DVH interpolation kernel used
+            for DVH point constructors.  One of INTERPOLATION_KERNELS.  If not
+            specified, the default linear interpolation is used.
         reference {PlanReference} --  Contains information used to link this
             report item to a plan value.  All report item definitions must
-            contain a plan reference definition.
+            contain either a plan reference definition or an expression.
+        expression {Optional, ItemExpression} -- A calculation using the
+            values of other report items in the same report.  Used for
+            derived values such as ratios, sums and pass/fail checks.
+            Expression values are not unit converted.
+        condition {Optional, Constraint} -- For Condition items, the report
+            item checked and the limits applied.  The item value is the
+            condition status: 'Pass', 'Warn', 'Fail' or None.
         target {Optional, Target} -- Contains information used to add the item
             value to the report.  Omitting the target attribute will cause the
             value to be obtained from the plan data but not directly displayed
             in the report. The item value can be accessed by other report items
             for calculations or validity checks.
     Methods
-        get_value(conversion_parameters: ConversionParameters)
+        get_value(reference: PlanReference,
+                  conversion_parameters: ConversionParameters)->Any
             Get the matching value from the plan data and perform any necessary
             unit conversions.
-        add_to_report(sheet: xw.Sheet)
+        query_key(reference_index: ReferenceIndex)->Tuple
+            Identify the plan data value requested by this item.
+        validate(reference: PlanReference)->List[str]
+            Check the report item against the report item schema.
+        add_to_report(sheet: xw.Sheet, value: Any)
             Enter the report item value into the spreadsheet.
         table_output(add_reference=False, add_target=False)->Dict[str, Any]
             Build a dictionary containing the key attributes defining the
@@ -591,8 +1210,28 @@ class ReportElement():
         self.category = optional_load(report_item, 'Category',
                                       self.default_category)
         self.constructor = optional_load(report_item, 'Constructor', '')
-        self.value = None
+        self.interpolation = optional_load(report_item, 'Interpolation', None)
+        if self.interpolation not in (None, *INTERPOLATION_KERNELS):
+            LOGGER.warning('Unknown interpolation kernel %s for %s; using '
+                           'linear interpolation.', self.interpolation,
+                           self.name)
+            self.interpolation = None
         self.reference = None
+        self.expression = None
+        self.condition = None
+        self.load_errors = list()
+        expression = optional_load(report_item, 'Expression', None)
+        if expression:
+            try:
+                self.expression = ItemExpression(expression)
+            except ValueError as err:
+                self.load_errors.append(str(err))
+        condition = report_item.find('Condition')
+        if condition is not None:
+            try:
+                self.condition = load_constraint(condition)
+            except ValueError as err:
+                self.load_errors.append(str(err))
         target = report_item.find('Target')
         if target is not None:
             self.target = Target(target)
@@ -600,38 +1239,114 @@ class ReportElement():
             self.target = None
 
     def get_value(self, reference: PlanReference,
-                  conversion: ConversionParameters):
+                  conversion: ConversionParameters)->Any:
         '''Get the matching value from the plan data.  Perform any necessary
             unit conversions.
         Arguments:
+            reference {PlanReference} -- The matched reference for this item.
             conversion {ConversionParameters} -- A dictionary containing the
                 data used to perform any necessary unit conversion.  Starts
                 with only one item:
                     'dose' {float} -- the plan prescription dose
                 Additional items are added before passing through to the
                 PlanElement.get_value method.
+        Returns:
+            Any -- The item value, or None if the reference is not matched.
+                If value is a number the units are those specified in the
+                target attribute.
         '''
         plan_element = reference['plan_element']
-        if plan_element:
-            target_units = self.target.get('Unit')
-            conversion['target_units'] = target_units
-            conversion['constructor'] = self.constructor
-            self.value = plan_element.get_value(**conversion)
-        return self.value
-
-    def add_to_report(self, sheet: xw.Sheet):
+        if not plan_element:
+            return None
+        conversion['target_units'] = self.target_units
+        conversion['constructor'] = self.constructor
+        conversion['interpolation'] = self.interpolation
+        return plan_element.get_value(**conversion)
+
+    @property
+    def target_units(self)->str:
+        '''The units of the report value, or None if not specified.'''
+        if self.target:
+            return self.target.get('Unit')
+        return None
+
+    def query_key(self, reference_index: ReferenceIndex)->Tuple:
+        '''Identify the plan data value requested by this item.
+        Report items with the same query key have the same value, so the
+        plan data only needs to be queried once.
+        Arguments:
+            reference_index {ReferenceIndex} -- The matched reference.
+        Returns:
+            Tuple -- (reference_index, constructor, target_units,
+                interpolation)
+        '''
+        return (reference_index, self.constructor, self.target_units,
+                self.interpolation)
+
+    def validate(self, reference: PlanReference)->List[str]:
+        '''Check the report item against the report item schema.
+        Arguments:
+            reference {PlanReference} -- The reference for this item, or None
+                if the item does not have a PlanReference.
+        Returns:
+            List[str] -- A description of each problem found, prefixed with
+                the item name.  Empty if the item is valid.
+        '''
+        problems = list()
+        if not self.name:
+            problems.append('ReportItem has no name')
+        if self.load_errors:
+            problems.extend(self.load_errors)
+        elif self.category == 'Condition':
+            if self.condition is None:
+                problems.append('Condition item has no Condition')
+            elif reference is not None or self.expression:
+                problems.append('Condition item with a PlanReference or '
+                                'Expression')
+        elif self.condition is not None:
+            problems.append('Condition given for a {} item'.format(
+                self.category))
+        elif self.expression:
+            if reference is not None:
+                problems.append('Both an Expression and a PlanReference')
+        elif reference is None:
+            problems.append('No PlanReference or Expression')
+        else:
+            reference_type = reference.get('reference_type')
+            constructor = self.constructor or ''
+            allowed = REFERENCE_CONSTRUCTORS.get(reference_type)
+            if reference_type == 'Structure':
+                dvh_constructor = parse_constructor(constructor)
+                if dvh_constructor:
+                    if dvh_constructor[2] not in REPORT_UNITS:
+                        problems.append('Unknown constructor unit {}'.format(
+                            constructor))
+                elif constructor not in STRUCTURE_PROPERTIES:
+                    problems.append('Unknown Structure constructor "{}"'.format(
+                        constructor))
+            elif allowed is None:
+                problems.append('Unknown PlanReference Type {}'.format(
+                    reference_type))
+            elif constructor not in allowed:
+                problems.append('Unknown {} constructor "{}"'.format(
+                    reference_type, constructor))
+        if self.target is not None:
+            problems.extend(self.target.validate())
+        return ['{}: {}'.format(self.name, problem) for problem in problems]
+
+    def add_to_report(self, sheet: xw.Sheet, value: Any):
         '''Enter the report item value into the spreadsheet.
         Arguments:
             sheet {xw.Sheet} -- The Excel worksheet where the value is to be
                 placed.
+            value {Any} -- The item value.
         '''
-        value = self.value
-        if value is not None:
+        if value is not None and self.target:
             self.target.add_value(value, sheet)
         return value
 
     def table_output(self, references: Dict[str, PlanReference],
-                     add_target=False)->Dict[str, Any]:
+                     add_target=False, value: Any = None)->Dict[str, Any]:
         '''Build a dictionary containing the key attributes defining the
         ReportElement.  Used to generate the representative string and for
             testing purposes.
@@ -640,6 +1355,7 @@ class ReportElement():
                 dictionary. Default is False
             add_target {bool} -- Include the target instance data in the
                 dictionary. Default is False
+            value {Any} -- The item value from a Report run. Default is None
         Returns:
             Dict[str, Any] -- Dictionary containing the key attributes
                 defining the ReportElement.
@@ -648,7 +1364,7 @@ class ReportElement():
         item_dict['ItemName'] = self.name
         item_dict['ItemLabel'] = self.label
         item_dict['ItemCategory'] = self.category
-        item_dict['ItemValue'] = self.value
+        item_dict['ItemValue'] = value
         reference = references.get(self.reference)
         if reference:
             item_dict['Reference'] = reference
@@ -657,18 +1373,19 @@ class ReportElement():
         return item_dict
 
     def __repr__(self, references: Dict[str, PlanReference],
-                 add_references: bool, add_target: bool)->str:
+                 add_references: bool, add_target: bool,
+                 value: Any = None)->str:
         '''Provide a formatted string describing this ReportElement.
         Returns:
             str -- A formatted string describing this ReportElement.
         '''
-        item_dict = self.table_output(references, add_target)
+        item_dict = self.table_output(references, add_target, value)
         repr_str = '\nReportElement(\n'
         repr_str = '\tName={ItemName}\n'
         repr_str += '\tLabel: {ItemLabel}\n'
         repr_str += '\tCategory: {ItemCategory}\n'
         formatted_string = repr_str.format(**item_dict)
-        if self.value:
+        if value:
             repr_str += '\tValue = {ItemValue}\n'
         if add_references:
             reference = references.get(self.reference)
@@ -682,8 +1399,11 @@ class ReportElement():
         return formatted_string
 
 
-class Report():
+class ReportDefinition():
     '''Defines a Plan Evaluation Report.
+    A report definition is read once and does not hold any plan specific
+    data, so it can be shared by any number of Report runs, threads or
+    worker processes.  Use Report(definition) to match and evaluate a plan.
     Arguments:
         report_def {ET.Element} -- The top element of a report definition
             from an XML file.
@@ -699,6 +1419,8 @@ class Report():
             (default: {None})
         lat_patterns {List[Alias]} -- A list of default Reference Name
             laterality modifiers (default: {None})
+        reference_pool {ReferencePool} -- A pool of references shared
+            between reports. (default: {None})
     Attributes:
         name {str} -- The name of the report
         template_file {Path} -- The directory containing the excel template
@@ -714,25 +1436,38 @@ class Report():
         report_elements {Dict[str, ReportElement]} -- A dictionary of all
             report elements to be entered as part of the report.
             The key is the element item name and the value is a ReportElement.
+        prescriptions {List[Prescription]} -- The dose and fraction schedules
+            the report applies to.  See load_prescriptions.
+        references {Dict[ReferenceIndex, PlanReference]} -- The reference
+            definitions.  These never hold a match.
+        match_indexes {Dict[str, CompiledMatches]} -- Compiled reference
+            lookups, keyed by plan laterality.
+        evaluation_order {List[str]} -- The report item names, ordered so
+            that each item follows the items its expression uses.
+        conditions {ConditionSet} -- The Condition report items, compiled
+            for evaluation as a batch.
     Methods
-        match_elements(self, plan: Plan)->Tuple[MatchList, MatchList]
-            Find match in plan for report elements.
-        get_values(self, plan: Plan)
-            Get values for the Report Elements from the plan data.
-        build(self)->xw.Sheet
-            Open the spreadsheet and save the Report elements.
-        table_output(self, add_items=True, flat_table=False,
-                     add_reference=True, add_target=True)->Dict[str, Any]
-            Build a dictionary summarizing the report definition.
-        __repr__(self, add_items=True)->str
-            Provide a formatted string describing this Report.
+        version(self)->str
+            A fingerprint of the report reference definitions.
+        with_aliases(self, alias_reference: AliasRef)->ReportDefinition
+            Return a copy of the report definition with added aliases.
+        pool_references(self, reference_pool: ReferencePool)
+            Replace the report references with the matching pool entries.
+        match_index(self, plan_laterality: str)->CompiledMatches
+            Return the compiled reference lookup for a plan laterality.
+        default_fractions(self)->int
+            The fractions used for condition limits if not otherwise known.
+    Raises:
+        ReportDefinitionError -- If any report item does not match the
+            report item schema.
     '''
     def __init__(self, report_def: ET.Element,
                  template_path: Path = Path.cwd(),
                  save_path: Path = Path.cwd(), # FIXME this is not a full file path.
                  alias_reference: AliasRef = None,
                  laterality_lookup: AliasRef = None,
-                 lat_patterns: List[Alias] = None):
+                 lat_patterns: List[Alias] = None,
+                 reference_pool: 'ReferencePool' = None):
         '''Load and generate a report definition.
         Arguments:
             report_def {ET.Element} -- The top element of a report definition
@@ -749,6 +1484,10 @@ class Report():
                 (default: {None})
             lat_patterns {List[Alias]} -- A list of default Reference Name
                 laterality modifiers (default: {None})
+            reference_pool {ReferencePool} -- A pool of references shared
+                between reports.  If given, references with the same index
+                and aliases as a pool entry use the pool entry.
+                (default: {None})
         '''
         self.name = report_def.findtext('Name')
         self.description = report_def.findtext('Description').strip()
@@ -758,9 +1497,12 @@ class Report():
         self.worksheet = worksheet
         self.laterality_lookup = laterality_lookup
         self.lat_patterns = lat_patterns
+        self.prescriptions = load_prescriptions(report_def)
 
         self.references = dict()
         self.report_elements = dict()
+        self.match_indexes = dict()
+        problems = list()
         element_list = report_def.find('ReportItemList')
         for element in element_list.findall('ReportItem'):
             if element is not None:
@@ -769,63 +1511,423 @@ class Report():
                 reference = element.find('PlanReference')
                 element_name = element_definition.name
                 reference_index = self.add_reference(reference, alias_reference,
-                                                    element_name)
+                                                     element_name,
+                                                     reference_pool)
                 element_definition.reference = reference_index
+                if element_name in self.report_elements:
+                    problems.append('{}: Duplicate ReportItem name'.format(
+                        element_name))
+                problems.extend(element_definition.validate(
+                    self.references.get(reference_index)))
                 self.report_elements[element_name] = element_definition
+        problems.extend(self.check_dependencies())
+        self.check_cells()
+        if problems:
+            raise ReportDefinitionError(self.name, problems)
+        self.conditions = ConditionSet({
+            element.name: element.condition
+            for element in self.report_elements.values()
+            if element.condition is not None})
 
         save_path = report_def.findtext(r'./FilePaths/Save/Path')
         save_file_name = report_def.findtext(r'./FilePaths/Save/File')
         self.save_file = Path(save_path) / save_file_name
         self.save_worksheet = report_def.findtext(r'./FilePaths/Save/WorkSheet')
 
-    def add_reference(self, reference_def, alias_reference, element_name):
+    def check_dependencies(self)->List[str]:
+        '''Check the report items used by expressions and conditions and set
+        the evaluation order.
+        Conditions are evaluated after all other items, so they can not be
+        used by an expression or by another condition.
+        Returns:
+            List[str] -- A description of each unknown item name or circular
+                reference found.  Empty if the dependencies are valid.
+        '''
+        problems = list()
+        for element in self.report_elements.values():
+            if element.expression is not None:
+                dependencies = element.expression.dependencies
+                source = 'Expression'
+            elif element.condition is not None:
+                dependencies = (element.condition.item,)
+                source = 'Condition'
+            else:
+                continue
+            for item_name in dependencies:
+                used = self.report_elements.get(item_name)
+                if used is None:
+                    problems.append('{}: Unknown report item {} in '
+                                    '{}'.format(element.name, item_name,
+                                                source))
+                elif used.condition is not None:
+                    problems.append('{}: Condition item {} used in '
+                                    '{}'.format(element.name, item_name,
+                                                source))
+        try:
+            self.evaluation_order = evaluation_order(self.report_elements)
+        except ValueError as err:
+            self.evaluation_order = list(self.report_elements)
+            problems.append(str(err))
+        return problems
+
+    @property
+    def default_fractions(self)->int:
+        '''The number of fractions used to select the condition limits when
+        the plan fractions are not known.
+        Returns:
+            int -- The fractions of the report prescriptions, or None if
+                they are not all the same.
+        '''
+        schedules = {fractions for (_, fractions) in self.prescriptions}
+        if len(schedules) == 1:
+            return schedules.pop()
+        return None
+
+    def check_cells(self):
+        '''Warn about report items that write to the same cell.
+        '''
+        cells = dict()
+        for element in self.report_elements.values():
+            if element.target is None or element.target.cell is None:
+                continue
+            other = cells.setdefault(element.target.cell, element.name)
+            if other != element.name:
+                LOGGER.warning('Report %s: %s and %s both use cell %s.',
+                               self.name, other, element.name,
+                               element.target['CellAddress'])
+
+    def add_reference(self, reference_def, alias_reference, element_name,
+                      reference_pool: 'ReferencePool' = None):
         '''build reference lookup'
+        If a reference pool is given, the pooled reference is used.
         '''
         if reference_def is None:
             return None
-        # TODO Check whether reference points to another Report Element
-        # TODO Ratio etc. should not generate new references, but should point to existing report items.
         reference = PlanReference(reference_def, alias_reference)
         # If a reference name is not given use the report element name.
         reference_name = reference['reference_name']
         if not reference_name:
             reference['reference_name'] = element_name
             reference_name = element_name
+        if reference_pool is not None:
+            reference = reference_pool.add(reference)
         self.references[reference.ref_index] = reference
         return reference.ref_index
 
-    def match_elements(self, plan: Plan)->Tuple[MatchList, MatchList]:
+    @property
+    def version(self)->str:
+        '''A fingerprint of the report reference definitions.
+        Changes whenever a reference, alias or laterality setting used for
+        matching changes.
+        Returns:
+            str -- A hexadecimal hash string.
+        '''
+        definition = [(index, sorted(reference.get('Aliases', {}), key=str))
+                      for index, reference in self.references.items()]
+        definition.sort(key=str)
+        settings = (definition, self.lat_patterns,
+                    sorted((self.laterality_lookup or {}).items(), key=str))
+        return hashlib.md5(repr(settings).encode('utf-8')).hexdigest()
+
+    def with_aliases(self, alias_reference: AliasRef)->'ReportDefinition':
+        '''Return a copy of the report definition with added aliases.
+        Used to add learned aliases to previously built reports.  The
+        definition and its references are not changed; references gaining
+        aliases are replaced by copies with a new alias set.  Pooled
+        references must be pooled again with pool_references.
+        Arguments:
+            alias_reference {AliasRef} -- A dictionary for looking up Aliases
+                for report elements.
+        Returns:
+            ReportDefinition -- A new definition, or this definition if no
+                aliases were added.
+        '''
+        references = dict()
+        added = False
+        for reference_index, reference in self.references.items():
+            aliases = reference.get('Aliases', set())
+            new_aliases = set(reference.lookup_aliases(alias_reference))
+            new_aliases -= aliases
+            if new_aliases:
+                reference = reference.copy()
+                reference['Aliases'] = aliases | new_aliases
+                added = True
+            references[reference_index] = reference
+        if not added:
+            return self
+        report = copy(self)
+        report.references = references
+        report.match_indexes = dict()
+        return report
+
+    def pool_references(self, reference_pool: 'ReferencePool'):
+        '''Replace the report references with the matching pool entries.
+        Used to share the references of separately loaded reports.
+        Arguments:
+            reference_pool {ReferencePool} -- A pool of references shared
+                between reports.
+        '''
+        for reference_index, reference in list(self.references.items()):
+            self.references[reference_index] = reference_pool.add(reference)
+        self.match_indexes.clear()
+
+    def match_index(self, plan_laterality: str)->CompiledMatches:
+        '''Return the compiled reference lookup for a plan laterality.
+        The lookup is compiled the first time a plan laterality is used.
+        Arguments:
+            plan_laterality {str} -- The laterality of the plan.  One of:
+                'Right', 'Left', 'Both' or None.
+        Returns:
+            CompiledMatches -- See compile_match_index.
+        '''
+        compiled = self.match_indexes.get(plan_laterality)
+        if compiled is None:
+            resolver = LateralityResolver(plan_laterality,
+                                          self.laterality_lookup,
+                                          self.lat_patterns)
+            compiled = compile_match_index(self.references, resolver)
+            self.match_indexes[plan_laterality] = compiled
+        return compiled
+
+
+class Report():
+    '''The evaluation of a report definition for one plan.
+    Holds the reference matches and report item values.  Everything else is
+    read from the shared ReportDefinition, so creating a Report is cheap and
+    does not change the definition.
+    Arguments:
+        definition {ReportDefinition} -- The report definition.
+    Attributes:
+        definition {ReportDefinition} -- The report definition.
+        references {Dict[ReferenceIndex, PlanReference]} -- Copies of the
+            definition references holding the matches for this run.
+        values {Dict[str, Any]} -- The report item values, keyed by report
+            item name.
+        conditions {Dict[str, ConditionResult]} -- The results of the
+            Condition report items, keyed by report item name.
+        save_file {Path} -- The path, including file name, where the filled
+            template is to be saved.
+        match_state {MatchState} -- The plan laterality and element names
+            used in the last match.
+    Methods
+        match_index(self, plan_laterality: str)->CompiledMatches
+            Return the compiled reference lookup for a plan laterality.
+        match_elements(self, plan: Plan, reference_indexes=None
+                       )->Tuple[MatchList, MatchList]
+            Find match in plan for report elements.
+        apply_matches(self, pool_matches: Dict[PoolKey, PlanReference],
+                      plan: Plan)
+            Use the matches from ReferencePool.match_elements.
+        affected_references(self, plan: Plan)->Set[ReferenceIndex]
+            Find the references whose match may differ for this plan.
+        rebind(self, plan: Plan)
+            Point matched references to the elements of a reloaded plan.
+        get_values(self, plan: Plan, fractions: int = None)
+            Get values for the Report Elements from the plan data,
+            calculate the expression items and check the conditions.
+        check_conditions(self, fractions: int = None
+                         )->Dict[str, ConditionResult]
+            Evaluate the Condition report items from the item values.
+        build(self)->xw.Sheet
+            Open the spreadsheet and save the Report elements.
+        table_output(self, add_items=True, flat_table=False,
+                     add_reference=True, add_target=True)->Dict[str, Any]
+            Build a dictionary summarizing the report.
+        __repr__(self, add_items=True)->str
+            Provide a formatted string describing this Report.
+    '''
+    def __init__(self, definition: ReportDefinition):
+        '''Start a new evaluation of a report definition.
+        Arguments:
+            definition {ReportDefinition} -- The report definition.
+        '''
+        self.definition = definition
+        self.references = {reference_index: reference.copy()
+                           for reference_index, reference
+                           in definition.references.items()}
+        self.values = dict()
+        self.conditions = dict()
+        self.save_file = definition.save_file
+        self.match_state = None
+
+    @property
+    def name(self)->str:
+        '''The name of the report.'''
+        return self.definition.name
+
+    @property
+    def description(self)->str:
+        '''The report description.'''
+        return self.definition.description
+
+    @property
+    def template_file(self)->Path:
+        '''The excel template used by the report.'''
+        return self.definition.template_file
+
+    @property
+    def worksheet(self)->str:
+        '''The name of the template worksheet.'''
+        return self.definition.worksheet
+
+    @property
+    def save_worksheet(self)->str:
+        '''The name of the worksheet to save the report in.'''
+        return self.definition.save_worksheet
+
+    @property
+    def prescriptions(self)->List[Prescription]:
+        '''The dose and fraction schedules the report applies to.'''
+        return self.definition.prescriptions
+
+    @property
+    def report_elements(self)->Dict[str, 'ReportElement']:
+        '''The report element definitions.'''
+        return self.definition.report_elements
+
+    @property
+    def laterality_lookup(self)->LateralityRef:
+        '''The laterality indicator lookup table.'''
+        return self.definition.laterality_lookup
+
+    @property
+    def lat_patterns(self)->List[Alias]:
+        '''The default Reference Name laterality modifiers.'''
+        return self.definition.lat_patterns
+
+    @property
+    def version(self)->str:
+        '''A fingerprint of the report reference definitions.'''
+        return self.definition.version
+
+    def match_index(self, plan_laterality: str)->CompiledMatches:
+        '''Return the compiled reference lookup for a plan laterality.
+        See ReportDefinition.match_index.
+        '''
+        return self.definition.match_index(plan_laterality)
+
+    def match_elements(self, plan: Plan,
+                       reference_indexes: Set[ReferenceIndex] = None
+                      )->Tuple[MatchList, MatchList]:
         '''Find match in plan for report elements.
+        Each plan element name is looked up once in the compiled reference
+        index.  The result is the same as calling
+        PlanReference.match_element for each reference.  References that are
+        still not matched are then compared with the plan element names
+        ignoring case, white space and underscores, which is accepted as a
+        match.  Failing that, the best fuzzy name match scoring at least
+        FUZZY_THRESHOLD is offered as a suggestion for manual approval.
         Arguments:
             plan {Plan} -- The plan data to match
+        Keyword Arguments:
+            reference_indexes {Set[ReferenceIndex]} -- Only match these
+                references.  Other references are left unchanged.
+                (default: {None}, match all references)
         Returns:
             Tuple[MatchList, MatchList] -- Dictionaries of matched and
                 unmatched report items. The key is the ReportElement name.
                 For matched, the value is the matching plan item.
                 For unmatched the value is None.
         '''
+        compiled = self.match_index(plan.laterality)
+        # Passing None lets match_references scan the plan elements once,
+        # rather than probing the candidate names of every reference.
+        best_matches = match_references(self.references, compiled, plan,
+                                        reference_indexes)
+        self.match_state = MatchState.of_plan(plan)
+
         matched = list()
         not_matched = list()
-        lat_param = dict(plan_laterality=plan.laterality,
-                         lat_patterns=self.lat_patterns,
-                         laterality_lookup=self.laterality_lookup)
         for report_item in self.report_elements.values():
-            reference_name = report_item.reference
-            reference = self.references.get(reference_name)
-            if reference:
-                reference_type = reference['reference_type']
-                plan_elements = plan.data_elements.get(reference_type)
-            else:
-                plan_elements = None
-            if plan_elements:
-                matched_element = reference.match_element(plan_elements,
-                                                          **lat_param)
-            if matched_element:
-                matched.append(matched_element)
+            if reference_indexes is not None and \
+                    report_item.reference not in reference_indexes:
+                continue
+            best = best_matches.get(report_item.reference)
+            if best:
+                matched.append(best[1])
             else:
-                not_matched.append(matched_element)
+                not_matched.append(None)
         return (matched, not_matched)
 
+    def apply_matches(self, pool_matches: Dict[PoolKey, PlanReference],
+                      plan: Plan):
+        '''Use the matches from ReferencePool.match_elements.
+        Matching a plan once with the reference pool and applying the
+        result to each report avoids matching shared references repeatedly.
+        References that are not in the pool are matched directly.
+        Arguments:
+            pool_matches {Dict[PoolKey, PlanReference]} -- The matched pool
+                references.
+            plan {Plan} -- The plan data matched by the pool.
+        '''
+        not_pooled = set()
+        for reference_index, reference in self.references.items():
+            pool_match = pool_matches.get(ReferencePool.pool_key(reference))
+            if pool_match is None:
+                not_pooled.add(reference_index)
+            else:
+                reference.update(pool_match)
+        if not_pooled:
+            self.match_elements(plan, not_pooled)
+        self.match_state = MatchState.of_plan(plan)
+
+    def affected_references(self, plan: Plan)->Set[ReferenceIndex]:
+        '''Find the references whose automatic match may differ for this plan
+            from the last call to match_elements.
+        A reference is affected when one of its candidate names was added to
+        or removed from the plan.  References that were not matched exactly
+        (normalised, suggested or unmatched) depend on all plan names of their
+        type.  Manual matches and direct entries are only affected if the
+        manually matched plan element was removed.
+        Arguments:
+            plan {Plan} -- The plan data to match
+        Returns:
+            Set[ReferenceIndex] -- The affected references, or None if all
+                references must be matched again, because the report has not
+                been matched or the plan laterality changed.
+        '''
+        state = self.match_state
+        if state is None or state.laterality != plan.laterality:
+            return None
+        compiled = self.match_index(plan.laterality)
+        affected = set()
+        for element_type, plan_elements in plan.data_elements.items():
+            old_names = state.names.get(element_type, frozenset())
+            changed = old_names.symmetric_difference(plan_elements)
+            if not changed:
+                continue
+            for reference_index, reference in self.references.items():
+                if reference['reference_type'] != element_type:
+                    continue
+                method = reference['match_method']
+                if method == 'Direct Entry':
+                    continue
+                if method == 'Manual':
+                    if reference.matched_name in changed:
+                        affected.add(reference_index)
+                    continue
+                names = compiled.candidates[reference_index]
+                exact = method == 'Auto' and reference.matched_name in names
+                if not exact or not changed.isdisjoint(names):
+                    affected.add(reference_index)
+        return affected
+
+    def rebind(self, plan: Plan):
+        '''Point matched references to the elements of a reloaded plan with
+            the same element names.
+        Arguments:
+            plan {Plan} -- The plan data.
+        '''
+        for reference in self.references.values():
+            method = reference['match_method']
+            if method in ('Auto', 'Manual') and reference['plan_element']:
+                reference['plan_element'] = plan.get_data_element(
+                    reference['reference_type'], reference.matched_name)
+            elif method == 'Suggested':
+                reference['suggested_element'] = plan.get_data_element(
+                    reference['reference_type'],
+                    reference['suggested_element'].name)
+
     def get_matches(self)->Dict[str, ReferenceGroup]:
         '''return a dictionary of reference matches
         '''
@@ -839,31 +1941,78 @@ class Report():
         if not new_ref.match_status:
             reference['plan_element'] = None
             updated = True
-        elif new_ref.match_status is 'Direct Entry':
+        elif new_ref.match_status == 'Direct Entry':
             reference['plan_element'] = new_ref.plan_Item
             updated = True
-        elif new_ref.match_status is 'Manual':
+        elif new_ref.match_status in ('Manual', 'Auto'):
             matched_element = plan.get_data_element(new_ref.reference_type,
                                                     new_ref.plan_Item)
             reference['plan_element'] = matched_element
             updated = True
+        elif new_ref.match_status == 'Suggested':
+            matched_element = plan.get_data_element(new_ref.reference_type,
+                                                    new_ref.plan_Item)
+            reference.suggest(matched_element, None)
+            updated = True
         return updated
 
-    def get_values(self, plan: Plan):
-        '''Get values for the Report Elements from the plan data.
+    def get_values(self, plan: Plan, fractions: int = None):
+        '''Get values for the Report Elements from the plan data,
+        calculate the expression items and check the conditions.
+        Items are evaluated in the definition's evaluation_order, so each
+        expression is calculated after the items it uses.  Items requesting
+        the same plan data value share a single lookup.  An expression item
+        is None if any item it uses is None.
         Arguments:
             plan {Plan} -- The plan data to obtain the values from.
+        Keyword Arguments:
+            fractions {int} -- The plan number of fractions, used to select
+                the condition limits.  See check_conditions.
+                (default: {None})
         '''
         conversion_parameters = dict(
             dose=plan.prescription_dose.element_value
             )
-        for element in self.report_elements.values():
-            reference_name = element.reference
-            reference = self.references.get(reference_name)
+        self.values = dict()
+        plan_values = dict()
+        for item_name in self.definition.evaluation_order:
+            element = self.report_elements[item_name]
+            if element.condition is not None:
+                continue
+            if element.expression is not None:
+                self.values[item_name] = element.expression.evaluate(
+                    self.values)
+                continue
+            reference = self.references.get(element.reference)
             if reference:
-                element.get_value(reference, conversion_parameters)
+                query = element.query_key(element.reference)
+                if query not in plan_values:
+                    plan_values[query] = element.get_value(
+                        reference, conversion_parameters)
+                self.values[item_name] = plan_values[query]
+        self.check_conditions(fractions)
         return None
 
+    def check_conditions(self, fractions: int = None
+                         )->Dict[str, ConditionResult]:
+        '''Evaluate the Condition report items from the item values.
+        The condition status is stored as the Condition item value.
+        Keyword Arguments:
+            fractions {int} -- The plan number of fractions.  If None and all
+                of the report prescriptions have the same number of
+                fractions, that number is used. (default: {None})
+        Returns:
+            Dict[str, ConditionResult] -- The result of each condition, keyed
+                by Condition report item name.
+        '''
+        if fractions is None:
+            fractions = self.definition.default_fractions
+        self.conditions = self.definition.conditions.evaluate(self.values,
+                                                              fractions)
+        for item_name, result in self.conditions.items():
+            self.values[item_name] = result.status
+        return self.conditions
+
     def build(self)->xw.Sheet:
         '''Open the spreadsheet and save the Report elements.
         Returns:
@@ -894,7 +2043,7 @@ class Report():
 
         # Add elements to the worksheet
         for element in self.report_elements.values():
-            element.add_to_report(spreadsheet)
+            element.add_to_report(spreadsheet, self.values.get(element.name))
         #workbook.save(str(self.save_file))
         return workbook
 
@@ -946,7 +2095,8 @@ class Report():
         if add_items:
             item_list = list()
             for element in self.report_elements.values():
-                item_dict = element.table_output(references, add_target)
+                item_dict = element.table_output(references, add_target,
+                                                 self.values.get(element.name))
                 if flat_table:
                     item_dict.update(report_dict)
                 item_list.append(item_dict)
@@ -977,53 +2127,924 @@ class Report():
         # Add strings for each report item
         repr_str += '\n'
         for element in self.report_elements.values():
-            e_str = element.__repr__(self.references, add_references, add_target)
+            e_str = element.__repr__(self.references, add_references,
+                                     add_target,
+                                     self.values.get(element.name))
             repr_str += '\n'.join('\t' + line for line in e_str.splitlines())
         repr_str += '\n'
         return repr_str
 
 
-def read_report_files(report_locations: List[Path],
-                      **parameters)->Dict[str, Report]:
+def sniff_root_tag(xml_file: Path)->str:
+    '''Return the root element tag of an XML file without parsing the file.
+    Only the first ROOT_SNIFF_BYTES of the file are read.  If the root tag is
+    not found in that prefix the file is parsed up to the root element.
+    Arguments:
+        xml_file {Path} -- The XML file.
+    Returns:
+        str -- The root element tag, or None if the file can not be read.
+    '''
+    try:
+        with open(str(xml_file), 'rb') as file:
+            prefix = file.read(ROOT_SNIFF_BYTES)
+    except OSError as err:
+        LOGGER.warning('Unable to read %s: %s', xml_file, err)
+        return None
+    prefix = prefix.lstrip(b'\xef\xbb\xbf')
+    start = XML_PREAMBLE.match(prefix)
+    position = 0
+    while start and start.end() > position:
+        position = start.end()
+        start = XML_PREAMBLE.match(prefix, position)
+    tag = XML_START_TAG.match(prefix, position)
+    if tag:
+        return tag.group(1).decode('utf-8', errors='replace')
+    try:
+        (_, element) = next(ET.iterparse(str(xml_file), events=['start']))
+    except (ET.ParseError, StopIteration) as err:
+        LOGGER.warning('Unable to parse %s: %s', xml_file, err)
+        return None
+    return element.tag
+
+
+def is_report_file(xml_file: Path)->bool:
+    '''Check whether an XML file contains report definitions.
+    Arguments:
+        xml_file {Path} -- The XML file.
+    Returns:
+        bool -- True if the file has a ReportDefinitions root element.
+    '''
+    root_tag = sniff_root_tag(xml_file)
+    return bool(root_tag) and 'ReportDefinitions' in root_tag
+
+
+def find_report_files(report_locations: List[Path])->List[Path]:
+    '''List the XML report definition files in the given directories.
+    Files are listed in the order of report_locations, sorted by name
+    within each directory.
+    Arguments:
+        report_locations {List[Path]} -- A list of full paths to folders
+            containing Report definition .xml files.
+    Returns:
+        List[Path] -- The .xml files with a ReportDefinitions root element.
+    '''
+    report_files = list()
+    for report_path in report_locations:
+        for file in sorted(Path(report_path).glob('*.xml')):
+            if is_report_file(file):
+                report_files.append(file)
+    return report_files
+
+
+def iterate_report_elements(report_file: Path)->Iterator[ET.Element]:
+    '''Read the Report elements of an XML report file one at a time.
+    The file is parsed incrementally.  Each Report element is yielded as
+    soon as it is complete and is cleared and removed from the root element
+    when the next one is requested, so only one report definition is held
+    in memory at a time.
+    Arguments:
+        report_file {Path} -- The full path to the Report .xml file.
+    Raises:
+        ET.ParseError -- If the file is not well formed.  Reports before
+            the error have already been yielded.
+    Returns:
+        Iterator[ET.Element] -- The top element of each report definition.
+    '''
+    report_root = None
+    depth = 0
+    for (event, element) in ET.iterparse(str(report_file),
+                                         events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if report_root is None:
+                report_root = element
+            continue
+        depth -= 1
+        if depth == 1 and element.tag == 'Report':
+            yield element
+            element.clear()
+            report_root.remove(element)
+        elif depth == 1:
+            report_root.remove(element)
+
+
+def load_report_definitions(report_file: Path,
+                            **report_parameters)->Dict[str, ReportDefinition]:
+    '''Read in all report definitions contained in a given XML report file
+    The file is read one report at a time; see iterate_report_elements.
+    Arguments:
+        report_file {Path} -- The full path to the Report .xml file.
+        report_parameters {dict} -- parameters used to define reports.
+            See the ReportDefinition class for details.
+    Returns:
+        Dict[str, ReportDefinition] -- A dictionary of report definitions,
+            the key is the name of the report.  Reports that do not match
+            the report item schema are logged and left out.
+    '''
+    report_dict = dict()
+    for report_def in iterate_report_elements(report_file):
+        try:
+            report = ReportDefinition(report_def, **report_parameters)
+        except ReportDefinitionError as err:
+            LOGGER.error('%s not loaded from %s', err, report_file)
+            continue
+        report_dict[report.name] = report
+    return report_dict
+
+
+def load_report_files(report_files: List[Path], max_workers: int = None,
+                      **report_parameters
+                      )->List[Tuple[Path, Dict[str, ReportDefinition]]]:
+    '''Read the report definitions from several XML report files.
+    The files are parsed in a pool of worker processes.  If a
+    reference_pool is given, the references of the loaded reports are added
+    to the pool after parsing, in the order of report_files.
+    Arguments:
+        report_files {List[Path]} -- The Report .xml files.
+        report_parameters {dict} -- parameters used to define reports.
+            See the ReportDefinition class for details.
+    Keyword Arguments:
+        max_workers {int} -- The number of worker processes.  If 1, or if
+            there are fewer than PARALLEL_REPORT_FILES files, the files are
+            parsed in the current process.  If None, one process per CPU is
+            used. (default: {None})
+    Returns:
+        List[Tuple[Path, Dict[str, ReportDefinition]]] -- The report file
+            and the report definitions read from it, in the order of
+            report_files.
+    '''
+    reference_pool = report_parameters.pop('reference_pool', None)
+    load_file = partial(load_report_definitions, **report_parameters)
+    if max_workers == 1 or len(report_files) < PARALLEL_REPORT_FILES:
+        report_dicts = [load_file(file) for file in report_files]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            report_dicts = list(executor.map(load_file, report_files))
+    if reference_pool is not None:
+        for report_dict in report_dicts:
+            for report in report_dict.values():
+                report.pool_references(reference_pool)
+    return list(zip(report_files, report_dicts))
+
+
+def read_report_files(report_locations: List[Path], max_workers: int = None,
+                      **parameters)->Dict[str, ReportDefinition]:
     '''Read in all report definitions contained in the XML report files
     located in the given directories.
+    If more than one file defines a report with the same name, the report
+    from the file listed last by find_report_files is used.
     Arguments:
         report_locations {List[Path]} -- A list of full paths to folders
             containing Report definition .xml files.
         report_parameters {dict} -- parameters used to define reports.
-            See the Report class definition for details.
+            See the ReportDefinition class for details.
+    Keyword Arguments:
+        max_workers {int} -- The number of worker processes.  See
+            load_report_files. (default: {None})
     Returns:
-        Dict[str, Report] -- A dictionary of report definitions, the key is
-            the name of the report.
+        Dict[str, ReportDefinition] -- A dictionary of report definitions,
+            the key is the name of the report.
     '''
-    def load_report_definitions(report_file: Path,
-                                report_parameters: dict)->Dict[str, Report]:
-        '''Read in all report definitions contained in a given XML report file
+    report_definitions = dict()
+    report_sources = dict()
+    report_files = find_report_files(report_locations)
+    for file, report_dict in load_report_files(report_files, max_workers,
+                                               **parameters):
+        for report_name, report in report_dict.items():
+            if report_name in report_sources:
+                LOGGER.warning('Report %s in %s replaces the definition in '
+                               '%s', report_name, file,
+                               report_sources[report_name])
+            report_sources[report_name] = file
+            report_definitions[report_name] = report
+    return report_definitions
+
+
+#%% Reference Pool
+class ReferencePool(dict):
+    '''A pool of PlanReferences shared by all loaded report definitions.
+    References with the same index and alias set are stored once, and each
+    report definition holds the pooled reference.  The pool can match all
+    distinct references against a plan in one pass, so the matching cost
+    depends on the number of distinct references rather than the number of
+    reports.
+    The key is a PoolKey: (reference index, frozenset of aliases).
+    Arguments:
+        laterality_lookup {LateralityRef} -- A dictionary for converting
+            reference and plan laterality in to a laterality indicator.
+            (default: {None})
+        lat_patterns {List[Alias]} -- A list of default Reference Name
+            laterality modifiers (default: {None})
+    Attributes:
+        match_indexes {Dict[str, CompiledMatches]} -- Compiled reference
+            lookups, keyed by plan laterality.
+    Methods
+        pool_key(reference: PlanReference)->PoolKey
+            Return the pool key for a reference.
+        add(reference: PlanReference)->PlanReference
+            Return the pooled reference, adding it if it is new.
+        match_index(plan_laterality: str)->CompiledMatches
+            Return the compiled lookup for all pooled references.
+        match_elements(plan: Plan)->Dict[PoolKey, PlanReference]
+            Match all pooled references to a plan.
+        from_reports(report_definitions: Iterable[ReportDefinition])
+            ->ReferencePool
+            Create a pool holding the references of several reports.
+    '''
+    def __init__(self, laterality_lookup: LateralityRef = None,
+                 lat_patterns: List[Alias] = None):
+        '''Create an empty pool.
+        Arguments:
+            laterality_lookup {LateralityRef} -- A dictionary for converting
+                reference and plan laterality in to a laterality indicator.
+                (default: {None})
+            lat_patterns {List[Alias]} -- A list of default Reference Name
+                laterality modifiers (default: {None})
+        '''
+        super().__init__()
+        self.laterality_lookup = laterality_lookup
+        self.lat_patterns = lat_patterns
+        self.match_indexes = dict()
+
+    @staticmethod
+    def pool_key(reference: PlanReference)->PoolKey:
+        '''Return the pool key for a reference.
+        Arguments:
+            reference {PlanReference} -- The reference.
+        Returns:
+            PoolKey -- (reference index, frozenset of aliases)
+        '''
+        return (reference.ref_index,
+                frozenset(reference.get('Aliases', set())))
+
+    @classmethod
+    def from_reports(cls, report_definitions: Iterable['ReportDefinition']
+                     )->'ReferencePool':
+        '''Create a pool holding the references of several reports.
+        The report definitions are not changed.  They must share the same
+        laterality settings, which are taken from the first definition.
         Arguments:
-            report_file {Path} -- The full path to the Report .xml file.
-            report_parameters {dict} -- parameters used to define reports.
-                See the Report class definition for details.
+            report_definitions {Iterable[ReportDefinition]} -- The reports.
         Returns:
-            Dict[str, Report] -- A dictionary of report definitions, the key is
-                the name of the report.
+            ReferencePool -- The pooled references.
         '''
-        report_tree = ET.parse(report_file)
-        report_root = report_tree.getroot()
-        report_dict = dict()
-        for report_def in report_root.findall('Report'):
-            report = Report(report_def, **report_parameters)
-            report_dict[report.name] = report
-        return report_dict
+        report_definitions = list(report_definitions)
+        if report_definitions:
+            first = report_definitions[0]
+            reference_pool = cls(first.laterality_lookup, first.lat_patterns)
+        else:
+            reference_pool = cls()
+        for definition in report_definitions:
+            for reference in definition.references.values():
+                reference_pool.add(reference)
+        return reference_pool
+
+    def add(self, reference: PlanReference)->PlanReference:
+        '''Return the pooled reference, adding it if it is new.
+        Arguments:
+            reference {PlanReference} -- A newly created reference.
+        Returns:
+            PlanReference -- The pool entry with the same index and aliases.
+        '''
+        key = self.pool_key(reference)
+        pooled = self.get(key)
+        if pooled is None:
+            self[key] = reference
+            self.match_indexes.clear()
+            pooled = reference
+        return pooled
+
+    def match_index(self, plan_laterality: str)->CompiledMatches:
+        '''Return the compiled lookup for all pooled references.
+        Arguments:
+            plan_laterality {str} -- The laterality of the plan.
+        Returns:
+            CompiledMatches -- See compile_match_index.
+        '''
+        compiled = self.match_indexes.get(plan_laterality)
+        if compiled is None:
+            resolver = LateralityResolver(plan_laterality,
+                                          self.laterality_lookup,
+                                          self.lat_patterns)
+            compiled = compile_match_index(self, resolver)
+            self.match_indexes[plan_laterality] = compiled
+        return compiled
+
+    def match_elements(self, plan: Plan)->Dict[PoolKey, PlanReference]:
+        '''Match all pooled references to a plan.
+        The pooled references are not changed.  Pass the result to
+        Report.apply_matches for each report, instead of calling
+        Report.match_elements.
+        Arguments:
+            plan {Plan} -- The plan data to match
+        Returns:
+            Dict[PoolKey, PlanReference] -- A matched copy of each pool
+                entry.
+        '''
+        compiled = self.match_index(plan.laterality)
+        references = {key: reference.copy()
+                      for key, reference in self.items()}
+        match_references(references, compiled, plan)
+        return references
 
-    report_definitions = dict()
+
+#%% Report Definition Cache
+class ReportSummary(NamedTuple):
+    '''The report details needed before a report is selected.
+    Attributes:
+        name {str} -- The name of the report.
+        description {str} -- The report description.
+        template_file {Path} -- The excel template used by the report.
+        worksheet {str} -- The name of the template worksheet.
+        prescriptions {List[Prescription]} -- The dose and fraction schedules
+            the report applies to.
+        source {str} -- The XML file the report was read from.
+    '''
+    name: str
+    description: str
+    template_file: Path
+    worksheet: str
+    prescriptions: List[Prescription]
+    source: str
+
+
+class CacheEntry(NamedTuple):
+    '''A cached report definition.
+    Attributes:
+        summary {ReportSummary} -- The report details.
+        data {bytes} -- The pickled ReportDefinition, or None if it has not
+            been read from the cache file.
+        position {Tuple[int, int]} -- The offset and size of the pickled
+            ReportDefinition in the cache file. (default: {None})
+    '''
+    summary: ReportSummary
+    data: bytes = None
+    position: Tuple[int, int] = None
+
+
+class ReportChanges(NamedTuple):
+    '''The report definition files changed since a previous scan.
+    Attributes:
+        current {Dict[str, int]} -- The modification time in nanoseconds of
+            each report definition file found.
+        changed {List[Path]} -- New or modified report definition files.
+        removed {Set[str]} -- Previously found files that no longer exist or
+            no longer contain report definitions.
+    '''
+    current: Dict[str, int]
+    changed: List[Path]
+    removed: Set[str]
+
+    @property
+    def count(self)->int:
+        '''The number of files added, changed or removed.'''
+        return len(self.changed) + len(self.removed)
+
+
+def scan_report_files(report_locations: List[Path],
+                      sources: Dict[str, int])->ReportChanges:
+    '''Find the report definition files changed since a previous scan.
+    Only new or changed .xml files are checked for a ReportDefinitions root
+    element.
+    Arguments:
+        report_locations {List[Path]} -- A list of full paths to folders
+            containing Report definition .xml files.
+        sources {Dict[str, int]} -- The modification time in nanoseconds of
+            each report definition file found by the previous scan.
+    Returns:
+        ReportChanges -- The changed files.
+    '''
+    current = dict()
+    changed = list()
     for report_path in report_locations:
-        for file in report_path.glob('*.xml'):
-            file_iter = ET.iterparse(str(file), events=['start'])
-            (event, elm) = file_iter.__next__()
-            if 'ReportDefinitions' in elm.tag:
-                report_dict = load_report_definitions(file, parameters)
-                report_definitions.update(report_dict)
-    return report_definitions
+        for file in sorted(Path(report_path).glob('*.xml')):
+            (source, mtime) = (str(file), file.stat().st_mtime_ns)
+            if sources.get(source) == mtime:
+                current[source] = mtime
+            elif is_report_file(file):
+                current[source] = mtime
+                changed.append(file)
+    removed = set(sources) - set(current)
+    return ReportChanges(current, changed, removed)
+
+
+def report_summary(report: ReportDefinition, source: str)->ReportSummary:
+    '''Return the report details needed before a report is selected.
+    Arguments:
+        report {ReportDefinition} -- The report definition.
+        source {str} -- The XML file the report was read from.
+    Returns:
+        ReportSummary -- The report details.
+    '''
+    return ReportSummary(report.name, report.description,
+                         report.template_file, report.worksheet,
+                         report.prescriptions, source)
+
+
+class ReportCache(dict):
+    '''Compiled report definitions, stored with the details needed to tell
+    when they are out of date.
+    The key is the report name and the value is a CacheEntry.  The cache
+    file contains each pickled ReportDefinition followed by an index holding
+    the report summaries, so loading the cache only reads the index.
+    Reports are unpickled individually when requested.
+    Arguments:
+        cache_file {Path} -- The file the cache was loaded from.
+            (default: {None})
+    Attributes:
+        schema {int} -- The cache format version.  Cache files written with
+            a different REPORT_CACHE_SCHEMA are discarded.
+        settings {str} -- A fingerprint of the report parameters (aliases,
+            laterality settings and template path) used to build the reports.
+        locations {List[str]} -- The report definition directories.
+        sources {Dict[str, int]} -- The modification time in nanoseconds of
+            each report definition file.
+        loaded {Dict[str, ReportDefinition]} -- Reports already built or
+            unpickled in this session.  Not saved.
+    Methods
+        settings_fingerprint(parameters: dict)->str
+            Return a fingerprint of the report parameters.
+        refresh(report_locations: List[Path], max_workers=None,
+                **parameters)->int
+            Rebuild the reports whose definition files have changed.
+        apply_changes(changes: ReportChanges, report_files, settings: str)
+            ->List[str]
+            Replace the reports read from changed files.
+        get_report(report_name: str, reference_pool=None)->ReportDefinition
+            Return a report, unpickling it if necessary.
+        save(cache_file: Path)
+            Write the cache to a file.
+        load(cache_file: Path)->ReportCache
+            Read the cache index from a file.
+    '''
+    def __init__(self, cache_file: Path = None):
+        '''Create an empty cache.
+        Keyword Arguments:
+            cache_file {Path} -- The file the cache was loaded from.
+                (default: {None})
+        '''
+        super().__init__()
+        self.cache_file = cache_file
+        self.schema = REPORT_CACHE_SCHEMA
+        self.settings = None
+        self.locations = list()
+        self.sources = dict()
+        self.loaded = dict()
+
+    @staticmethod
+    def settings_fingerprint(parameters: dict)->str:
+        '''Return a fingerprint of the report parameters.
+        Arguments:
+            parameters {dict} -- The ReportDefinition keyword arguments.  Any
+                reference_pool is ignored.
+        Returns:
+            str -- A hexadecimal hash string.
+        '''
+        settings = list()
+        for name, value in sorted(parameters.items()):
+            if name == 'reference_pool':
+                continue
+            if isinstance(value, dict):
+                value = sorted(value.items(), key=str)
+            settings.append((name, str(value)))
+        return hashlib.md5(repr(settings).encode('utf-8')).hexdigest()
+
+    def discard(self, sources: Set[str]):
+        '''Remove the reports read from the given files.
+        Arguments:
+            sources {Set[str]} -- The report definition files.
+        '''
+        stale = [name for name, entry in self.items()
+                 if entry.summary.source in sources]
+        for report_name in stale:
+            del self[report_name]
+            self.loaded.pop(report_name, None)
+
+    def refresh(self, report_locations: List[Path], max_workers: int = None,
+                **parameters)->int:
+        '''Rebuild the reports whose definition files have changed.
+        All reports are rebuilt if the report parameters have changed.  Only
+        new or changed .xml files are checked for a ReportDefinitions root
+        element.
+        Arguments:
+            report_locations {List[Path]} -- A list of full paths to folders
+                containing Report definition .xml files.
+            parameters {dict} -- parameters used to define reports.
+                See the ReportDefinition class for details.
+        Keyword Arguments:
+            max_workers {int} -- The number of worker processes.  See
+                load_report_files. (default: {None})
+        Returns:
+            int -- The number of report definition files added, changed or
+                removed.
+        '''
+        settings = self.settings_fingerprint(parameters)
+        if settings != self.settings:
+            self.clear()
+            self.sources.clear()
+            self.loaded.clear()
+            self.settings = settings
+        self.locations = [str(location) for location in report_locations]
+        changes = scan_report_files(report_locations, self.sources)
+        LOGGER.debug('Reading report definitions from %d files',
+                     len(changes.changed))
+        report_files = load_report_files(changes.changed, max_workers,
+                                         **parameters)
+        self.apply_changes(changes, report_files, settings)
+        return changes.count
+
+    def apply_changes(self, changes: ReportChanges,
+                      report_files: List[Tuple[Path,
+                                               Dict[str, ReportDefinition]]],
+                      settings: str)->List[str]:
+        '''Replace the reports read from changed files.
+        If the settings fingerprint differs from the cache settings, all
+        cached reports are removed first.
+        Arguments:
+            changes {ReportChanges} -- The changed files.
+            report_files {List[Tuple[Path, Dict[str, ReportDefinition]]]} --
+                The reports read from changes.changed.  See
+                load_report_files.
+            settings {str} -- The fingerprint of the report parameters used
+                to read the reports.
+        Returns:
+            List[str] -- The names of the reports removed, added or
+                replaced.
+        '''
+        if settings != self.settings:
+            updated = list(self)
+            self.clear()
+            self.loaded.clear()
+            self.settings = settings
+        else:
+            stale = changes.removed | {str(file) for file in changes.changed}
+            updated = [name for name, entry in self.items()
+                       if entry.summary.source in stale]
+            self.discard(stale)
+        for file, report_dict in report_files:
+            source = str(file)
+            for report_name, report in report_dict.items():
+                self[report_name] = CacheEntry(report_summary(report, source),
+                                               dumps(report))
+                self.loaded[report_name] = report
+                updated.append(report_name)
+        self.sources = dict(changes.current)
+        return list(dict.fromkeys(updated))
+
+    def read_data(self, entry: CacheEntry)->bytes:
+        '''Return the pickled ReportDefinition for a cache entry.
+        Arguments:
+            entry {CacheEntry} -- The cache entry.
+        Returns:
+            bytes -- The pickled ReportDefinition.
+        '''
+        if entry.data is not None:
+            return entry.data
+        (offset, size) = entry.position
+        with open(str(self.cache_file), 'rb') as file:
+            file.seek(offset)
+            return file.read(size)
+
+    def get_report(self, report_name: str,
+                   reference_pool: 'ReferencePool' = None)->ReportDefinition:
+        '''Return a report, unpickling it if necessary.
+        Arguments:
+            report_name {str} -- The name of the report.
+        Keyword Arguments:
+            reference_pool {ReferencePool} -- If given, the references of the
+                report are replaced by the pool entries. (default: {None})
+        Returns:
+            ReportDefinition -- The report definition, or None if it is not
+                in the cache or can not be read.  An unreadable report is
+                rebuilt by the next refresh.
+        '''
+        report = self.loaded.get(report_name)
+        if report is None:
+            entry = self.get(report_name)
+            if entry is None:
+                return None
+            try:
+                report = loads(self.read_data(entry))
+            except (OSError, EOFError, UnpicklingError, AttributeError,
+                    ImportError, TypeError) as err:
+                LOGGER.warning('Cached report %s not loaded: %s', report_name,
+                               err)
+                self.sources.pop(entry.summary.source, None)
+                return None
+            self.loaded[report_name] = report
+        if reference_pool is not None:
+            report.pool_references(reference_pool)
+        return report
+
+    def save(self, cache_file: Path):
+        '''Write the cache to a file.
+        The pickled report definitions are written first, followed by the
+        pickled index and the 8 byte offset of the index.
+        Arguments:
+            cache_file {Path} -- The full path to the cache file.
+        '''
+        report_data = {name: self.read_data(entry)
+                       for name, entry in self.items()}
+        entries = dict()
+        with open(str(cache_file), 'wb') as file:
+            for report_name, data in report_data.items():
+                position = (file.tell(), len(data))
+                file.write(data)
+                entries[report_name] = CacheEntry(self[report_name].summary,
+                                                  position=position)
+            index_offset = file.tell()
+            cache_index = dict(schema=self.schema, settings=self.settings,
+                               locations=self.locations,
+                               sources=self.sources, reports=entries)
+            dump(cache_index, file)
+            file.write(index_offset.to_bytes(8, 'big'))
+        self.update(entries)
+        self.cache_file = cache_file
+
+    @classmethod
+    def load(cls, cache_file: Path)->'ReportCache':
+        '''Read the cache index from a file.
+        Arguments:
+            cache_file {Path} -- The full path to the cache file.
+        Returns:
+            ReportCache -- The cached reports.  Empty if the file does not
+                exist, can not be read or has a different schema version.
+        '''
+        report_cache = cls()
+        try:
+            with open(str(cache_file), 'rb') as file:
+                file.seek(-8, 2)
+                file.seek(int.from_bytes(file.read(8), 'big'))
+                cache_index = load(file)
+        except (OSError, EOFError, UnpicklingError, AttributeError,
+                ValueError) as err:
+            LOGGER.debug('Report cache not loaded: %s', err)
+            return report_cache
+        if not isinstance(cache_index, dict) or \
+                cache_index.get('schema') != REPORT_CACHE_SCHEMA:
+            LOGGER.info('Report cache %s is out of date.', cache_file)
+            return report_cache
+        report_cache.cache_file = cache_file
+        report_cache.settings = cache_index['settings']
+        report_cache.locations = cache_index['locations']
+        report_cache.sources = cache_index['sources']
+        report_cache.update(cache_index['reports'])
+        return report_cache
+
+
+class ReportCatalog(Mapping):
+    '''The available report definitions, keyed by name.
+    Only the report summaries are read when the catalog is created.  A full
+    ReportDefinition is read from the cache the first time it is requested
+    and kept for later requests.  Iterating over the values or items reads
+    every report.
+    Arguments:
+        report_cache {ReportCache} -- The cached report definitions.
+    Keyword Arguments:
+        reference_pool {ReferencePool} -- A pool of references shared
+            between the loaded reports. (default: {None})
+        learned_aliases {AliasRef} -- Aliases added to each report when it
+            is loaded. (default: {None})
+    Methods
+        summary(report_name: str)->ReportSummary
+            Return the report details without loading the report.
+        loaded()->List[str]
+            The names of the reports that have been loaded.
+        apply_changes(changes: ReportChanges, report_files, settings: str)
+            ->List[str]
+            Replace the reports read from changed files.
+    '''
+    def __init__(self, report_cache: ReportCache,
+                 reference_pool: 'ReferencePool' = None,
+                 learned_aliases: AliasRef = None):
+        '''Create the catalog.
+        Arguments:
+            report_cache {ReportCache} -- The cached report definitions.
+        Keyword Arguments:
+            reference_pool {ReferencePool} -- A pool of references shared
+                between the loaded reports. (default: {None})
+            learned_aliases {AliasRef} -- Aliases added to each report when
+                it is loaded. (default: {None})
+        '''
+        self.report_cache = report_cache
+        self.reference_pool = reference_pool
+        self.learned_aliases = learned_aliases
+        self.reports = dict()
+
+    def __getitem__(self, report_name: str)->ReportDefinition:
+        report = self.reports.get(report_name)
+        if report is None:
+            report = self.report_cache.get_report(report_name,
+                                                  self.reference_pool)
+            if report is None:
+                raise KeyError(report_name)
+            if self.learned_aliases:
+                report = report.with_aliases(self.learned_aliases)
+                if self.reference_pool is not None:
+                    report.pool_references(self.reference_pool)
+            self.reports[report_name] = report
+        return report
+
+    def __iter__(self):
+        return iter(self.report_cache)
+
+    def __len__(self)->int:
+        return len(self.report_cache)
+
+    def __contains__(self, report_name: str)->bool:
+        return report_name in self.report_cache
+
+    def summary(self, report_name: str)->ReportSummary:
+        '''Return the report details without loading the report.
+        Arguments:
+            report_name {str} -- The name of the report.
+        Returns:
+            ReportSummary -- The report details, or None if not found.
+        '''
+        entry = self.report_cache.get(report_name)
+        if entry is None:
+            return None
+        return entry.summary
+
+    def loaded(self)->List[str]:
+        '''The names of the reports that have been loaded.
+        Returns:
+            List[str] -- The loaded report names.
+        '''
+        return list(self.reports)
+
+    def apply_changes(self, changes: ReportChanges,
+                      report_files: List[Tuple[Path,
+                                               Dict[str, ReportDefinition]]],
+                      settings: str)->List[str]:
+        '''Replace the reports read from changed files.
+        Loaded copies of the replaced reports are dropped, so the new
+        definitions are used the next time the reports are requested.
+        Arguments:
+            changes {ReportChanges} -- The changed files.
+            report_files {List[Tuple[Path, Dict[str, ReportDefinition]]]} --
+                The reports read from changes.changed.
+            settings {str} -- The fingerprint of the report parameters used
+                to read the reports.
+        Returns:
+            List[str] -- The names of the reports removed, added or
+                replaced.
+        '''
+        updated = self.report_cache.apply_changes(changes, report_files,
+                                                  settings)
+        for report_name in updated:
+            self.reports.pop(report_name, None)
+        return updated
+
+
+#%% Report Selection
+def load_prescriptions(report_def: ET.Element)->List[Prescription]:
+    '''Read the prescription schedules that a report applies to.
+    Schedules are read from optional Prescription elements:
+        <Prescriptions>
+            <Prescription Dose="4800" Fractions="4"/>
+        </Prescriptions>
+    with Dose in cGy.  If these are not given, schedules such as
+    "48 Gy in 4F" or "60Gy/5F" are read from the report description, and
+    "48 in 4" from the report name.
+    Arguments:
+        report_def {ET.Element} -- The top element of a report definition.
+    Returns:
+        List[Prescription] -- (dose in cGy, fractions) tuples.  Fractions may
+            be None.  Empty if no prescription is found.
+    '''
+    prescriptions = list()
+    for element in report_def.findall(r'./Prescriptions/Prescription'):
+        fractions = element.attrib.get('Fractions')
+        prescriptions.append((float(element.attrib.get('Dose')),
+                              int(fractions) if fractions else None))
+    if prescriptions:
+        return prescriptions
+    schedule_text = re.compile(
+        r'(?P<dose>\d+(?:\.\d+)?)\s*Gy\s*(?:in|/)\s*(?P<fractions>\d+)\s*F')
+    description = report_def.findtext('Description') or ''
+    for dose, fractions in schedule_text.findall(description):
+        prescriptions.append((float(dose)*100, int(fractions)))
+    if not prescriptions:
+        name_text = re.compile(
+            r'(?P<dose>\d+(?:\.\d+)?)\s*(?:Gy)?\s*in\s*(?P<fractions>\d+)')
+        name = report_def.findtext('Name') or ''
+        for dose, fractions in name_text.findall(name):
+            prescriptions.append((float(dose)*100, int(fractions)))
+    return prescriptions
+
+
+def prescription_match(prescriptions: List[Prescription], dose: float,
+                       fractions: int = None)->float:
+    '''Score how well a plan prescription fits a report's schedules.
+    Arguments:
+        prescriptions {List[Prescription]} -- The report schedules.
+        dose {float} -- The plan prescription dose in cGy.
+        fractions {int} -- The plan number of fractions. (default: {None})
+    Returns:
+        float -- 1.0 if the dose matches a schedule and the fractions match or
+            are not known, 0.25 if only the dose matches, 0.0 otherwise or if
+            either prescription is unknown.
+    '''
+    best = 0.0
+    if not dose:
+        return best
+    for report_dose, report_fractions in prescriptions:
+        if abs(report_dose - dose) > DOSE_TOLERANCE*report_dose:
+            continue
+        if fractions and report_fractions and fractions != report_fractions:
+            best = max(best, 0.25)
+        else:
+            return 1.0
+    return best
+
+
+class ReportScore(NamedTuple):
+    '''How well a report fits a plan.
+    Attributes:
+        report_name {str} -- The name of the report.
+        score {float} -- The combined ranking score.
+        coverage {float} -- The fraction of the report references that
+            match a plan element exactly.
+        prescription {float} -- The prescription match score.  See
+            prescription_match.
+    '''
+    report_name: str
+    score: float
+    coverage: float
+    prescription: float
+
+
+def rank_reports(report_definitions: Dict[str, ReportDefinition], plan: Plan,
+                 plan_description: PlanDescription = None)->List[ReportScore]:
+    '''Rank the report definitions by how well they fit a plan.
+    The compiled reference lookups of all reports are combined so that each
+    plan element name is looked up once.  The reference coverage is combined
+    with the prescription match, weighted by PRESCRIPTION_WEIGHT.
+    Arguments:
+        report_definitions {Dict[str, ReportDefinition]} -- The report
+            definitions.
+        plan {Plan} -- The plan data.
+    Keyword Arguments:
+        plan_description {PlanDescription} -- Used for the prescription dose
+            and fractions.  If not given, the plan prescription dose is used.
+            (default: {None})
+    Returns:
+        List[ReportScore] -- The reports in order of decreasing score.
+    '''
+    combined = dict()
+    for report_name, report in report_definitions.items():
+        lookup = report.match_index(plan.laterality).lookup
+        for key, hits in lookup.items():
+            entries = combined.setdefault(key, list())
+            entries.extend((report_name, hit[0]) for hit in hits)
+    matched = {report_name: set() for report_name in report_definitions}
+    for element_type, plan_elements in plan.data_elements.items():
+        for element_name, plan_element in plan_elements.items():
+            if not plan_element:
+                continue
+            for report_name, reference_index in combined.get(
+                    (element_type, element_name), ()):
+                matched[report_name].add(reference_index)
+
+    if plan_description is not None:
+        dose = plan_description.dose
+        fractions = plan_description.fractions
+    else:
+        prescription_dose = plan.prescription_dose
+        dose = prescription_dose.element_value
+        if dose and prescription_dose.unit not in (None, 'cGy'):
+            dose = convert_units(dose, prescription_dose.unit, 'cGy')
+        fractions = None
+    scores = list()
+    for report_name, report in report_definitions.items():
+        num_references = len(report.references)
+        coverage = (len(matched[report_name]) / num_references
+                    if num_references else 0.0)
+        rx_score = prescription_match(report.prescriptions, dose, fractions)
+        score = coverage + PRESCRIPTION_WEIGHT*rx_score
+        scores.append(ReportScore(report_name, score, coverage, rx_score))
+    scores.sort(key=attrgetter('score'), reverse=True)
+    return scores
+
+
+def select_report(report_definitions: Dict[str, ReportDefinition], plan: Plan,
+                  plan_description: PlanDescription = None)->str:
+    '''Return the name of the report that best fits a plan.
+    Arguments:
+        report_definitions {Dict[str, ReportDefinition]} -- The report
+            definitions.
+        plan {Plan} -- The plan data.
+    Keyword Arguments:
+        plan_description {PlanDescription} -- See rank_reports.
+            (default: {None})
+    Returns:
+        str -- The best report name, or None if there are no reports.
+    '''
+    ranking = rank_reports(report_definitions, plan, plan_description)
+    if ranking:
+        return ranking[0].report_name
+    return None
 
 
 #%% Match History class and Methods
@@ -1066,11 +3087,26 @@ class MatchHistory(list):
         last_change = self.pop()
         return last_change
 
-def rerun_matching(report: Report, plan: Plan, matches: MatchHistory)->Report:
+def rerun_matching(report: Report, plan: Plan, matches: MatchHistory,
+                   pool_matches: Dict[PoolKey, PlanReference] = None
+                   )->Report:
     '''Re-run the match with updated plan data and then apply stored manual
         matching and entries.
+    Only references affected by changes in the plan element names are
+    matched again.  All matching is repeated if the plan laterality changed.
+    If pool_matches, the result of ReferencePool.match_elements for the plan,
+    is given, it is used instead of repeating all matching.
     '''
-    report.match_elements(plan)
+    affected = report.affected_references(plan)
+    if affected is None:
+        if pool_matches is None:
+            report.match_elements(plan)
+        else:
+            report.apply_matches(pool_matches, plan)
+    else:
+        report.rebind(plan)
+        if affected:
+            report.match_elements(plan, affected)
     for change_match in matches.changed():
         report.update_ref(change_match, plan)
     return report
@@ -1081,11 +3117,295 @@ def undo_match(report: Report, plan: Plan, change: MatchHistoryItem)->Report:
     return report
 
 def reset_matching(report: Report, plan: Plan, history: MatchHistory)->Report:
-    '''Re-run the match with updated plan data and then apply stored manual
-        matching and entries.
+    '''Discard the changes in history and restore the automatic matches for
+        the changed references.
     '''
-    report.match_elements(plan)
-    for change_match in matches.changed():
-        report.update_ref(change_match, plan)
+    changed = {change.reference_index for change in history.changed()}
+    changed.update(change.old_value.reference_index for change in history)
+    if changed:
+        report.match_elements(plan, changed)
     history = MatchHistory()
-    return report, history
\ No newline at end of file
+    return report, history
+
+
+#%% Match Memo
+def structure_fingerprint(plan: Plan)->str:
+    '''Return a hash of the sorted set of plan structure names.
+    Arguments:
+        plan {Plan} -- The plan data.
+    Returns:
+        str -- A hexadecimal hash string.
+    '''
+    names = sorted(plan.data_elements.get('Structure', {}))
+    return hashlib.md5('\n'.join(names).encode('utf-8')).hexdigest()
+
+
+class MatchMemo(dict):
+    '''A persistent record of the final reference matches for previously
+        seen plan naming schemes.
+    The key is a MemoKey: (report name, report version, plan laterality,
+        structure name fingerprint).
+    The value is the dictionary of ReferenceGroup matches returned by
+        Report.get_matches, including any manual matches and entries.
+    Methods
+        memo_key(report: Report, plan: Plan)->MemoKey
+            Build the memo key for a report and plan.
+        recall(report: Report, plan: Plan)->bool
+            Apply stored matches to the report.
+        store(report: Report, plan: Plan)
+            Record the current report matches.
+        save(memo_file: Path)
+            Write the memo to a pickle file.
+        load(memo_file: Path)->MatchMemo
+            Read a memo from a pickle file.
+    '''
+    @staticmethod
+    def memo_key(report: Report, plan: Plan)->MemoKey:
+        '''Build the memo key for a report and plan.
+        Arguments:
+            report {Report} -- The report being matched.
+            plan {Plan} -- The plan data.
+        Returns:
+            MemoKey -- (report name, report version, plan laterality,
+                structure name fingerprint)
+        '''
+        return (report.name, report.version, str(plan.laterality),
+                structure_fingerprint(plan))
+
+    def recall(self, report: Report, plan: Plan)->bool:
+        '''Apply stored matches to the report.
+        Arguments:
+            report {Report} -- The report to be matched.
+            plan {Plan} -- The plan data.
+        Returns:
+            bool -- True if stored matches were found and applied.
+        '''
+        matches = self.get(self.memo_key(report, plan))
+        if not matches:
+            return False
+        for match in matches.values():
+            if match.reference_index in report.references:
+                report.update_ref(match, plan)
+        LOGGER.debug('Recalled matches for %s', report.name)
+        return True
+
+    def store(self, report: Report, plan: Plan):
+        '''Record the current report matches.
+        Arguments:
+            report {Report} -- The matched report.
+            plan {Plan} -- The plan data.
+        '''
+        self[self.memo_key(report, plan)] = report.get_matches()
+
+    def save(self, memo_file: Path):
+        '''Write the memo to a pickle file.
+        Arguments:
+            memo_file {Path} -- The full path to the memo file.
+        '''
+        with open(str(memo_file), 'wb') as file:
+            dump(dict(self), file)
+
+    @classmethod
+    def load(cls, memo_file: Path)->'MatchMemo':
+        '''Read a memo from a pickle file.
+        Arguments:
+            memo_file {Path} -- The full path to the memo file.
+        Returns:
+            MatchMemo -- The stored matches.  Empty if the file does not
+                exist or can not be read.
+        '''
+        memo = cls()
+        try:
+            with open(str(memo_file), 'rb') as file:
+                memo.update(load(file))
+        except (OSError, EOFError, UnpicklingError, AttributeError) as err:
+            LOGGER.debug('Match memo not loaded: %s', err)
+        return memo
+
+
+#%% Learned Alias Store
+class LearnedAliases(dict):
+    '''Aliases learned from accepted manual matches, with usage counts.
+    The key is an AliasIndex: (ReferenceType, ReferenceName, Laterality).
+    The value is a dictionary with alias tuples (alias_pattern, Size) as
+        keys and the number of times the alias was used as values.
+    The store is saved in the AliasList XML format used by the config file,
+        with an additional Count attribute for each Alias, so that it can be
+        reviewed and copied into the config file.
+    Methods
+        learn(match: ReferenceGroup, plan_laterality: str,
+              laterality_lookup: LateralityRef)->Tuple[str, Optional[int]]
+            Add the plan item name of a manual match as an alias.
+        record(matches: List[ReferenceGroup], plan_laterality: str,
+               laterality_lookup: LateralityRef)->int
+            Add the aliases for all manual matches.
+        alias_reference(min_count: int = 1)->AliasRef
+            Return the learned aliases in the AliasRef format.
+        to_xml()->ET.Element
+            Build an AliasList XML element from the learned aliases.
+        save(alias_file: Path)
+            Write the learned aliases to an XML file.
+        load(alias_file: Path)->LearnedAliases
+            Read learned aliases from an XML file.
+    '''
+    @staticmethod
+    def alias_pattern(plan_item: str, plan_laterality: str,
+                      reference_laterality: str,
+                      laterality_lookup: LateralityRef
+                     )->Tuple[str, Optional[int]]:
+        '''Convert a matched plan item name into an alias.
+        For references that depend on the plan laterality, the laterality
+        indicator in the name is replaced by "{LatIndicator}" so that the
+        alias also applies to plans with the opposite laterality.
+        Arguments:
+            plan_item {str} -- The name of the matched plan element.
+            plan_laterality {str} -- The laterality of the plan.
+            reference_laterality {str} -- The laterality of the reference.
+            laterality_lookup {LateralityRef} -- A dictionary for converting
+                reference and plan laterality in to a laterality indicator.
+        Returns:
+            Tuple[str, Optional[int]] -- The alias pattern and size, or None
+                if a laterality dependent name has no laterality indicator.
+        '''
+        if '{' in plan_item or '}' in plan_item:
+            return None
+        if reference_laterality in (None, 'Both'):
+            return (plan_item, None)
+        indicators = [(size, indicator) for (plan_lat, ref_lat, size), indicator
+                      in (laterality_lookup or {}).items()
+                      if plan_lat == plan_laterality
+                      and ref_lat == reference_laterality]
+        # Try the longest indicators first.  Multi-letter indicators may
+        # start a CamelCase word; single letters must stand alone.
+        for size, indicator in sorted(indicators, key=lambda item: -len(item[1])):
+            start = r'(?<![A-Za-z])' if len(indicator) == 1 else r'(?<![A-Z])'
+            found = re.search(start + re.escape(indicator) + r'(?![a-z])',
+                              plan_item)
+            if found:
+                pattern = (plan_item[:found.start()] + '{LatIndicator}'
+                           + plan_item[found.end():])
+                return (pattern, size)
+        return None
+
+    def learn(self, match: ReferenceGroup, plan_laterality: str,
+              laterality_lookup: LateralityRef)->Tuple[str, Optional[int]]:
+        '''Add the plan item name of a manual match as an alias.
+        Arguments:
+            match {ReferenceGroup} -- The manual match.
+            plan_laterality {str} -- The laterality of the plan.
+            laterality_lookup {LateralityRef} -- A dictionary for converting
+                reference and plan laterality in to a laterality indicator.
+        Returns:
+            Tuple[str, Optional[int]] -- The learned alias, or None if the
+                match can not be used as an alias.
+        '''
+        if match.match_status != 'Manual' or not match.plan_Item:
+            return None
+        if match.plan_Item == match.reference_name:
+            return None
+        alias = self.alias_pattern(match.plan_Item, plan_laterality,
+                                   match.laterality, laterality_lookup)
+        if alias is None:
+            LOGGER.debug('No laterality indicator found in %s.',
+                         match.plan_Item)
+            return None
+        alias_index = (match.reference_type, match.reference_name,
+                       match.laterality)
+        counts = self.setdefault(alias_index, dict())
+        counts[alias] = counts.get(alias, 0) + 1
+        return alias
+
+    def record(self, matches: List[ReferenceGroup], plan_laterality: str,
+               laterality_lookup: LateralityRef)->int:
+        '''Add the aliases for all manual matches.
+        Arguments:
+            matches {List[ReferenceGroup]} -- Accepted matches, such as
+                MatchHistory.changed().
+            plan_laterality {str} -- The laterality of the plan.
+            laterality_lookup {LateralityRef} -- A dictionary for converting
+                reference and plan laterality in to a laterality indicator.
+        Returns:
+            int -- The number of aliases recorded.
+        '''
+        learned = [self.learn(match, plan_laterality, laterality_lookup)
+                   for match in matches]
+        return len([alias for alias in learned if alias])
+
+    def alias_reference(self, min_count: int = 1)->AliasRef:
+        '''Return the learned aliases in the AliasRef format.
+        Arguments:
+            min_count {int} -- Only include aliases used at least this many
+                times. (default: {1})
+        Returns:
+            AliasRef -- The aliases for each reference, most used first.
+        '''
+        alias_reference = dict()
+        for alias_index, counts in self.items():
+            alias_list = [alias for alias, count in
+                          sorted(counts.items(), key=lambda item: -item[1])
+                          if count >= min_count]
+            if alias_list:
+                alias_reference[alias_index] = alias_list
+        return alias_reference
+
+    def to_xml(self)->ET.Element:
+        '''Build an AliasList XML element from the learned aliases.
+        Returns:
+            ET.Element -- An AliasList element in the config file format,
+                with a Count attribute for each Alias.
+        '''
+        alias_root = ET.Element('AliasList')
+        for (ref_type, ref_name, laterality), counts in sorted(self.items(),
+                                                                key=str):
+            element = ET.SubElement(alias_root, 'PlanElement', name=ref_name)
+            ET.SubElement(element, 'Type').text = ref_type
+            ET.SubElement(element, 'ReferenceName').text = ref_name
+            if laterality:
+                ET.SubElement(element, 'Laterality').text = laterality
+            aliases = ET.SubElement(element, 'Aliases')
+            for (pattern, size), count in sorted(counts.items(),
+                                                 key=lambda item: -item[1]):
+                alias = ET.SubElement(aliases, 'Alias', Count=str(count))
+                if size:
+                    alias.set('Size', str(size))
+                alias.text = pattern
+        return alias_root
+
+    def save(self, alias_file: Path):
+        '''Write the learned aliases to an XML file.
+        Arguments:
+            alias_file {Path} -- The full path to the alias file.
+        '''
+        alias_root = self.to_xml()
+        if hasattr(ET, 'indent'):
+            ET.indent(alias_root)
+        alias_tree = ET.ElementTree(alias_root)
+        alias_tree.write(str(alias_file), encoding='utf-8',
+                         xml_declaration=True)
+
+    @classmethod
+    def load(cls, alias_file: Path)->'LearnedAliases':
+        '''Read learned aliases from an XML file.
+        Arguments:
+            alias_file {Path} -- The full path to the alias file.
+        Returns:
+            LearnedAliases -- The learned aliases.  Empty if the file does
+                not exist or can not be read.
+        '''
+        learned = cls()
+        try:
+            alias_root = ET.parse(str(alias_file)).getroot()
+        except (OSError, ET.ParseError) as err:
+            LOGGER.debug('Learned aliases not loaded: %s', err)
+            return learned
+        for element in alias_root.findall('PlanElement'):
+            alias_index = (element.findtext('Type'),
+                           element.findtext('ReferenceName'),
+                           element.findtext('Laterality'))
+            counts = learned.setdefault(alias_index, dict())
+            for alias in element.findall('./Aliases/Alias'):
+                size = alias.attrib.get('Size', None)
+                if size:
+                    size = int(size)
+                counts[(alias.text, size)] = int(alias.attrib.get('Count', 1))
+        return learned
@@ -0,0 +1,327 @@
+'''Pass/fail constraints for report items with the Condition category.
+
+A Condition report item compares the value of another report item with a
+limit.  An optional warning level, on the passing side of the limit, gives
+a Warn status for values that pass the limit but fail the warning level.
+The limit and warning level can differ by the number of fractions.  The
+Limit outside any Tolerance element is required; it applies to every
+number of fractions without its own Tolerance entry:
+
+    <ReportItem name="V20_Lung_check">
+      <Category>Condition</Category>
+      <Condition>
+        <Item>V20_Lung</Item>
+        <Comparator>&lt;=</Comparator>
+        <Limit>10</Limit>
+        <Warning>8</Warning>
+        <Tolerance Fractions="8">
+          <Limit>12</Limit>
+        </Tolerance>
+      </Condition>
+    </ReportItem>
+
+All conditions of a report are evaluated together as arrays, and the same
+method accepts the values of many plans to evaluate a batch at once.
+'''
+
+#%% imports etc.
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import xml.etree.ElementTree as ET
+import logging
+import numpy as np
+
+
+LOGGER = logging.getLogger(__name__)
+
+COMPARATORS = {'<': np.less, '<=': np.less_equal,
+               '>': np.greater, '>=': np.greater_equal,
+               '==': np.equal, '!=': np.not_equal}
+# Comparator names that do not need to be escaped in XML.
+COMPARATOR_NAMES = {'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+                    'eq': '==', 'ne': '!='}
+# Status codes returned by ConditionSet.evaluate_batch, indexing
+# CONDITION_STATUS.  Code 0 is used when the item value is not a number.
+NOT_EVALUATED, PASS, WARN, FAIL = range(4)
+CONDITION_STATUS = (None, 'Pass', 'Warn', 'Fail')
+
+
+#%% Condition Definitions
+class Tolerance(NamedTuple):
+    '''The limits applied by a condition.
+    Attributes:
+        limit {float} -- Values failing the comparison with limit Fail.
+        warning {optional, float} -- Values passing the limit but failing
+            the comparison with warning get a Warn status.
+    '''
+    limit: float
+    warning: float = None
+
+
+class Constraint(NamedTuple):
+    '''The definition of a Condition report item.
+    Attributes:
+        item {str} -- The name of the report item being checked.
+        comparator {str} -- One of the COMPARATORS keys.  Values pass when
+            "value comparator limit" is true.
+        tolerances {Dict[Optional[int], Tolerance]} -- The limits, keyed by
+            number of fractions.  The None entry is always present and
+            applies to all other fractionations.
+    Methods
+        tolerance(fractions: int = None)->Tolerance
+            Return the limits for a number of fractions.
+    '''
+    item: str
+    comparator: str
+    tolerances: Dict[Optional[int], Tolerance]
+
+    def tolerance(self, fractions: int = None)->Tolerance:
+        '''Return the limits for a number of fractions.
+        Keyword Arguments:
+            fractions {int} -- The plan number of fractions. (default: {None})
+        Returns:
+            Tolerance -- The limits for the fractionation, or the default
+                limits if there is no specific entry.
+        '''
+        tolerance = self.tolerances.get(fractions)
+        if tolerance is None:
+            tolerance = self.tolerances.get(None)
+        return tolerance
+
+
+def load_tolerance(tolerance_def: ET.Element)->Tolerance:
+    '''Read the Limit and Warning levels from an XML element.
+    Arguments:
+        tolerance_def {ET.Element} -- A Condition or Tolerance element.
+    Raises:
+        ValueError -- If the Limit is missing or a level is not a number.
+    Returns:
+        Tolerance -- The limits, or None if the element has no Limit or
+            Warning.
+    '''
+    limit = tolerance_def.findtext('Limit')
+    warning = tolerance_def.findtext('Warning')
+    if limit is None and warning is None:
+        return None
+    if limit is None:
+        raise ValueError('Warning given without a Limit')
+    return Tolerance(float(limit), float(warning) if warning else None)
+
+
+def load_constraint(condition_def: ET.Element)->Constraint:
+    '''Read a Condition element.
+    Arguments:
+        condition_def {ET.Element} -- The Condition element of a report item.
+    Raises:
+        ValueError -- If the condition does not have an Item, has an unknown
+            Comparator, has no default Limit, or has missing or invalid
+            limits.
+    Returns:
+        Constraint -- The condition definition.
+    '''
+    item = (condition_def.findtext('Item') or '').strip()
+    if not item:
+        raise ValueError('Condition has no Item')
+    comparator = (condition_def.findtext('Comparator') or '').strip()
+    comparator = COMPARATOR_NAMES.get(comparator.lower(), comparator)
+    if comparator not in COMPARATORS:
+        raise ValueError('Unknown Condition Comparator "{}"'.format(
+            comparator))
+    tolerances = dict()
+    try:
+        tolerances[None] = load_tolerance(condition_def)
+        for tolerance_def in condition_def.findall('Tolerance'):
+            fractions = int(tolerance_def.attrib['Fractions'])
+            tolerances[fractions] = load_tolerance(tolerance_def)
+    except (KeyError, ValueError, TypeError) as err:
+        raise ValueError('Invalid Condition Limit: {}'.format(err)) from err
+    # The default limits are used for any number of fractions without a
+    # Tolerance entry, so they are required.
+    if tolerances[None] is None and len(tolerances) > 1:
+        raise ValueError('Condition has no default Limit')
+    if None in tolerances.values():
+        raise ValueError('Condition has no Limit')
+    return Constraint(item, comparator, tolerances)
+
+
+#%% Condition Results
+class ConditionResult(NamedTuple):
+    '''The outcome of one condition for one plan.
+    Attributes:
+        name {str} -- The name of the Condition report item.
+        item {str} -- The name of the report item checked.
+        value {Any} -- The value of the checked item.
+        comparator {str} -- The comparison used.
+        limit {float} -- The limit applied.
+        warning {float} -- The warning level applied, or None.
+        status {str} -- One of 'Pass', 'Warn', 'Fail', or None if the value
+            is missing or not a number.
+    '''
+    name: str
+    item: str
+    value: Any
+    comparator: str
+    limit: float
+    warning: float
+    status: str
+
+
+def as_number(value: Any)->float:
+    '''Convert a report item value for comparison.
+    Arguments:
+        value {Any} -- The report item value.
+    Returns:
+        float -- The value, with True and False as 1 and 0, or NaN if the
+            value is missing or not a number.
+    '''
+    if value is None or isinstance(value, str):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ConditionSet():
+    '''The Condition report items of one report, compiled for evaluation
+    as arrays.
+    Arguments:
+        constraints {Dict[str, Constraint]} -- The conditions, keyed by
+            Condition report item name.
+    Attributes:
+        names {List[str]} -- The Condition report item names, in column
+            order.
+        constraints {List[Constraint]} -- The matching condition
+            definitions.
+        limits {Dict[Optional[int], Tuple[np.array, np.array]]} -- The limit
+            and warning level columns, keyed by number of fractions.
+            Compiled the first time a fractionation is used.  Missing
+            warning levels are equal to the limit.
+    Methods
+        limit_columns(fractions: int = None)->Tuple[np.array, np.array]
+            Return the limit and warning level of each condition.
+        evaluate_batch(value_rows: Sequence[Dict[str, Any]],
+                       fractions: Sequence[int] = None)->np.array
+            Return the status code of every condition for each plan.
+        evaluate(values: Dict[str, Any],
+                 fractions: int = None)->Dict[str, ConditionResult]
+            Evaluate the conditions for one plan.
+    '''
+    def __init__(self, constraints: Dict[str, Constraint]):
+        '''Compile the conditions.
+        Arguments:
+            constraints {Dict[str, Constraint]} -- The conditions, keyed by
+                Condition report item name.
+        '''
+        self.names = list(constraints)
+        self.constraints = list(constraints.values())
+        self.limits = dict()
+        # Column indexes of the conditions using each comparator.
+        self.columns = dict()
+        for index, constraint in enumerate(self.constraints):
+            self.columns.setdefault(constraint.comparator, list()).append(
+                index)
+
+    def __len__(self)->int:
+        return len(self.names)
+
+    def limit_columns(self, fractions: int = None
+                      )->Tuple[np.array, np.array]:
+        '''Return the limit and warning level of each condition.
+        Keyword Arguments:
+            fractions {int} -- The plan number of fractions. (default: {None})
+        Returns:
+            Tuple[np.array, np.array] -- The limits and warning levels.
+        '''
+        columns = self.limits.get(fractions)
+        if columns is None:
+            tolerances = [constraint.tolerance(fractions)
+                          for constraint in self.constraints]
+            limits = np.array([tolerance.limit for tolerance in tolerances],
+                              dtype=float)
+            warnings = np.array([tolerance.limit if tolerance.warning is None
+                                 else tolerance.warning
+                                 for tolerance in tolerances], dtype=float)
+            columns = (limits, warnings)
+            self.limits[fractions] = columns
+        return columns
+
+    def evaluate_batch(self, value_rows: Sequence[Dict[str, Any]],
+                       fractions: Sequence[int] = None)->np.array:
+        '''Return the status code of every condition for each plan.
+        Arguments:
+            value_rows {Sequence[Dict[str, Any]]} -- The report item values
+                for each plan, keyed by report item name.
+        Keyword Arguments:
+            fractions {Sequence[int]} -- The number of fractions of each
+                plan.  If None the default limits are used for all plans.
+                (default: {None})
+        Returns:
+            np.array -- An (n_plans, n_conditions) array of status codes.
+                See CONDITION_STATUS.
+        '''
+        if fractions is None:
+            fractions = [None]*len(value_rows)
+        values = np.array([[as_number(row.get(constraint.item))
+                            for constraint in self.constraints]
+                           for row in value_rows],
+                          dtype=float).reshape(len(value_rows), len(self))
+        limit_rows = [self.limit_columns(plan_fractions)
+                      for plan_fractions in fractions]
+        limits = np.array([row[0] for row in limit_rows],
+                          dtype=float).reshape(values.shape)
+        warnings = np.array([row[1] for row in limit_rows],
+                            dtype=float).reshape(values.shape)
+        within_limit = np.zeros(values.shape, dtype=bool)
+        within_warning = np.zeros(values.shape, dtype=bool)
+        for comparator, columns in self.columns.items():
+            compare = COMPARATORS[comparator]
+            within_limit[:, columns] = compare(values[:, columns],
+                                               limits[:, columns])
+            within_warning[:, columns] = compare(values[:, columns],
+                                                 warnings[:, columns])
+        status = np.where(within_limit,
+                          np.where(within_warning, PASS, WARN), FAIL)
+        status[np.isnan(values)] = NOT_EVALUATED
+        return status
+
+    def evaluate(self, values: Dict[str, Any],
+                 fractions: int = None)->Dict[str, ConditionResult]:
+        '''Evaluate the conditions for one plan.
+        Arguments:
+            values {Dict[str, Any]} -- The report item values, keyed by
+                report item name.
+        Keyword Arguments:
+            fractions {int} -- The plan number of fractions. (default: {None})
+        Returns:
+            Dict[str, ConditionResult] -- The result of each condition, keyed
+                by Condition report item name.
+        '''
+        results = dict()
+        if not self.names:
+            return results
+        codes = self.evaluate_batch([values], [fractions])[0]
+        for name, constraint, code in zip(self.names, self.constraints,
+                                          codes):
+            tolerance = constraint.tolerance(fractions)
+            results[name] = ConditionResult(
+                name=name, item=constraint.item,
+                value=values.get(constraint.item),
+                comparator=constraint.comparator, limit=tolerance.limit,
+                warning=tolerance.warning, status=CONDITION_STATUS[code])
+        return results
+
+
+def failed_conditions(results: Dict[str, ConditionResult],
+                      include_warnings: bool = False)->List[ConditionResult]:
+    '''Select the conditions that did not pass.
+    Arguments:
+        results {Dict[str, ConditionResult]} -- The condition results.
+    Keyword Arguments:
+        include_warnings {bool} -- Include conditions with a Warn status.
+            (default: {False})
+    Returns:
+        List[ConditionResult] -- The failed conditions.
+    '''
+    flagged = ('Fail', 'Warn') if include_warnings else ('Fail',)
+    return [result for result in results.values()
+            if result.status in flagged]